@@ -0,0 +1,245 @@
+import math
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+
+import numpy as np
+from sqlalchemy import delete, insert, select
+
+import archive
+from database_manager import DatabaseManager
+from models_module import Plant, PlantStatistics, StrainStatistics
+from timeseries import MeasurementColumns, NutrientColumns
+
+HEIGHT_MILESTONES = (30, 60, 90, 120)
+ROLLING_WINDOW_DAYS = 7
+# Growth after a feeding is measured over this many days.
+RESPONSE_DAYS = 7
+MAX_PLANTS_PER_JOB = 500
+
+# Records are sorted by plant and day, so plant_id * DAY_SPAN + day is a
+# sorted key and a search for "day - window" never crosses into the
+# previous plant.
+DAY_SPAN = 10 ** 7
+
+_worker = {}
+
+def _plant_keys(columns):
+    return columns.plant_id * DAY_SPAN + columns.day
+
+def rolling_mean(columns, values, window=ROLLING_WINDOW_DAYS):
+    # Mean over the measurements in the trailing window of days, for every
+    # plant in the columns at once.
+    keys = _plant_keys(columns)
+    starts = np.searchsorted(keys, keys - window + 1, side='left')
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    rows = np.arange(1, len(values) + 1)
+    return (sums[rows] - sums[starts]) / (rows - starts)
+
+def smoothed_growth_rates(columns, window=ROLLING_WINDOW_DAYS):
+    # Slope of the rolling mean height over the previous window, in cm/day;
+    # NaN until a plant has measurements on two different days.
+    smoothed = rolling_mean(columns, columns.height, window)
+    keys = _plant_keys(columns)
+    previous = np.searchsorted(keys, keys - window, side='left')
+    days = columns.day - columns.day[previous]
+    rates = np.full(len(columns), np.nan)
+    np.divide(smoothed - smoothed[previous], days, out=rates, where=days > 0)
+    return smoothed, rates
+
+def _height_at(columns, keys, plant_ids, days):
+    # Index of each plant's last measurement on or before the given day,
+    # or -1 if it has none.
+    rows = np.searchsorted(keys, plant_ids * DAY_SPAN + days, side='right') - 1
+    valid = rows >= 0
+    valid[valid] &= columns.plant_id[rows[valid]] == plant_ids[valid]
+    return np.where(valid, rows, -1)
+
+def _correlation_sums(columns, nutrients):
+    # Pearson sums (n, x, y, xx, yy, xy) per plant for the total dose given on
+    # a day against the height growth rate over the following RESPONSE_DAYS.
+    # Sums can be added across plants, so strains are pooled exactly.
+    if not len(nutrients) or not len(columns):
+        return {}
+    feeding_keys, inverse = np.unique(_plant_keys(nutrients), return_inverse=True)
+    doses = np.bincount(inverse, weights=nutrients.amount)
+    plant_ids = feeding_keys // DAY_SPAN
+    days = feeding_keys % DAY_SPAN
+
+    keys = _plant_keys(columns)
+    before = _height_at(columns, keys, plant_ids, days)
+    after = _height_at(columns, keys, plant_ids, days + RESPONSE_DAYS)
+    valid = (before >= 0) & (after >= 0)
+    valid[valid] &= columns.day[after[valid]] > columns.day[before[valid]]
+    before, after = before[valid], after[valid]
+    x = doses[valid]
+    y = (columns.height[after] - columns.height[before]) / (columns.day[after] - columns.day[before])
+
+    owners, index = np.unique(plant_ids[valid], return_inverse=True)
+    sums = np.stack([
+        np.bincount(index, minlength=len(owners)).astype(float),
+        np.bincount(index, weights=x, minlength=len(owners)),
+        np.bincount(index, weights=y, minlength=len(owners)),
+        np.bincount(index, weights=x * x, minlength=len(owners)),
+        np.bincount(index, weights=y * y, minlength=len(owners)),
+        np.bincount(index, weights=x * y, minlength=len(owners)),
+    ], axis=1)
+    return {int(plant_id): row for plant_id, row in zip(owners, sums)}
+
+def correlation(sums):
+    n, x, y, xx, yy, xy = sums
+    denominator = (n * xx - x * x) * (n * yy - y * y)
+    if n < 3 or denominator <= 0:
+        return None
+    return float((n * xy - x * y) / math.sqrt(denominator))
+
+def plant_statistics(plants, columns, nutrients):
+    # plants is a list of (id, strain); columns and nutrients hold their
+    # records sorted by plant and day. Every statistic is computed for the
+    # whole partition with array operations, then split out per plant.
+    slices = columns.plant_slices()
+    nutrient_slices = nutrients.plant_slices()
+    smoothed, rates = smoothed_growth_rates(columns) if len(columns) else (np.empty(0), np.empty(0))
+    peak_rates = np.where(np.isnan(rates), -np.inf, rates)
+    correlation_sums = _correlation_sums(columns, nutrients)
+
+    rows = []
+    for plant_id, strain in plants:
+        row = {
+            'plant_id': plant_id, 'strain': strain, 'measurement_count': 0,
+            'nutrient_total': 0.0, 'feeding_count': 0, 'correlation_sums': correlation_sums.get(plant_id, np.zeros(6)),
+        }
+        nutrient_rows = nutrient_slices.get(plant_id)
+        if nutrient_rows is not None:
+            row['nutrient_total'] = float(nutrients.amount[nutrient_rows].sum())
+            row['feeding_count'] = len(np.unique(nutrients.day[nutrient_rows]))
+        row['nutrient_growth_correlation'] = correlation(row['correlation_sums'])
+
+        rows_slice = slices.get(plant_id)
+        if rows_slice is not None:
+            first, last = rows_slice.start, rows_slice.stop - 1
+            days = columns.day[rows_slice]
+            heights = columns.height[rows_slice]
+            peak = first + int(np.argmax(peak_rates[rows_slice]))
+            has_peak = not np.isnan(rates[peak])
+            span = int(days[-1] - days[0])
+            row.update({
+                'measurement_count': rows_slice.stop - rows_slice.start,
+                'first_date': date.fromordinal(int(days[0])),
+                'last_date': date.fromordinal(int(days[-1])),
+                'final_height': float(heights[-1]),
+                'rolling_height': float(smoothed[last]),
+                'mean_growth_rate': float((heights[-1] - heights[0]) / span) if span else None,
+                'peak_growth_rate': float(rates[peak]) if has_peak else None,
+                'peak_growth_date': date.fromordinal(int(columns.day[peak])) if has_peak else None,
+            })
+            for milestone in HEIGHT_MILESTONES:
+                reached = np.flatnonzero(heights >= milestone)
+                row[f"days_to_{milestone}cm"] = int(days[reached[0]] - days[0]) if len(reached) else None
+        rows.append(row)
+    return rows
+
+def _init_worker(database_uri):
+    _worker['db_manager'] = DatabaseManager(database_uri)
+
+def _analyze_job(job):
+    # Each worker reads its own partition straight into NumPy columns; no
+    # ORM objects are built.
+    db_manager = _worker['db_manager']
+    plant_ids = [plant_id for plant_id, _ in job['plants']]
+    with db_manager.create_session() as session:
+        columns = MeasurementColumns.load(session, plant_ids)
+        nutrients = NutrientColumns.load(session, plant_ids)
+        archived = archive.load_archived(session, plant_ids)
+    if archived:
+        columns = archive.merge_columns(columns, [parts[0] for parts in archived.values()])
+        nutrients = archive.merge_columns(nutrients, [parts[1] for parts in archived.values()])
+    return job, plant_statistics(job['plants'], columns, nutrients)
+
+def plan_jobs(session, strains=None, max_plants=MAX_PLANTS_PER_JOB):
+    # One job per strain, with large strains split so the pool stays busy;
+    # strain results are merged afterwards.
+    statement = select(Plant.id, Plant.strain).order_by(Plant.strain, Plant.id)
+    if strains:
+        statement = statement.where(Plant.strain.in_(strains))
+    by_strain = defaultdict(list)
+    for plant_id, strain in session.execute(statement):
+        by_strain[strain].append((plant_id, strain))
+
+    jobs = []
+    for strain, plants in by_strain.items():
+        for start in range(0, len(plants), max_plants):
+            jobs.append({'strain': strain, 'plants': plants[start:start + max_plants]})
+    return jobs
+
+def _median(values):
+    values = [value for value in values if value is not None]
+    return float(np.median(values)) if values else None
+
+def _mean(values):
+    values = [value for value in values if value is not None]
+    return float(np.mean(values)) if values else None
+
+def strain_statistics(strain, rows):
+    return {
+        'strain': strain,
+        'plant_count': len(rows),
+        'measurement_count': sum(row['measurement_count'] for row in rows),
+        'mean_final_height': _mean([row.get('final_height') for row in rows]),
+        'mean_growth_rate': _mean([row.get('mean_growth_rate') for row in rows]),
+        'mean_peak_growth_rate': _mean([row.get('peak_growth_rate') for row in rows]),
+        **{
+            f"median_days_to_{milestone}cm": _median([row.get(f"days_to_{milestone}cm") for row in rows])
+            for milestone in HEIGHT_MILESTONES
+        },
+        'feeding_count': sum(row['feeding_count'] for row in rows),
+        'nutrient_growth_correlation': correlation(sum(row['correlation_sums'] for row in rows)),
+    }
+
+def _save(session, plant_rows, strain_rows, strains, computed_at):
+    columns = set(PlantStatistics.__table__.columns.keys())
+    if strains:
+        session.execute(delete(PlantStatistics).where(PlantStatistics.strain.in_(strains)))
+        session.execute(delete(StrainStatistics).where(StrainStatistics.strain.in_(strains)))
+    else:
+        session.execute(delete(PlantStatistics))
+        session.execute(delete(StrainStatistics))
+    if plant_rows:
+        session.execute(insert(PlantStatistics), [
+            dict({key: row.get(key) for key in columns}, computed_at=computed_at)
+            for row in plant_rows
+        ])
+    if strain_rows:
+        session.execute(insert(StrainStatistics), [dict(row, computed_at=computed_at) for row in strain_rows])
+    session.commit()
+
+def compute_statistics(database_uri, workers=None, strains=None, max_plants=MAX_PLANTS_PER_JOB):
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    db_manager = DatabaseManager(database_uri)
+    with db_manager.create_session() as session:
+        jobs = plan_jobs(session, strains, max_plants)
+
+    by_strain = defaultdict(list)
+    if workers == 1 or len(jobs) <= 1:
+        _worker['db_manager'] = db_manager
+        for job in jobs:
+            job, rows = _analyze_job(job)
+            by_strain[job['strain']].extend(rows)
+    elif jobs:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), initializer=_init_worker, initargs=(database_uri,)) as pool:
+            for future in as_completed([pool.submit(_analyze_job, job) for job in jobs]):
+                job, rows = future.result()
+                by_strain[job['strain']].extend(rows)
+
+    plant_rows = [row for rows in by_strain.values() for row in rows]
+    strain_rows = [strain_statistics(strain, rows) for strain, rows in sorted(by_strain.items())]
+    with db_manager.create_session() as session:
+        _save(session, plant_rows, strain_rows, strains, datetime.now())
+    db_manager.engine.dispose()
+
+    print(f"Computed statistics for {len(plant_rows):,} plants in {len(strain_rows):,} strains in "
+          f"{time.perf_counter() - started:.1f} s using {min(workers, max(len(jobs), 1))} workers.")
+    return strain_rows
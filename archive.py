@@ -0,0 +1,256 @@
+import heapq
+import os
+import time
+from datetime import date, datetime, timedelta
+from operator import itemgetter
+
+import numpy as np
+from sqlalchemy import delete, func, select, text
+
+from models_module import ArchivedPlant, Comment, Measurement, Nutrient, NutrientType, Plant
+from timeseries import METRICS, MEASUREMENT_DTYPE, NUTRIENT_DTYPE, MeasurementColumns, NutrientColumns, day_ordinal
+
+SNAPSHOT_VERSION = 1
+DEFAULT_INACTIVE_DAYS = 90
+
+def default_directory(database_uri):
+    # <name>.db -> <name>_archive next to it.
+    path = database_uri.split('///', 1)[-1].split('?', 1)[0]
+    if not path or path == ':memory:':
+        raise ValueError("An in-memory database needs an explicit archive directory")
+    return f"{os.path.splitext(os.path.abspath(path))[0]}_archive"
+
+def _narrow(values):
+    # The smallest type that holds every value exactly: float32 when no
+    # reading loses precision, int16/int32 when the range fits.
+    if values.dtype.kind == 'f':
+        narrow = values.astype(np.float32)
+        return narrow if np.array_equal(narrow.astype(values.dtype), values) else values
+    for dtype in (np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if not len(values) or (values.min() >= info.min and values.max() <= info.max):
+            return values.astype(dtype)
+    return values
+
+def _columns(session, statement):
+    rows = session.execute(statement).all()
+    return [np.array(values) for values in zip(*rows)] if rows else None
+
+def _snapshot(session, plant):
+    arrays = {'version': np.array(SNAPSHOT_VERSION), 'plant': np.array([plant.name, plant.strain])}
+    for prefix, model, fields in (
+        ('measurement', Measurement, ('height', 'leaf_count', 'stem_diameter')),
+        ('nutrient', Nutrient, ('nutrient_type_id', 'amount')),
+        ('comment', Comment, ('content',)),
+    ):
+        statement = (
+            select(model.id, day_ordinal(model.date), *[getattr(model, field) for field in fields])
+            .where(model.plant_id == plant.id)
+            .order_by(model.date, model.id)
+        )
+        columns = _columns(session, statement)
+        names = ['id', 'day', *fields]
+        for name, values in zip(names, columns or [np.empty(0, dtype=np.int64)] * len(names)):
+            if name == 'content':
+                values = values.astype(str)
+            elif name in ('height', 'stem_diameter', 'amount'):
+                values = _narrow(values.astype(np.float64))
+            else:
+                values = _narrow(values.astype(np.int64))
+            arrays[f"{prefix}_{name}"] = values
+
+    type_ids = np.unique(arrays['nutrient_nutrient_type_id'])
+    names = dict(session.execute(select(NutrientType.id, NutrientType.name).where(NutrientType.id.in_(type_ids.tolist()))).all())
+    arrays['nutrient_type_ids'] = type_ids
+    arrays['nutrient_type_names'] = np.array([names[int(type_id)] for type_id in type_ids], dtype=str)
+    return arrays
+
+def _write(path, arrays):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def inactive_plants(session, inactive_days=DEFAULT_INACTIVE_DAYS, today=None):
+    # A grow counts as finished when nothing has been recorded for it in
+    # inactive_days; plants without any records are left alone.
+    cutoff = (today or date.today()) - timedelta(days=inactive_days)
+    latest = {}
+    for model in (Measurement, Nutrient, Comment):
+        for plant_id, last in session.execute(select(model.plant_id, func.max(model.date)).group_by(model.plant_id)):
+            latest[plant_id] = max(latest.get(plant_id, last), last)
+    archived = set(session.scalars(select(ArchivedPlant.plant_id)))
+    return sorted(plant_id for plant_id, last in latest.items() if last < cutoff and plant_id not in archived)
+
+def archive_plants(session, plant_ids, directory):
+    # The snapshot is written and synced before the rows are deleted, so an
+    # interrupted run leaves at most an orphaned file, never lost records.
+    # Rollups and statistics are small and stay behind, so weekly and daily
+    # views of an archived plant still come straight from the database.
+    archived = []
+    for plant_id in plant_ids:
+        plant = session.get(Plant, plant_id)
+        if plant is None:
+            raise ValueError(f"No plant with id {plant_id}")
+        if session.get(ArchivedPlant, plant_id) is not None:
+            raise ValueError(f"Plant {plant_id} is already archived")
+
+        arrays = _snapshot(session, plant)
+        path = os.path.join(os.path.abspath(directory), f"plant-{plant_id}.npz")
+        _write(path, arrays)
+        days = np.concatenate([arrays['measurement_day'], arrays['nutrient_day'], arrays['comment_day']])
+        summary = {
+            'plant_id': plant_id, 'path': path, 'archived_at': datetime.now(),
+            'measurement_count': len(arrays['measurement_id']),
+            'nutrient_count': len(arrays['nutrient_id']),
+            'comment_count': len(arrays['comment_id']),
+            'first_date': date.fromordinal(int(days.min())) if len(days) else None,
+            'last_date': date.fromordinal(int(days.max())) if len(days) else None,
+            'file_bytes': os.path.getsize(path),
+        }
+        for model in (Measurement, Nutrient, Comment):
+            session.execute(delete(model).where(model.plant_id == plant_id))
+        session.add(ArchivedPlant(**summary))
+        session.commit()
+        archived.append(summary)
+    return archived
+
+def restore_plant(session, plant_id):
+    entry = session.get(ArchivedPlant, plant_id)
+    if entry is None:
+        raise ValueError(f"Plant {plant_id} is not archived")
+    path = entry.path
+    arrays = load_snapshot(path)
+
+    measurements = [
+        {'id': int(record_id), 'plant_id': plant_id, 'date': date.fromordinal(int(day)), 'height': float(height),
+         'leaf_count': int(leaf_count), 'stem_diameter': float(stem_diameter)}
+        for record_id, day, height, leaf_count, stem_diameter in zip(
+            arrays['measurement_id'], arrays['measurement_day'], arrays['measurement_height'],
+            arrays['measurement_leaf_count'], arrays['measurement_stem_diameter'])
+    ]
+    nutrients = [
+        {'id': int(record_id), 'plant_id': plant_id, 'date': date.fromordinal(int(day)),
+         'nutrient_type_id': int(type_id), 'amount': float(amount)}
+        for record_id, day, type_id, amount in zip(
+            arrays['nutrient_id'], arrays['nutrient_day'], arrays['nutrient_nutrient_type_id'], arrays['nutrient_amount'])
+    ]
+    comments = [
+        {'id': int(record_id), 'plant_id': plant_id, 'date': date.fromordinal(int(day)), 'content': str(content)}
+        for record_id, day, content in zip(arrays['comment_id'], arrays['comment_day'], arrays['comment_content'])
+    ]
+    # Rows go back in with their original ids: the tables use AUTOINCREMENT,
+    # so those ids are never handed out again, and exports, the dashboard
+    # and render fingerprints that track the highest id seen stay valid. The
+    # triggers rebuild the growth rates and the comment search index.
+    for model, rows in ((Measurement, measurements), (Nutrient, nutrients), (Comment, comments)):
+        if rows:
+            ids = {row['id'] for row in rows}
+            taken = len(ids.intersection(session.scalars(select(model.id).where(model.id.between(min(ids), max(ids))))))
+            if taken:
+                raise ValueError(f"{taken:,} of plant {plant_id}'s archived {model.__tablename__} ids are in use again; not restoring")
+    for model, rows in ((Measurement, measurements), (Nutrient, nutrients), (Comment, comments)):
+        if rows:
+            session.execute(model.__table__.insert(), rows)
+    session.delete(entry)
+    session.commit()
+    os.remove(path)
+    return len(measurements), len(nutrients), len(comments)
+
+def vacuum(engine):
+    # Deleted rows only leave free pages behind; VACUUM rewrites the file so
+    # it actually shrinks.
+    with engine.connect() as connection:
+        connection.execution_options(isolation_level='AUTOCOMMIT').execute(text("VACUUM"))
+
+def load_snapshot(path):
+    with np.load(path) as snapshot:
+        arrays = {name: snapshot[name] for name in snapshot.files}
+    if int(arrays['version']) > SNAPSHOT_VERSION:
+        raise ValueError(f"{path} was written by a newer version of the application")
+    return arrays
+
+def snapshot_rows(snapshot, kind, fields, since=None, until=None):
+    # (date, *fields) for each of a snapshot's records of one kind
+    # ('measurement', 'nutrient' or 'comment') between since and until, in
+    # the (date, id) order they were written in.
+    first = since.toordinal() if since else 1
+    last = until.toordinal() if until else date.max.toordinal()
+    for day, *values in zip(snapshot[f"{kind}_day"].tolist(), *[snapshot[f"{kind}_{field}"].tolist() for field in fields]):
+        if first <= day <= last:
+            yield (date.fromordinal(day), *values)
+
+def nutrient_type_names(snapshot):
+    return dict(zip(snapshot['nutrient_type_ids'].tolist(), snapshot['nutrient_type_names'].tolist()))
+
+def merge_records(path, measurements, nutrients, comments, since=None, until=None):
+    # A plant's archived records merged in date order with whatever was
+    # recorded for it afterwards, as (date, height, leaf_count,
+    # stem_diameter), (date, nutrient type, amount) and (date, content) rows.
+    # On the same day the archived ones come first, as they are older.
+    snapshot = load_snapshot(path)
+    names = nutrient_type_names(snapshot)
+    archived_nutrients = (
+        (day, names[nutrient_type_id], amount)
+        for day, nutrient_type_id, amount in snapshot_rows(snapshot, 'nutrient', ('nutrient_type_id', 'amount'), since, until)
+    )
+    return (
+        heapq.merge(
+            snapshot_rows(snapshot, 'measurement', METRICS, since, until),
+            ((m.date, m.height, m.leaf_count, m.stem_diameter) for m in measurements), key=itemgetter(0)),
+        heapq.merge(archived_nutrients, ((n.date, n.nutrient_type.name, n.amount) for n in nutrients), key=itemgetter(0)),
+        heapq.merge(snapshot_rows(snapshot, 'comment', ('content',), since, until), ((c.date, c.content) for c in comments), key=itemgetter(0)),
+    )
+
+def load_columns(path, plant_id):
+    # Snapshot arrays widened back to the dtypes every other history uses.
+    arrays = load_snapshot(path)
+    measurements = np.empty(len(arrays['measurement_id']), dtype=MEASUREMENT_DTYPE)
+    measurements['plant_id'] = plant_id
+    measurements['day'] = arrays['measurement_day']
+    for metric in ('height', 'leaf_count', 'stem_diameter'):
+        measurements[metric] = arrays[f"measurement_{metric}"]
+
+    nutrients = np.empty(len(arrays['nutrient_id']), dtype=NUTRIENT_DTYPE)
+    nutrients['plant_id'] = plant_id
+    nutrients['day'] = arrays['nutrient_day']
+    nutrients['nutrient_type_id'] = arrays['nutrient_nutrient_type_id']
+    nutrients['amount'] = arrays['nutrient_amount']
+
+    return MeasurementColumns(measurements), NutrientColumns(nutrients), nutrient_type_names(arrays)
+
+def merge_columns(columns, parts):
+    # Snapshot rows go in ahead of the live ones (their ids are older) and
+    # everything is put back in (plant_id, day) order; lexsort is stable, so
+    # rows recorded on the same day keep that order.
+    merged = type(columns).concatenate([*parts, columns])
+    return merged.take(np.lexsort((merged.day, merged.plant_id)))
+
+def archived_paths(session, plant_ids=None):
+    # One row per archived plant, so the whole table is read rather than
+    # chunking an IN list.
+    paths = dict(session.execute(select(ArchivedPlant.plant_id, ArchivedPlant.path)).all())
+    if plant_ids is None:
+        return paths
+    return {plant_id: paths[plant_id] for plant_id in plant_ids if plant_id in paths}
+
+def load_archived(session, plant_ids):
+    # {plant_id: (measurements, nutrients, nutrient_type_names)} for the
+    # given plants that have been archived; live plants are left out.
+    return {plant_id: load_columns(path, plant_id) for plant_id, path in archived_paths(session, plant_ids).items()}
+
+def run(db_manager, plant_ids=None, inactive_days=DEFAULT_INACTIVE_DAYS, directory=None, compact=True):
+    directory = directory or default_directory(db_manager.database_uri)
+    started = time.perf_counter()
+    with db_manager.create_session() as session:
+        if plant_ids is None:
+            plant_ids = inactive_plants(session, inactive_days)
+        archived = archive_plants(session, plant_ids, directory)
+    if db_manager._history_cache is not None:
+        db_manager._history_cache.invalidate(plant_ids)
+    if archived and compact:
+        vacuum(db_manager.engine)
+    return archived, time.perf_counter() - started
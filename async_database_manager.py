@@ -0,0 +1,209 @@
+import asyncio
+import time
+from collections import defaultdict
+
+from sqlalchemy import event, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import joinedload
+
+import migrations
+import rollups
+import storage
+from connection_profiles import POOL_OPTIONS, apply_pragmas, resolve
+from models_module import Base, Plant, Measurement, NutrientType, Nutrient, Comment
+
+DEFAULT_MAX_BATCH = 1000
+
+# Rollup maintenance for each table, run in the same transaction as the insert.
+ROLLUPS = {
+    Measurement.__table__: rollups.add_measurements,
+    Nutrient.__table__: rollups.add_nutrients,
+}
+
+class WriteRequest:
+    def __init__(self, model, values):
+        self.model = model
+        self.values = values
+        self.future = asyncio.get_running_loop().create_future()
+
+class WriterStats:
+    def __init__(self):
+        self.rows = 0
+        self.commits = 0
+        self.errors = 0
+        self.busy = 0.0
+
+    def __repr__(self):
+        return f"<WriterStats(rows='{self.rows}', commits='{self.commits}', errors='{self.errors}', rows_per_commit='{self.rows_per_commit:.1f}')>"
+
+    @property
+    def rows_per_commit(self):
+        return self.rows / self.commits if self.commits else 0.0
+
+class AsyncDatabaseManager:
+    def __init__(self, database_uri, profile=None, max_batch=DEFAULT_MAX_BATCH):
+        url, self.profile, pragmas = resolve(database_uri, profile)
+        if url.get_backend_name() != 'sqlite':
+            raise ValueError("AsyncDatabaseManager only supports SQLite databases.")
+        options = dict(POOL_OPTIONS) if url.database not in (None, '', ':memory:') else {}
+        self.database_uri = database_uri
+        self.engine = create_async_engine(url.set(drivername='sqlite+aiosqlite'), **options)
+        storage.watch(self.engine.sync_engine)
+        if pragmas:
+            event.listen(self.engine.sync_engine, 'connect', lambda dbapi_connection, connection_record: apply_pragmas(dbapi_connection, pragmas))
+        self.Session = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.max_batch = max_batch
+        self.stats = WriterStats()
+        self._queue = None
+        self._writer = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def start(self):
+        async with self.engine.begin() as connection:
+            await connection.run_sync(migrations.apply, Base.metadata)
+        self._queue = asyncio.Queue()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def close(self):
+        if self._writer is not None:
+            await self._queue.put(None)
+            await self._writer
+            self._writer = None
+        await self.engine.dispose()
+
+    def create_session(self):
+        return self.Session()
+
+    async def add_plant(self, name, strain):
+        return await self._write(Plant, {'name': name, 'strain': strain})
+
+    async def add_nutrient_type(self, name, description=None):
+        return await self._write(NutrientType, {'name': name, 'description': description})
+
+    async def add_measurement(self, plant_id, date, height, leaf_count, stem_diameter):
+        return await self._write(Measurement, {
+            'plant_id': plant_id, 'date': date, 'height': height, 'leaf_count': leaf_count, 'stem_diameter': stem_diameter,
+        })
+
+    async def add_nutrient(self, plant_id, nutrient_type_id, date, amount):
+        return await self._write(Nutrient, {'plant_id': plant_id, 'nutrient_type_id': nutrient_type_id, 'date': date, 'amount': amount})
+
+    async def add_comment(self, plant_id, date, content):
+        return await self._write(Comment, {'plant_id': plant_id, 'date': date, 'content': content})
+
+    async def get_plant(self, plant_id):
+        async with self.Session() as session:
+            return await session.get(Plant, plant_id)
+
+    async def get_all_plants(self):
+        async with self.Session() as session:
+            return (await session.scalars(select(Plant).order_by(Plant.id))).all()
+
+    async def get_all_nutrient_types(self):
+        async with self.Session() as session:
+            return (await session.scalars(select(NutrientType).order_by(NutrientType.id))).all()
+
+    async def get_measurements(self, plant_id, since=None, until=None):
+        return await self._get_records(Measurement, plant_id, since, until)
+
+    async def get_nutrients(self, plant_id, since=None, until=None):
+        return await self._get_records(Nutrient, plant_id, since, until, joinedload(Nutrient.nutrient_type))
+
+    async def get_comments(self, plant_id, since=None, until=None):
+        return await self._get_records(Comment, plant_id, since, until)
+
+    async def _get_records(self, model, plant_id, since, until, *options):
+        statement = select(model).options(*options).where(model.plant_id == plant_id).order_by(model.date, model.id)
+        if since is not None:
+            statement = statement.where(model.date >= since)
+        if until is not None:
+            statement = statement.where(model.date <= until)
+        async with self.Session() as session:
+            return (await session.scalars(statement)).all()
+
+    async def _write(self, model, values):
+        if self._writer is None:
+            raise RuntimeError("AsyncDatabaseManager.start() must be awaited before writing.")
+        request = WriteRequest(model, values)
+        await self._queue.put(request)
+        return await request.future
+
+    async def _write_loop(self):
+        # The only task that writes. Whatever queued up while the previous
+        # commit was running goes into the next one, so the batch size
+        # grows with the load and there is never more than one writer
+        # waiting on SQLite's lock.
+        stopping = False
+        while not stopping:
+            request = await self._queue.get()
+            if request is None:
+                break
+            batch = [request]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                request = self._queue.get_nowait()
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+            await self._commit(batch)
+
+    async def _commit(self, batch):
+        started = time.perf_counter()
+        async with self.Session() as session:
+            try:
+                results = await self._insert(session, batch)
+                await session.commit()
+                self.stats.commits += 1
+            except IntegrityError:
+                # Isolate the offending requests instead of failing the batch.
+                await session.rollback()
+                results = []
+                for request in batch:
+                    try:
+                        results.extend(await self._insert(session, [request]))
+                        await session.commit()
+                        self.stats.commits += 1
+                    except Exception as e:
+                        # Any failure only fails its own request; letting
+                        # it escape would stop the writer and strand every
+                        # queued future.
+                        await session.rollback()
+                        self.stats.errors += 1
+                        if not request.future.done():
+                            request.future.set_exception(e)
+            except Exception as e:
+                await session.rollback()
+                self.stats.errors += len(batch)
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                results = []
+
+        for request, row_id in results:
+            # A producer that gave up waiting has cancelled its future.
+            if not request.future.done():
+                request.future.set_result(request.model(id=row_id, **request.values))
+        self.stats.rows += len(results)
+        self.stats.busy += time.perf_counter() - started
+
+    async def _insert(self, session, batch):
+        groups = defaultdict(list)
+        for request in batch:
+            groups[request.model.__table__].append(request)
+
+        results = []
+        for table, requests in groups.items():
+            rows = await session.run_sync(storage.assign_ids, table, [request.values for request in requests])
+            statement = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+            row_ids = (await session.execute(statement, rows)).scalars().all()
+            if table in ROLLUPS:
+                await session.run_sync(ROLLUPS[table], rows)
+            results.extend(zip(requests, row_ids))
+        return results
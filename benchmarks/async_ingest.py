@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+from async_database_manager import AsyncDatabaseManager, DEFAULT_MAX_BATCH
+from connection_profiles import PROFILES
+
+# Run from the repository root:
+#   python -m benchmarks.async_ingest --producers 50 --seconds 20
+
+async def producer(db_manager, plant_ids, seconds, interval, seed, latencies):
+    # One simulated sensor gateway: sends a reading, waits for it to be
+    # committed, then sleeps for the rest of its reporting interval.
+    rng = random.Random(seed)
+    deadline = time.perf_counter() + seconds
+    day = date.today()
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        await db_manager.add_measurement(
+            rng.choice(plant_ids), day - timedelta(days=rng.randrange(30)),
+            rng.uniform(1, 200), rng.randrange(200), rng.uniform(1, 30),
+        )
+        latency = time.perf_counter() - started
+        latencies.append(latency)
+        if interval > latency:
+            await asyncio.sleep(interval - latency)
+
+async def run(path, args):
+    async with AsyncDatabaseManager(f"sqlite:///{path}", profile=args.profile, max_batch=args.max_batch) as db_manager:
+        plant_ids = [(await db_manager.add_plant(f"Plant {index}", 'Hybrid')).id for index in range(args.plants)]
+        latencies = []
+        commits, rows = db_manager.stats.commits, db_manager.stats.rows
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            producer(db_manager, plant_ids, args.seconds, args.interval, args.seed + index, latencies)
+            for index in range(args.producers)
+        ))
+        elapsed = time.perf_counter() - started
+        commits, rows = db_manager.stats.commits - commits, db_manager.stats.rows - rows
+
+    latencies = np.array(latencies) * 1000
+    print(f"{args.producers} producers, {args.seconds:g} s, profile {args.profile or 'default'}")
+    print(f"  inserts:     {len(latencies):,} ({len(latencies) / elapsed:,.0f}/s sustained)")
+    print(f"  commits:     {commits:,} ({rows / commits if commits else 0:.1f} rows per commit)")
+    print(f"  latency ms:  p50 {np.percentile(latencies, 50):.2f}, p95 {np.percentile(latencies, 95):.2f}, p99 {np.percentile(latencies, 99):.2f}, max {latencies.max():.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the asynchronous single-writer ingestion path")
+    parser.add_argument("--producers", type=int, default=50, help="Concurrent simulated sensor gateways")
+    parser.add_argument("--seconds", type=float, default=10, help="Test duration")
+    parser.add_argument("--interval", type=float, default=0, help="Seconds between readings per producer (default: as fast as possible)")
+    parser.add_argument("--plants", type=int, default=100, help="Plants to spread readings across")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH, help="Most writes coalesced into one commit")
+    parser.add_argument("--profile", choices=list(PROFILES), help="SQLite connection profile")
+    parser.add_argument("--database", help="Database file to write to (default: a temporary file)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    directory = None
+    path = args.database
+    if path is None:
+        directory = tempfile.mkdtemp(prefix="botanylog-bench-")
+        path = os.path.join(directory, "ingest.db")
+    try:
+        asyncio.run(run(path, args))
+    finally:
+        if directory:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
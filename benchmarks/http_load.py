@@ -0,0 +1,96 @@
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+
+import numpy as np
+
+# Start the service, then run from the repository root:
+#   python user_interface_module.py serve
+#   python -m benchmarks.http_load --threads 16 --seconds 20 --write-ratio 0.1
+
+READ_PATHS = ('measurements', 'nutrients', 'growth-rates', 'comments')
+
+def worker(url, plant_ids, args, seed, stop, results):
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+    etags = {}
+    latencies = results['latencies']
+    statuses = results['statuses']
+    while not stop.is_set():
+        plant_id = rng.choice(plant_ids)
+        headers = {}
+        if rng.random() < args.write_ratio:
+            method, path = 'POST', '/measurements'
+            body = json.dumps({
+                'plant_id': plant_id, 'date': (date.today() - timedelta(days=rng.randrange(30))).isoformat(),
+                'height': rng.uniform(1, 200), 'leaf_count': rng.randrange(200), 'stem_diameter': rng.uniform(1, 30),
+            })
+            headers['Content-Type'] = 'application/json'
+        else:
+            method, body = 'GET', None
+            path = f"/plants/{plant_id}/{rng.choice(READ_PATHS)}"
+            if args.since_days:
+                path += f"?since={(date.today() - timedelta(days=args.since_days)).isoformat()}"
+            if args.revalidate and path in etags:
+                headers['If-None-Match'] = etags[path]
+
+        started = time.perf_counter()
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - started)
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+        if method == 'GET' and response.getheader('ETag'):
+            etags[path] = response.getheader('ETag')
+    connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the plant HTTP service")
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="Service address")
+    parser.add_argument("--threads", type=int, default=8, help="Concurrent client connections")
+    parser.add_argument("--seconds", type=float, default=10, help="Test duration")
+    parser.add_argument("--write-ratio", type=float, default=0.0, help="Fraction of requests that post a measurement")
+    parser.add_argument("--since-days", type=int, help="Add a since= filter covering this many days to reads")
+    parser.add_argument("--revalidate", action="store_true", help="Send If-None-Match with the last ETag seen for a path")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+    connection.request('GET', '/plants')
+    plant_ids = [plant['id'] for plant in json.loads(connection.getresponse().read())]
+    connection.close()
+    if not plant_ids:
+        parser.error("the service has no plants to query")
+
+    stop = threading.Event()
+    results = [{'latencies': [], 'statuses': {}} for _ in range(args.threads)]
+    threads = [
+        threading.Thread(target=worker, args=(url, plant_ids, args, args.seed + index, stop, results[index]))
+        for index in range(args.threads)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = np.array([latency for result in results for latency in result['latencies']]) * 1000
+    statuses = {}
+    for result in results:
+        for status, count in result['statuses'].items():
+            statuses[status] = statuses.get(status, 0) + count
+    print(f"{len(latencies):,} requests from {args.threads} connections in {elapsed:.1f} s: {len(latencies) / elapsed:,.0f} requests/s")
+    print("  status:     " + ", ".join(f"{status} x {count:,}" for status, count in sorted(statuses.items())))
+    print(f"  latency ms: p50 {np.percentile(latencies, 50):.2f}, p95 {np.percentile(latencies, 95):.2f}, p99 {np.percentile(latencies, 99):.2f}, max {latencies.max():.2f}")
+
+if __name__ == "__main__":
+    main()
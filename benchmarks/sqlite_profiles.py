@@ -0,0 +1,132 @@
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date
+
+from sqlalchemy import text
+
+from benchmarks.synthetic import GrowDataSpec, generate
+from connection_profiles import PROFILES, read_pragmas
+from database_manager import DatabaseManager
+from timeseries import MeasurementColumns
+
+# Run from the repository root:
+#   python -m benchmarks.sqlite_profiles --rows 10000000
+
+def single_commits(db_manager, plant_ids, count, rng):
+    with db_manager.create_session() as session:
+        plants = db_manager.get_plants(session, rng.sample(plant_ids, min(len(plant_ids), 50)))
+        started = time.perf_counter()
+        for _ in range(count):
+            db_manager.add_measurement(session, rng.choice(plants), date.today(), 10.0, 5, 1.0)
+        return count / (time.perf_counter() - started)
+
+def bulk_insert(db_manager, plant_ids, count, rng):
+    rows = [(rng.choice(plant_ids), date.today(), 10.0, 5, 1.0) for _ in range(count)]
+    with db_manager.create_session() as session:
+        return db_manager.add_measurements_bulk(session, rows).rows_per_second
+
+def mixed_load(db_manager, plant_ids, threads, seconds, seed):
+    # Readers load whole plant histories while one writer keeps committing
+    # single measurements, the way the dashboard and the menu share the file.
+    stop = threading.Event()
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def count(key):
+        with lock:
+            counts[key] += 1
+
+    def reader(worker):
+        rng = random.Random(seed + worker)
+        while not stop.is_set():
+            try:
+                with db_manager.create_session() as session:
+                    MeasurementColumns.load(session, [rng.choice(plant_ids)])
+                count('reads')
+            except Exception:
+                count('errors')
+
+    def writer():
+        rng = random.Random(seed)
+        with db_manager.create_session() as session:
+            plants = db_manager.get_plants(session, rng.sample(plant_ids, min(len(plant_ids), 50)))
+            while not stop.is_set():
+                try:
+                    db_manager.add_measurement(session, rng.choice(plants), date.today(), 10.0, 5, 1.0)
+                    count('writes')
+                except Exception:
+                    session.rollback()
+                    count('errors')
+
+    workers = [threading.Thread(target=reader, args=(worker,)) for worker in range(threads)]
+    workers.append(threading.Thread(target=writer))
+    for worker in workers:
+        worker.start()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    return counts['reads'] / seconds, counts['writes'] / seconds, counts['errors']
+
+def run_profile(source, directory, profile, args):
+    path = os.path.join(directory, f"{profile}.db")
+    shutil.copyfile(source, path)
+    rng = random.Random(args.seed)
+    db_manager = DatabaseManager(f"sqlite:///{path}", profile=profile)
+    with db_manager.engine.connect() as connection:
+        pragmas = read_pragmas(connection)
+        plant_ids = list(connection.scalars(text("SELECT id FROM plants")))
+    print(f"\n{profile}: " + ", ".join(f"{name}={value}" for name, value in pragmas.items()))
+
+    results = {}
+    results['single commits/s'] = single_commits(db_manager, plant_ids, args.commits, rng)
+    results['bulk rows/s'] = bulk_insert(db_manager, plant_ids, args.bulk_rows, rng)
+    reads, writes, errors = mixed_load(db_manager, plant_ids, args.threads, args.seconds, args.seed)
+    results['mixed reads/s'] = reads
+    results['mixed writes/s'] = writes
+    results['mixed errors'] = errors
+    for label, value in results.items():
+        print(f"  {label:>16}: {value:,.0f}")
+    db_manager.engine.dispose()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare read and write throughput of the SQLite connection profiles")
+    parser.add_argument("--rows", type=int, default=10000000, help="Measurements in the synthetic database (default: 10,000,000)")
+    parser.add_argument("--plants", type=int, default=1000, help="Plants in the synthetic database")
+    parser.add_argument("--commits", type=int, default=500, help="Single-measurement transactions to time")
+    parser.add_argument("--bulk-rows", type=int, default=100000, help="Rows for the bulk insert test")
+    parser.add_argument("--threads", type=int, default=4, help="Reader threads in the mixed test")
+    parser.add_argument("--seconds", type=float, default=10, help="Duration of the mixed test")
+    parser.add_argument("--profile", action="append", choices=list(PROFILES), help="Profile to test, may be repeated (default: all)")
+    parser.add_argument("--directory", help="Scratch directory (default: a temporary directory)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    directory = args.directory or tempfile.mkdtemp(prefix="botanylog-bench-")
+    os.makedirs(directory, exist_ok=True)
+    source = os.path.join(directory, "source.db")
+    try:
+        # Measurements only, split evenly over the plants; the profiles are
+        # compared on the measurement table alone.
+        spec = GrowDataSpec(args.plants, -(-args.rows // args.plants), nutrient_types=0, comment_rate=0, seed=args.seed)
+        started = time.perf_counter()
+        counts = generate(source, spec)
+        print(f"Generated {counts['measurement']:,} measurements for {args.plants:,} plants in {time.perf_counter() - started:.1f} s")
+        results = {profile: run_profile(source, directory, profile, args) for profile in args.profile or PROFILES}
+    finally:
+        if not args.directory:
+            shutil.rmtree(directory)
+
+    labels = list(next(iter(results.values())))
+    print("\n" + f"{'':>16}" + "".join(f"{profile:>14}" for profile in results))
+    for label in labels:
+        print(f"{label:>16}" + "".join(f"{values[label]:>14,.0f}" for values in results.values()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Run from the repository root; point --repo at another checkout (for
+# example a `git worktree` of an older commit) to compare the two:
+#   python -m benchmarks.startup --runs 20
+
+PROMPT = b"Enter your choice"
+EXIT_CHOICE = b"7\n"
+
+def time_to_prompt(repo, database_uri, timeout):
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(repo, 'user_interface_module.py'), '--database', database_uri],
+        cwd=repo, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    output = b""
+    try:
+        while PROMPT not in output:
+            chunk = os.read(process.stdout.fileno(), 4096)
+            if not chunk:
+                raise RuntimeError(f"Exited before the first prompt: {process.stderr.read().decode(errors='replace')}")
+            output += chunk
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError("Timed out waiting for the first prompt")
+        elapsed = time.perf_counter() - started
+        process.communicate(EXIT_CHOICE, timeout=timeout)
+    finally:
+        if process.poll() is None:
+            process.kill()
+    return elapsed
+
+def check_menu_imports(repo):
+    # A checkout the menu cannot start in (utility_module, which holds the
+    # input helpers, is not part of every tree) would otherwise only show
+    # up as a traceback read back from the first launch.
+    result = subprocess.run([sys.executable, '-c', 'import user_interface_module'], cwd=repo, capture_output=True, text=True)
+    if result.returncode:
+        error = (result.stderr.strip().splitlines() or ["unknown error"])[-1]
+        sys.exit(f"Cannot start the menu in {os.path.abspath(repo)}: {error}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the time from launching the menu to its first prompt")
+    parser.add_argument("--repo", default=os.getcwd(), help="Checkout to launch (default: the current directory)")
+    parser.add_argument("--runs", type=int, default=10, help="Launches against an existing database")
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+    check_menu_imports(args.repo)
+
+    directory = tempfile.mkdtemp(prefix="botanylog-bench-")
+    database_uri = f"sqlite:///{os.path.join(directory, 'startup.db')}"
+    try:
+        first = time_to_prompt(args.repo, database_uri, args.timeout)
+        timings = [time_to_prompt(args.repo, database_uri, args.timeout) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(directory)
+
+    print(f"Time to first prompt for {os.path.abspath(args.repo)}:")
+    print(f"  new database:      {1000 * first:.0f} ms")
+    print(f"  existing database: median {1000 * statistics.median(timings):.0f} ms, min {1000 * min(timings):.0f} ms, max {1000 * max(timings):.0f} ms over {len(timings)} runs")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+from benchmarks.synthetic import GrowDataSpec, generate
+from database_manager import DatabaseManager
+
+# Run from the repository root. Save a baseline on the main branch, then
+# compare a change against it; the exit status is 1 if any scenario got
+# slower by more than the threshold:
+#   python -m benchmarks.suite --output baseline.json
+#   python -m benchmarks.suite --baseline baseline.json --threshold 0.15
+
+DEFAULT_THRESHOLD = 0.10
+SCENARIOS = {}
+
+def scenario(name):
+    def register(function):
+        SCENARIOS[name] = function
+        return function
+    return register
+
+class BenchmarkContext:
+    def __init__(self, source, directory, args):
+        self.source = source
+        self.directory = directory
+        self.args = args
+        self.db_manager = DatabaseManager(f"sqlite:///{source}")
+        with self.db_manager.create_session() as session:
+            self.plant_ids = [plant.id for plant in self.db_manager.get_all_plants(session)]
+
+    def scratch_manager(self):
+        # Write scenarios get their own copy so the read scenarios always
+        # see the generated data and nothing else.
+        path = os.path.join(self.directory, 'scratch.db')
+        shutil.copyfile(self.source, path)
+        return DatabaseManager(f"sqlite:///{path}")
+
+    def sample_plant_ids(self):
+        # Seeded on every call, so each scenario works on the same plants
+        # however many of the others are run before it.
+        return random.Random(self.args.seed).sample(self.plant_ids, min(len(self.plant_ids), self.args.sample_plants))
+
+    def histories(self):
+        # A fresh manager, so the history cache is cold.
+        db_manager = DatabaseManager(f"sqlite:///{self.source}")
+        with db_manager.create_session() as session:
+            histories = db_manager.get_plant_histories(session, db_manager.get_plants(session, self.sample_plant_ids()))
+        db_manager.engine.dispose()
+        return histories
+
+@scenario('insert_single')
+def insert_single(context):
+    db_manager = context.scratch_manager()
+    with db_manager.create_session() as session:
+        plants = db_manager.get_plants(session, context.sample_plant_ids())
+        started = time.perf_counter()
+        for index in range(context.args.single_inserts):
+            db_manager.add_measurement(session, plants[index % len(plants)], date.today(), 10.0, 5, 1.0)
+        elapsed = time.perf_counter() - started
+    db_manager.engine.dispose()
+    return elapsed
+
+@scenario('insert_bulk')
+def insert_bulk(context):
+    db_manager = context.scratch_manager()
+    rng = random.Random(context.args.seed)
+    rows = [(rng.choice(context.plant_ids), date.today(), 10.0, 5, 1.0) for _ in range(context.args.bulk_rows)]
+    with db_manager.create_session() as session:
+        started = time.perf_counter()
+        db_manager.add_measurements_bulk(session, rows)
+        elapsed = time.perf_counter() - started
+    db_manager.engine.dispose()
+    return elapsed
+
+@scenario('get_measurements')
+def get_measurements(context):
+    with context.db_manager.create_session() as session:
+        plants = context.db_manager.get_plants(session, context.sample_plant_ids())
+        session.expunge_all()
+        started = time.perf_counter()
+        for plant in plants:
+            context.db_manager.get_measurements(session, plant)
+        return time.perf_counter() - started
+
+@scenario('view_plants')
+def view_plants(context):
+    # The reads and per-row formatting of "View plants", done here rather
+    # than through the CLI module, which needs the interactive input helpers.
+    output = io.StringIO()
+    with context.db_manager.create_session() as session:
+        started = time.perf_counter()
+        for plant, measurements, nutrients, comments in context.db_manager.iter_plant_records(session):
+            output.write(f"\nPlant: {plant.name} ({plant.strain})\n")
+            for m in measurements:
+                output.write(f"  {m.date:%Y-%m-%d}: Height={m.height:.2f} cm, Leaf Count={m.leaf_count}, Stem Diameter={m.stem_diameter:.2f} mm\n")
+            for n in nutrients:
+                output.write(f"  {n.date:%Y-%m-%d}: {n.nutrient_type.name} - {n.amount:.2f} ml\n")
+            for c in comments:
+                output.write(f"  {c.date:%Y-%m-%d}: {c.content}\n")
+        return time.perf_counter() - started
+
+@scenario('plant_histories')
+def plant_histories(context):
+    started = time.perf_counter()
+    context.histories()
+    return time.perf_counter() - started
+
+@scenario('calculate_growth_rates')
+def calculate_growth_rates(context):
+    from data_visualization import calculate_growth_rates
+    with context.db_manager.create_session() as session:
+        plants = context.db_manager.get_plants(session, context.sample_plant_ids())
+        measurement_lists = [context.db_manager.get_measurements(session, plant) for plant in plants]
+        started = time.perf_counter()
+        for measurements in measurement_lists:
+            for metric in ('height', 'leaf_count', 'stem_diameter'):
+                calculate_growth_rates(measurements, metric)
+        return time.perf_counter() - started
+
+def _plot_scenario(name, plot_all):
+    @scenario(name)
+    def plot(context):
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        import data_visualization
+
+        histories = context.histories()
+        function = getattr(data_visualization, name)
+        started = time.perf_counter()
+        if plot_all:
+            figures = [function(histories, show=False)]
+        else:
+            figures = [function(history, show=False) for history in histories]
+        for figure in figures:
+            figure.canvas.draw()
+        elapsed = time.perf_counter() - started
+        for figure in figures:
+            plt.close(figure)
+        return elapsed
+    return plot
+
+@scenario('dashboard_refresh')
+def dashboard_refresh(context):
+    # One new measurement per plant, continuing its growth, after a full
+    # history is on screen; the refresh should cost the same however long
+    # that history is.
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from dashboard import Dashboard
+
+    db_manager = context.scratch_manager()
+    dashboard = Dashboard(db_manager, context.sample_plant_ids())
+    dashboard.load()
+    next_day = date.fromordinal(max(day for day, _ in dashboard.watermarks.values()) + 1)
+    with db_manager.create_session() as session:
+        rows = [
+            (plant_id, next_day, float(dashboard.series[(plant_id, 'height')].values[-1]) + 0.5, 5, 1.0)
+            for plant_id in sorted(dashboard.watermarks)
+        ]
+        db_manager.add_measurements_bulk(session, rows)
+    started = time.perf_counter()
+    dashboard.refresh()
+    elapsed = time.perf_counter() - started
+    plt.close(dashboard.fig)
+    db_manager.engine.dispose()
+    return elapsed
+
+for _name, _plot_all in (
+    ('plot_plant_heights', True),
+    ('plot_growth_rates_all_plants', True),
+    ('plot_growth_rates_individual_plant', False),
+    ('plot_nutrient_schedule_all_plants', True),
+    ('plot_nutrient_schedule_individual_plant', False),
+):
+    _plot_scenario(_name, _plot_all)
+
+def run_scenario(function, context, repeat):
+    timings = [function(context) for _ in range(repeat)]
+    return {
+        'median': statistics.median(timings),
+        'min': min(timings),
+        'max': max(timings),
+        'runs': timings,
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold):
+    # Medians are compared, so one noisy run does not count as a regression.
+    # Scenarios missing from either side are listed but never fail the run.
+    rows = []
+    for name, result in results['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            rows.append((name, None, result['median'], None, 'new'))
+            continue
+        change = result['median'] / before['median'] - 1 if before['median'] else 0.0
+        status = 'REGRESSION' if change > threshold else 'faster' if change < -threshold else 'ok'
+        rows.append((name, before['median'], result['median'], change, status))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the main read, write and plotting paths on synthetic grow data")
+    parser.add_argument("--plants", type=int, default=50, help="Plants in the synthetic database")
+    parser.add_argument("--measurements", type=int, default=365, help="Measurement days per plant")
+    parser.add_argument("--nutrient-types", type=int, default=4)
+    parser.add_argument("--comment-rate", type=float, default=0.1, help="Chance of a comment on each measurement day")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per scenario; the median is reported")
+    parser.add_argument("--sample-plants", type=int, default=10, help="Plants read, plotted or written per scenario")
+    parser.add_argument("--single-inserts", type=int, default=200, help="Committed measurements in insert_single")
+    parser.add_argument("--bulk-rows", type=int, default=50000, help="Rows in insert_bulk")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="Scenario to run, may be repeated (default: all)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Slowdown that counts as a regression (default: 0.10 = 10%%)")
+    args = parser.parse_args()
+
+    spec = GrowDataSpec(args.plants, args.measurements, args.nutrient_types, args.comment_rate, args.seed)
+    directory = tempfile.mkdtemp(prefix="botanylog-bench-")
+    try:
+        source = os.path.join(directory, 'grow.db')
+        counts = generate(source, spec)
+        context = BenchmarkContext(source, directory, args)
+        scenarios = {}
+        for name in args.scenario or SCENARIOS:
+            scenarios[name] = run_scenario(SCENARIOS[name], context, args.repeat)
+            print(f"{name:>40}: median {1000 * scenarios[name]['median']:9.2f} ms", file=sys.stderr)
+        context.db_manager.engine.dispose()
+    finally:
+        shutil.rmtree(directory)
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'dataset': dict(spec.as_dict(), rows=counts),
+        'repeat': args.repeat,
+        'scenarios': scenarios,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    else:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('dataset') != results['dataset']:
+            print("Warning: the baseline was measured on a different dataset", file=sys.stderr)
+        rows = compare(results, baseline, args.threshold)
+        print(f"\nAgainst {args.baseline} (revision {baseline.get('revision')}), threshold {args.threshold:.0%}:", file=sys.stderr)
+        for name, before, after, change, status in rows:
+            before = '-' if before is None else f"{1000 * before:.2f}"
+            change = '' if change is None else f"{change:+.1%}"
+            print(f"{name:>40}: {before:>9} -> {1000 * after:9.2f} ms {change:>8} {status}", file=sys.stderr)
+        if any(status == 'REGRESSION' for *_, status in rows):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
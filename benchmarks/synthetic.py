@@ -0,0 +1,136 @@
+import argparse
+import math
+import random
+import sqlite3
+import time
+from datetime import date, timedelta
+
+import rollups
+from database_manager import DatabaseManager
+
+# Deterministic grow data: the same arguments and seed always produce the
+# same database, so benchmark runs on different commits see identical rows.
+#   python -m benchmarks.synthetic grow.db --plants 50 --measurements 365
+
+FIRST_DAY = date(2023, 1, 1)
+STRAINS = ('Indica', 'Sativa', 'Hybrid')
+NUTRIENT_NAMES = ('Grow', 'Bloom', 'Micro', 'Cal-Mag', 'Silica', 'Enzymes', 'Kelp', 'Molasses')
+OBSERVATIONS = (
+    "New growth at the top, leaves look healthy",
+    "Lower leaves yellowing, possible nitrogen deficiency",
+    "Spotted powdery mildew on two fan leaves, sprayed neem oil",
+    "Topped above the fifth node",
+    "Defoliated the lower third to improve airflow",
+    "Leaf tips burning, reduced the nutrient dose",
+    "Flipped to 12/12 light schedule",
+    "First pistils showing",
+    "Trichomes mostly cloudy, a few amber",
+    "Fungus gnats on the soil surface, added sticky traps",
+    "Watered to runoff, pH 6.3",
+    "Stem looks thicker after adding silica",
+)
+INSERT_BATCH = 50000
+
+class GrowDataSpec:
+    def __init__(self, plants=50, measurements=365, nutrient_types=4, comment_rate=0.1, seed=1):
+        self.plants = plants
+        self.measurements = measurements
+        self.nutrient_types = nutrient_types
+        # Comments per measurement day; growers note something about once a week or so.
+        self.comment_rate = comment_rate
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(vars(self))
+
+def _growth(day_index, days, ceiling):
+    # Logistic curve with its midpoint a third of the way through the grow.
+    return ceiling / (1 + math.exp(-8 * (day_index / max(days, 1) - 0.35)))
+
+def plant_rows(spec, rng):
+    return [(plant_id, f"Plant {plant_id}", rng.choice(STRAINS)) for plant_id in range(1, spec.plants + 1)]
+
+def nutrient_type_rows(spec):
+    return [
+        (type_id, NUTRIENT_NAMES[(type_id - 1) % len(NUTRIENT_NAMES)] + ('' if type_id <= len(NUTRIENT_NAMES) else f" {type_id}"), None)
+        for type_id in range(1, spec.nutrient_types + 1)
+    ]
+
+def record_rows(spec, rng):
+    # Yields ('measurement' | 'nutrient' | 'comment', row) one plant at a
+    # time, so arbitrarily large datasets are generated in constant memory.
+    for plant_id in range(1, spec.plants + 1):
+        height_ceiling = rng.uniform(80, 200)
+        leaf_ceiling = rng.uniform(80, 250)
+        stem_ceiling = rng.uniform(10, 30)
+        feeding_interval = rng.choice((2, 3, 7))
+        for day_index in range(spec.measurements):
+            day = (FIRST_DAY + timedelta(days=day_index)).isoformat()
+            yield 'measurement', (
+                plant_id, day,
+                round(_growth(day_index, spec.measurements, height_ceiling) * rng.uniform(0.97, 1.03), 2),
+                int(_growth(day_index, spec.measurements, leaf_ceiling) * rng.uniform(0.95, 1.05)),
+                round(_growth(day_index, spec.measurements, stem_ceiling) * rng.uniform(0.97, 1.03), 2),
+            )
+            if spec.nutrient_types and day_index % feeding_interval == 0:
+                for type_id in rng.sample(range(1, spec.nutrient_types + 1), min(spec.nutrient_types, 2)):
+                    yield 'nutrient', (plant_id, type_id, day, round(rng.uniform(1, 20), 1))
+            if rng.random() < spec.comment_rate:
+                yield 'comment', (plant_id, day, rng.choice(OBSERVATIONS))
+
+INSERTS = {
+    'measurement': "INSERT INTO measurements (plant_id, date, height, leaf_count, stem_diameter) VALUES (?, ?, ?, ?, ?)",
+    'nutrient': "INSERT INTO nutrients (plant_id, nutrient_type_id, date, amount) VALUES (?, ?, ?, ?)",
+    'comment': "INSERT INTO comments (plant_id, date, content) VALUES (?, ?, ?)",
+}
+
+def generate(path, spec):
+    # The schema comes from the application; the rows go straight through
+    # sqlite3, which is far quicker than the ORM for building test data.
+    DatabaseManager(f"sqlite:///{path}", profile='stock').engine.dispose()
+    rng = random.Random(spec.seed)
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.executemany("INSERT INTO plants (id, name, strain) VALUES (?, ?, ?)", plant_rows(spec, rng))
+    connection.executemany("INSERT INTO nutrient_types (id, name, description) VALUES (?, ?, ?)", nutrient_type_rows(spec))
+
+    counts = dict.fromkeys(INSERTS, 0)
+    batches = {kind: [] for kind in INSERTS}
+    for kind, row in record_rows(spec, rng):
+        batch = batches[kind]
+        batch.append(row)
+        if len(batch) >= INSERT_BATCH:
+            connection.executemany(INSERTS[kind], batch)
+            counts[kind] += len(batch)
+            batch.clear()
+    for kind, batch in batches.items():
+        connection.executemany(INSERTS[kind], batch)
+        counts[kind] += len(batch)
+
+    # The comment search index is filled by its triggers; the rollups are
+    # computed once at the end instead of row by row.
+    for statement in rollups.REBUILD_STATEMENTS:
+        connection.execute(statement)
+    connection.commit()
+    connection.close()
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic grow database")
+    parser.add_argument("path", help="SQLite file to create")
+    parser.add_argument("--plants", type=int, default=50)
+    parser.add_argument("--measurements", type=int, default=365, help="Measurement days per plant")
+    parser.add_argument("--nutrient-types", type=int, default=4)
+    parser.add_argument("--comment-rate", type=float, default=0.1, help="Chance of a comment on each measurement day")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    spec = GrowDataSpec(args.plants, args.measurements, args.nutrient_types, args.comment_rate, args.seed)
+    started = time.perf_counter()
+    counts = generate(args.path, spec)
+    print(f"Generated {counts['measurement']:,} measurements, {counts['nutrient']:,} nutrients and "
+          f"{counts['comment']:,} comments for {spec.plants:,} plants in {time.perf_counter() - started:.1f} s")
+
+if __name__ == "__main__":
+    main()
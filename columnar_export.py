@@ -0,0 +1,277 @@
+import glob
+import heapq
+import json
+import os
+import shutil
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+from sqlalchemy import select, func
+
+import archive
+from history_cache import build_histories
+from models_module import Plant, Measurement, NutrientType, Nutrient, Comment
+from timeseries import METRICS, MEASUREMENT_DTYPE, NUTRIENT_DTYPE, UNIX_EPOCH_ORDINAL, MeasurementColumns, NutrientColumns, day_ordinal
+
+STATE_NAME = 'export_state.json'
+FORMATS = {'parquet': 'parquet', 'arrow': 'arrow'}
+STREAM_ROWS = 50000
+
+# Table name -> (model, exported columns as (name, SQL expression, Arrow type)).
+# Dates are exported as day ordinals and stored as Arrow date32.
+TABLES = {
+    'measurements': (Measurement, [
+        ('id', Measurement.id, pa.int64()),
+        ('plant_id', Measurement.plant_id, pa.int64()),
+        ('date', day_ordinal(Measurement.date), pa.date32()),
+        ('height', Measurement.height, pa.float64()),
+        ('leaf_count', Measurement.leaf_count, pa.int64()),
+        ('stem_diameter', Measurement.stem_diameter, pa.float64()),
+    ]),
+    'nutrients': (Nutrient, [
+        ('id', Nutrient.id, pa.int64()),
+        ('plant_id', Nutrient.plant_id, pa.int64()),
+        ('date', day_ordinal(Nutrient.date), pa.date32()),
+        ('nutrient_type_id', Nutrient.nutrient_type_id, pa.int64()),
+        ('nutrient_type', NutrientType.name, pa.string()),
+        ('amount', Nutrient.amount, pa.float64()),
+    ]),
+    'comments': (Comment, [
+        ('id', Comment.id, pa.int64()),
+        ('plant_id', Comment.plant_id, pa.int64()),
+        ('date', day_ordinal(Comment.date), pa.date32()),
+        ('content', Comment.content, pa.string()),
+    ]),
+}
+
+# Table name -> (snapshot record kind, snapshot fields after id and date).
+SNAPSHOT_FIELDS = {
+    'measurements': ('measurement', METRICS),
+    'nutrients': ('nutrient', ('nutrient_type_id', 'amount')),
+    'comments': ('comment', ('content',)),
+}
+
+PLANT_SCHEMA = pa.schema([('id', pa.int64()), ('name', pa.string()), ('strain', pa.string())])
+
+class ExportState:
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, STATE_NAME)
+        self.file_format = None
+        self.watermarks = {}
+        self.pending = {}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            state = json.load(f)
+        self.file_format = state['format']
+        self.watermarks = state['watermarks']
+        self.pending = state.get('pending', {})
+        return True
+
+    def save(self):
+        state = {'format': self.file_format, 'watermarks': self.watermarks, 'pending': self.pending}
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+def _write(table, path, file_format):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if file_format == 'parquet':
+        pq.write_table(table, path)
+    else:
+        # Uncompressed, so the loader can map the buffers without copying.
+        with ipc.new_file(path, table.schema) as writer:
+            writer.write_table(table)
+
+def _read(path):
+    if path.endswith('.parquet'):
+        return pq.read_table(path, memory_map=True)
+    with pa.memory_map(path) as source:
+        return ipc.open_file(source).read_all()
+
+def _partition_path(output_dir, name, plant_id, month, part, file_format):
+    return os.path.join(output_dir, name, f"plant_id={plant_id}", f"month={month}", f"{part}.{FORMATS[file_format]}")
+
+def _rows_to_table(rows, columns):
+    arrays = []
+    for index, (_, _, arrow_type) in enumerate(columns):
+        values = [row[index] for row in rows]
+        if arrow_type == pa.date32():
+            values = pa.array(np.array(values, dtype=np.int32) - UNIX_EPOCH_ORDINAL, type=pa.int32()).cast(pa.date32())
+        else:
+            values = pa.array(values, type=arrow_type)
+        arrays.append(values)
+    return pa.Table.from_arrays(arrays, names=[name for name, _, _ in columns])
+
+def _snapshot_rows(snapshots, name, low, high):
+    # Archived plants' records in the shape and (plant_id, date, id) order
+    # of the rows the query returns.
+    kind, fields = SNAPSHOT_FIELDS[name]
+    for plant_id, snapshot in snapshots:
+        nutrient_type_names = archive.nutrient_type_names(snapshot)
+        for day, record_id, *values in archive.snapshot_rows(snapshot, kind, ('id', *fields)):
+            if low < record_id <= high:
+                if name == 'nutrients':
+                    values.insert(1, nutrient_type_names[values[0]])
+                yield (plant_id, day.strftime('%Y-%m'), record_id, plant_id, day.toordinal(), *values)
+
+def _export_table(session, output_dir, name, low, high, file_format, snapshots=()):
+    # Rows come back ordered by plant and date, so each (plant, month)
+    # partition is complete once the next one starts and only one is held
+    # in memory at a time.
+    model, columns = TABLES[name]
+    month = func.strftime('%Y-%m', model.date)
+    statement = (
+        select(model.plant_id, month, *[expression for _, expression, _ in columns])
+        .where(model.id > low, model.id <= high)
+        .order_by(model.plant_id, model.date, model.id)
+        .execution_options(yield_per=STREAM_ROWS)
+    )
+    if model is Nutrient:
+        statement = statement.join(NutrientType, Nutrient.nutrient_type_id == NutrientType.id)
+
+    records = session.execute(statement)
+    if snapshots:
+        records = heapq.merge(records, _snapshot_rows(snapshots, name, low, high), key=lambda row: (row[0], row[4], row[2]))
+
+    part = f"part-{low + 1}-{high}"
+    key = None
+    rows = []
+    written = 0
+    for row in records:
+        if (row[0], row[1]) != key:
+            if rows:
+                _write(_rows_to_table(rows, columns), _partition_path(output_dir, name, *key, part, file_format), file_format)
+                written += len(rows)
+            key = (row[0], row[1])
+            rows = []
+        rows.append(row[2:])
+    if rows:
+        _write(_rows_to_table(rows, columns), _partition_path(output_dir, name, *key, part, file_format), file_format)
+        written += len(rows)
+    return written
+
+def _remove_parts(output_dir, name, low, high):
+    for path in glob.glob(os.path.join(output_dir, name, '*', '*', f"part-{low + 1}-{high}.*")):
+        os.remove(path)
+
+def export_dataset(db_manager, output_dir, file_format='parquet', full=False):
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown export format '{file_format}', expected one of {', '.join(FORMATS)}.")
+    os.makedirs(output_dir, exist_ok=True)
+    state = ExportState(output_dir)
+    if full:
+        for name in TABLES:
+            shutil.rmtree(os.path.join(output_dir, name), ignore_errors=True)
+        for path in glob.glob(os.path.join(output_dir, 'plants.*')):
+            os.remove(path)
+    elif state.load() and state.file_format != file_format:
+        raise ValueError(f"{output_dir} holds a {state.file_format} export; use --full to replace it with {file_format}.")
+
+    # A run that was interrupted leaves its ranges pending; its partial
+    # files are removed and the same rows exported again.
+    for name, (low, high) in state.pending.items():
+        _remove_parts(output_dir, name, low, high)
+    state.file_format = file_format
+    started = time.perf_counter()
+
+    with db_manager.create_session() as session:
+        # Archived plants' records are exported from their snapshot files, so
+        # a full export still holds them, and their ids count towards the
+        # watermarks like those of live rows.
+        snapshots = [(plant_id, archive.load_snapshot(path)) for plant_id, path in sorted(archive.archived_paths(session).items())]
+        ranges = {}
+        for name, (model, _) in TABLES.items():
+            low = 0 if full else state.watermarks.get(name, 0)
+            kind = SNAPSHOT_FIELDS[name][0]
+            high = max([session.scalar(select(func.max(model.id))) or 0] + [int(snapshot[f"{kind}_id"].max(initial=0)) for _, snapshot in snapshots])
+            if high > low:
+                ranges[name] = (low, high)
+        state.pending = ranges
+        state.save()
+
+        plants = session.execute(select(Plant.id, Plant.name, Plant.strain).order_by(Plant.id)).all()
+        _write(pa.Table.from_pylist([row._asdict() for row in plants], schema=PLANT_SCHEMA),
+               os.path.join(output_dir, f"plants.{FORMATS[file_format]}"), file_format)
+        counts = {}
+        for name, (low, high) in ranges.items():
+            counts[name] = _export_table(session, output_dir, name, low, high, file_format, snapshots)
+            state.watermarks[name] = high
+
+    state.pending = {}
+    state.save()
+    summary = ", ".join(f"{count:,} {name}" for name, count in counts.items()) or "no new rows"
+    print(f"Exported {summary} to {output_dir} in {time.perf_counter() - started:.1f} s.")
+    return counts
+
+def _partitions(output_dir, name, plant_ids=None):
+    # Plant and month directories sort in (plant_id, date) order, and each
+    # file is sorted by (plant_id, date, id) when written.
+    for plant_dir in sorted(glob.glob(os.path.join(output_dir, name, 'plant_id=*')), key=lambda path: int(path.rsplit('=', 1)[1])):
+        if plant_ids is not None and int(plant_dir.rsplit('=', 1)[1]) not in plant_ids:
+            continue
+        for month_dir in sorted(glob.glob(os.path.join(plant_dir, 'month=*'))):
+            yield sorted(glob.glob(os.path.join(month_dir, 'part-*')))
+
+def load_table(output_dir, name, plant_ids=None):
+    # Arrow IPC files are memory-mapped and the returned columns reference
+    # the mapped pages directly. Only months that received rows in more
+    # than one export run are re-sorted, which copies them. Parquet has to
+    # be decoded, but is still read through a memory map.
+    _, columns = TABLES[name]
+    plant_ids = None if plant_ids is None else set(plant_ids)
+    tables = []
+    for paths in _partitions(output_dir, name, plant_ids):
+        parts = [_read(path) for path in paths]
+        if len(parts) == 1:
+            tables.extend(parts)
+        elif parts:
+            tables.append(pa.concat_tables(parts).sort_by([('date', 'ascending'), ('id', 'ascending')]))
+    if not tables:
+        return pa.schema([(column, arrow_type) for column, _, arrow_type in columns]).empty_table()
+    return pa.concat_tables(tables)
+
+def load_plants(output_dir):
+    paths = glob.glob(os.path.join(output_dir, 'plants.*'))
+    if not paths:
+        raise ValueError(f"No exported dataset in {output_dir}")
+    return _read(paths[0]).to_pylist()
+
+def _days(column):
+    return column.cast(pa.int32()).to_numpy().astype(np.int64) + UNIX_EPOCH_ORDINAL
+
+def load_histories(output_dir, plant_ids=None):
+    # PlantHistory keeps rows in structured arrays, so this is one
+    # vectorised copy per column out of the mapped files, with no SQLite
+    # involved.
+    plants = [plant for plant in load_plants(output_dir) if plant_ids is None or plant['id'] in plant_ids]
+    measurements_table = load_table(output_dir, 'measurements', plant_ids)
+    nutrients_table = load_table(output_dir, 'nutrients', plant_ids)
+
+    measurements = np.empty(measurements_table.num_rows, dtype=MEASUREMENT_DTYPE)
+    measurements['plant_id'] = measurements_table['plant_id'].to_numpy()
+    measurements['day'] = _days(measurements_table['date'])
+    for metric in METRICS:
+        measurements[metric] = measurements_table[metric].to_numpy()
+
+    nutrients = np.empty(nutrients_table.num_rows, dtype=NUTRIENT_DTYPE)
+    nutrients['plant_id'] = nutrients_table['plant_id'].to_numpy()
+    nutrients['day'] = _days(nutrients_table['date'])
+    nutrients['nutrient_type_id'] = nutrients_table['nutrient_type_id'].to_numpy()
+    nutrients['amount'] = nutrients_table['amount'].to_numpy()
+    nutrient_types = nutrients_table.group_by(['nutrient_type_id', 'nutrient_type']).aggregate([])
+    nutrient_type_names = dict(zip(nutrient_types['nutrient_type_id'].to_pylist(), nutrient_types['nutrient_type'].to_pylist()))
+
+    return build_histories(
+        [SimpleNamespace(**plant) for plant in plants],
+        MeasurementColumns(measurements),
+        NutrientColumns(nutrients),
+        nutrient_type_names,
+    )
@@ -0,0 +1,137 @@
+import re
+from collections import namedtuple
+from datetime import date
+from operator import attrgetter
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import archive
+
+DEFAULT_LIMIT = 20
+SNIPPET_TOKENS = 12
+
+# comments_fts is an external-content FTS5 index: it stores only the token
+# index and reads the text back from comments. The triggers keep it in step
+# with every insert, update and delete, whether it comes from the ORM, the
+# bulk inserts or another tool.
+CREATE_STATEMENTS = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS comments_fts USING fts5(
+           content, content='comments', content_rowid='id', tokenize='porter unicode61'
+       )""",
+    """CREATE TRIGGER IF NOT EXISTS comments_fts_insert AFTER INSERT ON comments BEGIN
+           INSERT INTO comments_fts (rowid, content) VALUES (new.id, new.content);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS comments_fts_delete AFTER DELETE ON comments BEGIN
+           INSERT INTO comments_fts (comments_fts, rowid, content) VALUES ('delete', old.id, old.content);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS comments_fts_update AFTER UPDATE OF content ON comments BEGIN
+           INSERT INTO comments_fts (comments_fts, rowid, content) VALUES ('delete', old.id, old.content);
+           INSERT INTO comments_fts (rowid, content) VALUES (new.id, new.content);
+       END""",
+]
+
+REBUILD_STATEMENTS = [
+    "INSERT INTO comments_fts (comments_fts) VALUES ('rebuild')",
+]
+
+# Archived plants' comments live in snapshot files, so a search indexes the
+# ones in range in a temporary table with the same tokenizer and matches
+# them with the same expression. The table is emptied rather than dropped,
+# as the driver runs DDL outside the transaction a rollback would undo.
+ARCHIVED_CREATE = """CREATE VIRTUAL TABLE IF NOT EXISTS temp.archived_comments_fts USING fts5(
+    content, comment_id UNINDEXED, plant_id UNINDEXED, date UNINDEXED, tokenize='porter unicode61'
+)"""
+ARCHIVED_CLEAR = "DELETE FROM temp.archived_comments_fts"
+
+SearchResult = namedtuple('SearchResult', ['comment_id', 'plant_id', 'plant_name', 'date', 'snippet', 'rank'])
+
+TOKEN = re.compile(r'\w+\*?')
+
+def to_match_expression(query):
+    # Plain words are quoted so punctuation and FTS5 keywords in user input
+    # cannot break the query; a trailing * still means prefix search.
+    terms = []
+    for token in TOKEN.findall(query):
+        prefix = token.endswith('*')
+        word = token.rstrip('*')
+        terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    if not terms:
+        raise ValueError("Search query has no words to look for")
+    return ' '.join(terms)
+
+def search(session, query, plant_id=None, since=None, until=None, limit=DEFAULT_LIMIT, raw=False, highlight=('[', ']')):
+    conditions = ["comments_fts MATCH :match"]
+    params = {
+        'match': query if raw else to_match_expression(query),
+        'limit': limit,
+        'start': highlight[0],
+        'end': highlight[1],
+        'tokens': SNIPPET_TOKENS,
+    }
+    if plant_id is not None:
+        conditions.append("c.plant_id = :plant_id")
+        params['plant_id'] = plant_id
+    if since is not None:
+        conditions.append("c.date >= :since")
+        params['since'] = since.isoformat()
+    if until is not None:
+        conditions.append("c.date <= :until")
+        params['until'] = until.isoformat()
+
+    statement = text(f"""
+        SELECT c.id, c.plant_id, p.name, c.date,
+               snippet(comments_fts, 0, :start, :end, '...', :tokens),
+               bm25(comments_fts) AS rank
+        FROM comments_fts
+        JOIN comments c ON c.id = comments_fts.rowid
+        JOIN plants p ON p.id = c.plant_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY rank
+        LIMIT :limit
+    """)
+    results = _execute(session, statement, params, query)
+
+    archived = _archived_comments(session, plant_id, since, until)
+    if archived:
+        # The two indexes score against different sets of comments, so the
+        # ranks are close to, not exactly, what one index would give.
+        session.execute(text(ARCHIVED_CREATE))
+        session.execute(text(ARCHIVED_CLEAR))
+        try:
+            session.execute(text("INSERT INTO temp.archived_comments_fts (content, comment_id, plant_id, date) VALUES (:content, :comment_id, :plant_id, :date)"), archived)
+            statement = text("""
+                SELECT a.comment_id, a.plant_id, p.name, a.date,
+                       snippet(archived_comments_fts, 0, :start, :end, '...', :tokens),
+                       bm25(archived_comments_fts) AS rank
+                FROM temp.archived_comments_fts a
+                JOIN plants p ON p.id = a.plant_id
+                WHERE archived_comments_fts MATCH :match
+                ORDER BY rank
+                LIMIT :limit
+            """)
+            results = sorted(results + _execute(session, statement, params, query), key=attrgetter('rank'))[:limit]
+        finally:
+            session.execute(text(ARCHIVED_CLEAR))
+    return results
+
+def _execute(session, statement, params, query):
+    try:
+        rows = session.execute(statement, params).all()
+    except OperationalError as e:
+        # Only raw queries can be malformed; report them like other bad input.
+        session.rollback()
+        raise ValueError(f"Invalid search query '{query}': {e.orig}")
+    return [
+        SearchResult(comment_id, plant_id, plant_name, date.fromisoformat(day), snippet, rank)
+        for comment_id, plant_id, plant_name, day, snippet, rank in rows
+    ]
+
+def _archived_comments(session, plant_id, since, until):
+    rows = []
+    for archived_plant_id, path in archive.archived_paths(session, None if plant_id is None else [plant_id]).items():
+        rows.extend(
+            {'content': content, 'comment_id': comment_id, 'plant_id': archived_plant_id, 'date': day.isoformat()}
+            for day, content, comment_id in archive.snapshot_rows(archive.load_snapshot(path), 'comment', ('content', 'id'), since, until)
+        )
+    return rows
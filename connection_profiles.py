@@ -0,0 +1,95 @@
+import os
+import re
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+PROFILE_ENVIRONMENT_VARIABLE = 'DATABASE_PROFILE'
+# Faster profiles trade durability or change the journal mode of the file,
+# so they are only used when asked for.
+DEFAULT_PROFILE = 'stock'
+
+PRAGMAS = ('journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store', 'busy_timeout')
+
+# PRAGMA values applied to every new connection, in PRAGMAS order. A
+# negative cache_size is in KiB rather than pages.
+PROFILES = {
+    # SQLite's own defaults: rollback journal, synchronous=FULL, ~2 MB cache.
+    'stock': {},
+    # WAL lets readers run alongside a writer; synchronous=NORMAL only
+    # syncs at checkpoints, which can lose the last commits on power loss
+    # but never corrupts the database.
+    'performance': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -64000,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -64000,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+}
+
+# Enough connections for the dashboard and render threads to read
+# concurrently; SQLite still serialises the writers among them.
+POOL_OPTIONS = {
+    'pool_size': 8,
+    'max_overflow': 8,
+    'pool_timeout': 30,
+}
+
+# SQLite builds before 3.32 allow at most 999 bound parameters per statement.
+MAX_IN_PARAMETERS = 500
+
+PRAGMA_VALUE = re.compile(r'^-?[A-Za-z0-9_]+$')
+
+def resolve(database_uri, profile=None):
+    # The profile and individual pragmas can ride along in the URI, e.g.
+    # sqlite:///plant_tracker.db?profile=durable&cache_size=-200000; they are
+    # removed before the URI reaches the driver.
+    url = make_url(database_uri)
+    query = dict(url.query)
+    profile = profile or query.pop('profile', None) or os.environ.get(PROFILE_ENVIRONMENT_VARIABLE) or DEFAULT_PROFILE
+    query.pop('profile', None)
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown database profile '{profile}', expected one of {', '.join(PROFILES)}.")
+
+    pragmas = dict(PROFILES[profile])
+    for name in PRAGMAS:
+        if name in query:
+            pragmas[name] = query.pop(name)
+    for name, value in pragmas.items():
+        if not PRAGMA_VALUE.match(str(value)):
+            raise ValueError(f"Invalid value '{value}' for PRAGMA {name}.")
+    pragmas = {name: pragmas[name] for name in PRAGMAS if name in pragmas}
+    return url.set(query=query), profile, pragmas
+
+def apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+def read_pragmas(connection):
+    return {name: connection.exec_driver_sql(f"PRAGMA {name}").scalar() for name in PRAGMAS}
+
+def create_profiled_engine(database_uri, profile=None):
+    url, profile, pragmas = resolve(database_uri, profile)
+    if url.get_backend_name() != 'sqlite':
+        return create_engine(url), profile
+
+    options = {}
+    if url.database not in (None, '', ':memory:'):
+        options.update(POOL_OPTIONS)
+    engine = create_engine(url, **options)
+    if pragmas:
+        event.listen(engine, 'connect', lambda dbapi_connection, connection_record: apply_pragmas(dbapi_connection, pragmas))
+    return engine, profile
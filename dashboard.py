@@ -0,0 +1,288 @@
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+from sqlalchemy import func, select
+
+import archive
+import instrumentation
+from models_module import GrowthRate, Measurement, Plant
+from timeseries import compute_growth_rates, day_ordinal, ordinals_to_dates
+from downsampling import DEFAULT_METHOD, downsample, target_points
+
+DEFAULT_INTERVAL = 5.0
+# New points are drawn over a cached background on every refresh; once a
+# line's live tail gets this long it is folded into the background.
+MAX_LIVE_POINTS = 500
+# Room left beyond the data when the axes are rescaled, so new points
+# rarely fall outside them and force a full redraw.
+HEADROOM = 0.1
+MIN_DAY_HEADROOM = 7
+
+ROW_DTYPE = np.dtype([
+    ('id', np.int64),
+    ('plant_id', np.int64),
+    ('day', np.int64),
+    ('height', np.float64),
+    ('height_rate', np.float64),
+])
+
+PANELS = (
+    ('height', "Plant Heights", "Height (cm)"),
+    ('height_rate', "Growth Rates", "Growth Rate (cm/day)"),
+)
+
+class Series:
+    # One plant's line on one panel. The settled part is drawn (downsampled)
+    # into the cached background; the live tail is an animated artist that
+    # is redrawn alone on every refresh.
+    def __init__(self, ax, label, color=None):
+        self.days = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0)
+        self.live_days = []
+        self.live_values = []
+        self.line, = ax.plot([], [], marker='o', markersize=3, label=label, color=color)
+        self.live, = ax.plot([], [], marker='o', markersize=3, color=self.line.get_color(), animated=True)
+
+    def __len__(self):
+        return len(self.days) + len(self.live_days)
+
+    def replace(self, days, values):
+        self.days = np.asarray(days, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.live_days, self.live_values = [], []
+
+    def extend(self, days, values):
+        self.live_days.extend(days)
+        self.live_values.extend(values)
+        # Starts from the last settled point so the line stays joined.
+        days, values = self.live_days, self.live_values
+        if len(self.days):
+            days, values = [int(self.days[-1])] + days, [float(self.values[-1])] + values
+        self.live.set_data(ordinals_to_dates(days), values)
+
+    def settle(self, method, points):
+        if self.live_days:
+            self.days = np.concatenate((self.days, self.live_days))
+            self.values = np.concatenate((self.values, self.live_values))
+            self.live_days, self.live_values = [], []
+        days, values = downsample(self.days, self.values, method, points)
+        self.line.set_data(ordinals_to_dates(days), values)
+        self.live.set_data([], [])
+
+    def bounds(self):
+        days = np.concatenate((self.days, self.live_days))
+        values = np.concatenate((self.values, self.live_values))
+        values = values[np.isfinite(values)]
+        if not len(days) or not len(values):
+            return None
+        return days.min(), days.max(), values.min(), values.max()
+
+class Dashboard:
+    # Keeps one figure open and polls for measurements with an id above the
+    # last one seen, so a refresh reads and draws only the new rows however
+    # long the history is. Edits to rows already plotted show up after the
+    # dashboard is reopened.
+    def __init__(self, db_manager, plant_ids=None, interval=DEFAULT_INTERVAL, downsample=DEFAULT_METHOD):
+        self.db_manager = db_manager
+        self.plant_ids = None if plant_ids is None else set(plant_ids)
+        self.interval = interval
+        self.downsample = downsample
+        self.last_id = 0
+        # (day, id) of the last point plotted for each plant; rows that sort
+        # before it were backdated and reload that plant's lines.
+        self.watermarks = {}
+        self.series = {}
+        self.limits = {}
+        self.background = None
+        self.timer = None
+        self.refreshes = 0
+        self.redraws = 0
+
+        self.fig, axes = plt.subplots(len(PANELS), 1, figsize=(12, 8), sharex=True)
+        self.axes = {}
+        for ax, (column, title, label) in zip(axes, PANELS):
+            ax.set_title(title)
+            ax.set_ylabel(label)
+            ax.xaxis_date()
+            ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+            self.axes[column] = ax
+        axes[-1].set_xlabel("Date")
+        self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def _statement(self, *conditions):
+        m, g = Measurement, GrowthRate
+        statement = (
+            select(m.id, m.plant_id, day_ordinal(m.date), m.height, g.height_rate)
+            .outerjoin(g, g.measurement_id == m.id)
+            .where(*conditions)
+        )
+        if self.plant_ids is not None:
+            statement = statement.where(m.plant_id.in_(sorted(self.plant_ids)))
+        return statement
+
+    def _read(self, session, statement):
+        return np.fromiter((tuple(row) for row in session.execute(statement)), dtype=ROW_DTYPE)
+
+    def _read_all(self, session, plant_ids, *conditions):
+        # Archived plants' measurements come from their snapshot files, with
+        # growth rates worked out as the triggers work them out. Snapshots
+        # keep no ids; 0 puts their rows ahead of live ones on the same day.
+        m = Measurement
+        rows = [self._read(session, self._statement(*conditions).order_by(m.plant_id, m.date, m.id))]
+        for measurements, _, _ in archive.load_archived(session, sorted(plant_ids)).values():
+            snapshot_rows = np.zeros(len(measurements), dtype=ROW_DTYPE)
+            snapshot_rows['plant_id'] = measurements.plant_id
+            snapshot_rows['day'] = measurements.day
+            snapshot_rows['height'] = measurements.height
+            snapshot_rows['height_rate'] = compute_growth_rates(measurements, ('height',))['height']
+            rows.append(snapshot_rows)
+        rows = np.concatenate(rows)
+        return rows.take(np.lexsort((rows['id'], rows['day'], rows['plant_id'])))
+
+    def _add_plants(self, session, plant_ids):
+        for plant_id, name in session.execute(select(Plant.id, Plant.name).where(Plant.id.in_(sorted(plant_ids))).order_by(Plant.id)):
+            color = None
+            for column in self.axes:
+                series = self.series[(plant_id, column)] = Series(self.axes[column], name, color)
+                color = series.line.get_color()
+
+    def _replace(self, rows):
+        for plant_id, rows_slice in _plant_slices(rows).items():
+            plant_rows = rows[rows_slice]
+            for column in self.axes:
+                self.series[(plant_id, column)].replace(plant_rows['day'], plant_rows[column])
+            self.watermarks[plant_id] = (int(plant_rows['day'][-1]), int(plant_rows['id'][-1]))
+
+    def load(self):
+        m = Measurement
+        with self.db_manager.create_session() as session:
+            self.last_id = session.scalar(select(func.max(m.id))) or 0
+            plant_ids = set(session.scalars(select(Plant.id)) if self.plant_ids is None else self.plant_ids)
+            self._add_plants(session, plant_ids)
+            rows = self._read_all(session, plant_ids, m.id <= self.last_id)
+        self._replace(rows)
+        self.redraw()
+
+    def poll(self):
+        m = Measurement
+        with self.db_manager.create_session() as session:
+            rows = self._read(session, self._statement(m.id > self.last_id).order_by(m.date, m.id))
+            if not len(rows):
+                return rows
+            self.last_id = int(rows['id'].max())
+            # Plants added since the dashboard opened get their own lines.
+            new_plants = {plant_id for plant_id in np.unique(rows['plant_id']).tolist() if (plant_id, 'height') not in self.series}
+            if new_plants:
+                self._add_plants(session, new_plants)
+        return rows
+
+    def _reload(self, plant_ids):
+        m = Measurement
+        with self.db_manager.create_session() as session:
+            self._replace(self._read_all(session, plant_ids, m.id <= self.last_id, m.plant_id.in_(sorted(plant_ids))))
+
+    def apply(self, rows):
+        # Returns True when the new rows only need the live tails redrawn.
+        full = False
+        backdated = set()
+        for plant_id in np.unique(rows['plant_id']).tolist():
+            plant_rows = rows[rows['plant_id'] == plant_id]
+            if (plant_id, 'height') not in self.series:
+                continue
+            if plant_id not in self.watermarks:
+                full = True
+            elif (int(plant_rows['day'][0]), int(plant_rows['id'][0])) < self.watermarks[plant_id]:
+                backdated.add(plant_id)
+                continue
+            for column in self.axes:
+                series = self.series[(plant_id, column)]
+                series.extend(plant_rows['day'].tolist(), plant_rows[column].tolist())
+                full = full or len(series.live_days) > MAX_LIVE_POINTS or not self._fits(column, plant_rows['day'], plant_rows[column])
+            self.watermarks[plant_id] = (int(plant_rows['day'][-1]), int(plant_rows['id'][-1]))
+        if backdated:
+            self._reload(backdated)
+        return not (full or backdated)
+
+    def _fits(self, column, days, values):
+        limits = self.limits.get(column)
+        if limits is None:
+            return False
+        values = values[np.isfinite(values)]
+        xmin, xmax, ymin, ymax = limits
+        return (
+            days.min() >= xmin and days.max() <= xmax
+            and (not len(values) or (values.min() >= ymin and values.max() <= ymax))
+        )
+
+    def _rescale(self):
+        for column, ax in self.axes.items():
+            bounds = [series.bounds() for (_, series_column), series in self.series.items() if series_column == column]
+            bounds = [bound for bound in bounds if bound is not None]
+            if not bounds:
+                self.limits.pop(column, None)
+                continue
+            xmin, xmax = min(bound[0] for bound in bounds), max(bound[1] for bound in bounds)
+            ymin, ymax = min(bound[2] for bound in bounds), max(bound[3] for bound in bounds)
+            xmax += max(int(HEADROOM * (xmax - xmin)), MIN_DAY_HEADROOM)
+            margin = HEADROOM * (ymax - ymin) or 1.0
+            self.limits[column] = (xmin - 1, xmax, ymin - margin, ymax + margin)
+            ax.set_xlim(ordinals_to_dates([xmin - 1, xmax]))
+            ax.set_ylim(ymin - margin, ymax + margin)
+
+    def redraw(self):
+        for (_, column), series in self.series.items():
+            series.settle(self.downsample, target_points(self.axes[column]))
+        self._rescale()
+        if self.series:
+            self.axes[PANELS[0][0]].legend(loc='upper left')
+        self.redraws += 1
+        self.fig.canvas.draw()
+
+    def _on_draw(self, event):
+        # Every full draw (including a window resize) renders the settled
+        # lines; the live tails are drawn on top of the saved copy.
+        canvas = self.fig.canvas
+        if getattr(canvas, 'supports_blit', False):
+            self.background = canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_live()
+
+    def _draw_live(self):
+        for (_, column), series in self.series.items():
+            if series.live_days:
+                self.axes[column].draw_artist(series.live)
+
+    def blit(self):
+        canvas = self.fig.canvas
+        if self.background is None:
+            canvas.draw_idle()
+            return
+        canvas.restore_region(self.background)
+        self._draw_live()
+        canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+
+    def refresh(self):
+        with instrumentation.operation("dashboard: refresh"):
+            self.refreshes += 1
+            rows = self.poll()
+            if not len(rows):
+                return 0
+            if self.apply(rows):
+                self.blit()
+            else:
+                self.redraw()
+            return len(rows)
+
+    def show(self):
+        self.load()
+        self.timer = self.fig.canvas.new_timer(interval=int(1000 * self.interval))
+        self.timer.add_callback(self.refresh)
+        self.timer.start()
+        plt.show()
+
+def _plant_slices(rows):
+    if not len(rows):
+        return {}
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(rows['plant_id'])) + 1))
+    ends = np.append(starts[1:], len(rows))
+    return {int(rows['plant_id'][start]): slice(int(start), int(end)) for start, end in zip(starts, ends)}
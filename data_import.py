@@ -0,0 +1,300 @@
+import csv
+import json
+import os
+import sys
+import time
+
+from models_module import Plant, NutrientType
+from utility_module import (
+    convert_date_string,
+    validate_height,
+    validate_leaf_count,
+    validate_stem_diameter,
+    validate_nutrient_amount,
+)
+
+KINDS = ('measurement', 'nutrient', 'comment')
+DEFAULT_BATCH_SIZE = 10000
+MAX_REPORTED_ERRORS = 20
+
+class ImportRecord:
+    def __init__(self, offset, line, next_line, fields):
+        self.offset = offset
+        self.line = line
+        self.next_line = next_line
+        self.fields = fields
+        self.kind = None
+        self.values = None
+        self.error = None
+
+    def __repr__(self):
+        return f"<ImportRecord(line='{self.line}', kind='{self.kind}', error='{self.error}')>"
+
+class NameLookup:
+    def __init__(self, session):
+        self.plant_ids = {}
+        self.ambiguous_plants = set()
+        for plant_id, name in session.query(Plant.id, Plant.name):
+            if name in self.plant_ids:
+                self.ambiguous_plants.add(name)
+            self.plant_ids[name] = plant_id
+        self.nutrient_type_ids = dict(session.query(NutrientType.name, NutrientType.id))
+
+    def plant_id(self, fields):
+        if fields.get('plant_id') not in (None, ''):
+            return int(fields['plant_id'])
+        name = fields.get('plant')
+        if name in self.ambiguous_plants:
+            raise ValueError(f"Plant name '{name}' is ambiguous, use plant_id instead")
+        if name not in self.plant_ids:
+            raise ValueError(f"Unknown plant '{name}'")
+        return self.plant_ids[name]
+
+    def nutrient_type_id(self, fields):
+        if fields.get('nutrient_type_id') not in (None, ''):
+            return int(fields['nutrient_type_id'])
+        name = fields.get('nutrient_type')
+        if name not in self.nutrient_type_ids:
+            raise ValueError(f"Unknown nutrient type '{name}'")
+        return self.nutrient_type_ids[name]
+
+class Checkpoint:
+    # Without a path (records piped in or given on the command line) the
+    # counters are still kept but nothing is written to disk.
+    def __init__(self, path, source=None):
+        self.path = path
+        self.source = None
+        if source is not None:
+            stat = os.stat(source)
+            self.source = {'path': os.path.abspath(source), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        self.offset = 0
+        self.line = 1
+        self.records = 0
+        self.inserted = 0
+        self.errors = 0
+        self.complete = False
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get('source') != self.source:
+            print(f"Ignoring checkpoint {self.path}: the source file has changed.")
+            return False
+        for key in ('offset', 'line', 'records', 'inserted', 'errors', 'complete'):
+            setattr(self, key, state[key])
+        return True
+
+    def save(self):
+        if self.path is None:
+            return
+        state = {
+            'source': self.source,
+            'offset': self.offset,
+            'line': self.line,
+            'records': self.records,
+            'inserted': self.inserted,
+            'errors': self.errors,
+            'complete': self.complete,
+        }
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.path)
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.ndjson', '.jsonl', '.json'):
+        return 'ndjson'
+    if extension in ('.csv', '.txt'):
+        return 'csv'
+    raise ValueError(f"Cannot detect the format of '{path}', pass --format")
+
+def parse_csv(path, offset=0, line=1):
+    with open(path, 'rb') as f:
+        yield from parse_csv_stream(f, offset, line)
+
+def parse_csv_stream(f, offset=0, line=1):
+    header_line = f.readline()
+    header = next(csv.reader([header_line.decode('utf-8-sig')]), [])
+    header = [name.strip() for name in header]
+    position = {'offset': max(offset, len(header_line)), 'line': max(line, 2)}
+    if position['offset'] != len(header_line):
+        f.seek(position['offset'])
+
+    def lines():
+        for raw in f:
+            position['offset'] += len(raw)
+            position['line'] += 1
+            yield raw.decode('utf-8')
+
+    # csv.reader only pulls the lines it needs for one record, so the
+    # position after each row is a safe place to resume from.
+    start_line = position['line']
+    for row in csv.reader(lines()):
+        if row:
+            yield ImportRecord(position['offset'], start_line, position['line'], dict(zip(header, row)))
+        start_line = position['line']
+
+def parse_ndjson(path, offset=0, line=1):
+    with open(path, 'rb') as f:
+        yield from parse_ndjson_stream(f, offset, line)
+
+def parse_ndjson_stream(f, offset=0, line=1):
+    if offset:
+        f.seek(offset)
+    for raw in f:
+        offset += len(raw)
+        if raw.strip():
+            try:
+                record = ImportRecord(offset, line, line + 1, json.loads(raw))
+                if not isinstance(record.fields, dict):
+                    record.error = "Expected a JSON object"
+            except ValueError as e:
+                record = ImportRecord(offset, line, line + 1, {})
+                record.error = f"Invalid JSON: {e}"
+            yield record
+        line += 1
+
+PARSERS = {'csv': parse_csv, 'ndjson': parse_ndjson}
+STREAM_PARSERS = {'csv': parse_csv_stream, 'ndjson': parse_ndjson_stream}
+
+def _text(fields, name):
+    value = fields.get(name)
+    if value is None or value == '':
+        raise ValueError(f"Missing field '{name}'")
+    return str(value).strip()
+
+def validate_records(records, default_kind=None):
+    for record in records:
+        if record.error is None:
+            try:
+                fields = record.fields
+                record.kind = fields.get('kind') or default_kind
+                if record.kind not in KINDS:
+                    raise ValueError(f"Unknown record kind '{record.kind}'")
+
+                values = {'date': convert_date_string(_text(fields, 'date'))}
+                if record.kind == 'measurement':
+                    values['height'] = validate_height(_text(fields, 'height'))
+                    values['leaf_count'] = validate_leaf_count(_text(fields, 'leaf_count'))
+                    values['stem_diameter'] = validate_stem_diameter(_text(fields, 'stem_diameter'))
+                elif record.kind == 'nutrient':
+                    values['amount'] = validate_nutrient_amount(_text(fields, 'amount'))
+                else:
+                    values['content'] = _text(fields, 'content')
+                record.values = values
+            except ValueError as e:
+                record.error = str(e)
+        yield record
+
+def resolve_records(records, lookup):
+    for record in records:
+        if record.error is None:
+            try:
+                record.values['plant_id'] = lookup.plant_id(record.fields)
+                if record.kind == 'nutrient':
+                    record.values['nutrient_type_id'] = lookup.nutrient_type_id(record.fields)
+            except ValueError as e:
+                record.error = str(e)
+        yield record
+
+def insert_records(session, db_manager, records, checkpoint, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    inserters = {
+        'measurement': db_manager.add_measurements_bulk,
+        'nutrient': db_manager.add_nutrients_bulk,
+        'comment': db_manager.add_comments_bulk,
+    }
+    buffers = {kind: [] for kind in KINDS}
+    pending = 0
+
+    def flush(last_record):
+        for kind, rows in buffers.items():
+            if rows:
+                result = inserters[kind](session, rows, batch_size=batch_size, commit=False)
+                checkpoint.inserted += result.inserted
+                for _, row, message in result.errors:
+                    report_error(checkpoint, row.get('line'), message)
+                rows.clear()
+        session.commit()
+        checkpoint.offset = last_record.offset
+        checkpoint.line = last_record.next_line
+        checkpoint.save()
+        if progress:
+            progress(checkpoint)
+
+    record = None
+    for record in records:
+        checkpoint.records += 1
+        pending += 1
+        if record.error is None:
+            buffers[record.kind].append(dict(record.values, line=record.line))
+        else:
+            report_error(checkpoint, record.line, record.error)
+
+        if pending >= batch_size:
+            flush(record)
+            pending = 0
+
+    if pending:
+        flush(record)
+
+def report_error(checkpoint, line, message):
+    checkpoint.errors += 1
+    if checkpoint.errors <= MAX_REPORTED_ERRORS:
+        print(f"  line {line}: {message}", file=sys.stderr)
+    elif checkpoint.errors == MAX_REPORTED_ERRORS + 1:
+        print("  further errors are counted but not shown", file=sys.stderr)
+
+def import_file(db_manager, path, file_format=None, default_kind=None,
+                batch_size=DEFAULT_BATCH_SIZE, checkpoint_path=None, restart=False):
+    file_format = file_format or detect_format(path)
+    checkpoint = Checkpoint(checkpoint_path or f"{path}.checkpoint", path)
+    if not restart and checkpoint.load():
+        if checkpoint.complete:
+            print(f"{path} was already imported, use --restart to import it again.")
+            return checkpoint
+        print(f"Resuming {path} from line {checkpoint.line}.")
+
+    total_size = checkpoint.source['size']
+    started = time.perf_counter()
+    start_records = checkpoint.records
+
+    def progress(state):
+        elapsed = time.perf_counter() - started
+        rate = (state.records - start_records) / elapsed if elapsed else 0.0
+        percent = 100.0 * state.offset / total_size if total_size else 100.0
+        print(
+            f"{path}: {state.records:,} records ({percent:.1f}%), {state.inserted:,} inserted, "
+            f"{state.errors:,} errors, {rate:,.0f} records/s"
+        )
+
+    records = PARSERS[file_format](path, checkpoint.offset, checkpoint.line)
+    load_records(db_manager, records, checkpoint, default_kind, batch_size, progress)
+
+    checkpoint.complete = True
+    checkpoint.save()
+    print(f"Finished {path}: {checkpoint.inserted:,} rows inserted, {checkpoint.errors:,} errors.")
+    return checkpoint
+
+def load_records(db_manager, records, checkpoint, default_kind=None, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    # One session and one name lookup for the whole run, however many
+    # records arrive.
+    with db_manager.create_session() as session:
+        lookup = NameLookup(session)
+        records = validate_records(records, default_kind)
+        records = resolve_records(records, lookup)
+        insert_records(session, db_manager, records, checkpoint, batch_size, progress)
+    return checkpoint
+
+def import_stream(db_manager, stream, file_format='csv', default_kind=None, batch_size=DEFAULT_BATCH_SIZE):
+    checkpoint = Checkpoint(None)
+    load_records(db_manager, STREAM_PARSERS[file_format](stream), checkpoint, default_kind, batch_size)
+    return checkpoint
+
+def import_fields(db_manager, rows, default_kind=None, batch_size=DEFAULT_BATCH_SIZE):
+    checkpoint = Checkpoint(None)
+    records = (ImportRecord(0, line, line + 1, fields) for line, fields in enumerate(rows, start=1))
+    load_records(db_manager, records, checkpoint, default_kind, batch_size)
+    return checkpoint
@@ -2,143 +2,145 @@ import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 from models_module import Plant, Measurement, Nutrient
 from datetime import datetime
+from timeseries import MeasurementColumns, NutrientColumns, build_nutrient_pivot, compute_growth_rates, ordinals_to_dates
+from downsampling import DEFAULT_METHOD, downsample, target_points
 
-def plot_plant_heights(plants):
+def plot_series(ax, days, values, method=DEFAULT_METHOD, **kwargs):
+    days, values = downsample(days, values, method, target_points(ax))
+    return ax.plot(ordinals_to_dates(days), values, **kwargs)
+
+def plot_plant_heights(histories, show=True, downsample=DEFAULT_METHOD):
     fig, ax = plt.subplots(figsize=(12, 6))
     ax.set_title("Plant Heights Over Time")
     ax.set_xlabel("Date")
     ax.set_ylabel("Height (cm)")
 
-    for plant in plants:
-        measurements = plant.measurements
-        dates = [measurement.date for measurement in measurements]
-        heights = [measurement.height for measurement in measurements]
-        ax.plot(dates, heights, label=plant.name, marker='o')
+    for history in histories:
+        measurements = history.measurements
+        plot_series(ax, measurements.day, measurements.height, downsample, label=history.name, marker='o')
 
     ax.legend()
     ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
     fig.autofmt_xdate()
-    plt.show()
+    if show:
+        plt.show()
+    return fig
 
-def plot_growth_rates_all_plants(plants):
+def plot_growth_rates_all_plants(histories, show=True, downsample=DEFAULT_METHOD):
     fig, ax = plt.subplots(figsize=(12, 6))
     ax.set_title("Growth Rates for All Plants")
     ax.set_xlabel("Date")
     ax.set_ylabel("Growth Rate (cm/day)")
 
-    for plant in plants:
-        measurements = plant.measurements
-        dates = [measurement.date for measurement in measurements]
-        growth_rates = calculate_growth_rates(measurements, 'height')
-        ax.plot(dates[1:], growth_rates, label=plant.name, marker='o')
+    for history in histories:
+        days = history.measurements.day
+        growth_rates = history.growth_rates()['height']
+        plot_series(ax, days[1:], growth_rates[1:], downsample, label=history.name, marker='o')
 
     ax.legend()
     ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
     fig.autofmt_xdate()
-    plt.show()
+    if show:
+        plt.show()
+    return fig
 
-def plot_growth_rates_individual_plant(plant):
+def plot_growth_rates_individual_plant(history, show=True, downsample=DEFAULT_METHOD):
     fig, ax = plt.subplots(figsize=(12, 6))
-    ax.set_title(f"Growth Rates for {plant.name}")
+    ax.set_title(f"Growth Rates for {history.name}")
     ax.set_xlabel("Date")
     ax.set_ylabel("Growth Rate")
 
-    measurements = plant.measurements
-    dates = [measurement.date for measurement in measurements]
-    height_growth_rates = calculate_growth_rates(measurements, 'height')
-    leaf_count_growth_rates = calculate_growth_rates(measurements, 'leaf_count')
-    stem_diameter_growth_rates = calculate_growth_rates(measurements, 'stem_diameter')
+    days = history.measurements.day[1:]
+    growth_rates = history.growth_rates()
 
-    ax.plot(dates[1:], height_growth_rates, label="Height Growth Rate", marker='o')
-    ax.plot(dates[1:], leaf_count_growth_rates, label="Leaf Count Growth Rate", marker='o')
-    ax.plot(dates[1:], stem_diameter_growth_rates, label="Stem Diameter Growth Rate", marker='o')
+    plot_series(ax, days, growth_rates['height'][1:], downsample, label="Height Growth Rate", marker='o')
+    plot_series(ax, days, growth_rates['leaf_count'][1:], downsample, label="Leaf Count Growth Rate", marker='o')
+    plot_series(ax, days, growth_rates['stem_diameter'][1:], downsample, label="Stem Diameter Growth Rate", marker='o')
 
     ax.legend()
     ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
     fig.autofmt_xdate()
-    plt.show()
+    if show:
+        plt.show()
+    return fig
 
-def plot_nutrient_schedule_all_plants(plants):
+def plot_nutrient_schedule_all_plants(histories, show=True):
     fig, ax = plt.subplots(figsize=(12, 6))
     ax.set_title("Nutrient Schedule for All Plants")
     ax.set_xlabel("Date")
     ax.set_ylabel("Nutrient Amount (ml)")
 
-    nutrient_types = set()
-    for plant in plants:
-        for nutrient in plant.nutrients:
-            nutrient_types.add(nutrient.nutrient_type.name)
-
-    nutrient_types = list(nutrient_types)
-    num_nutrient_types = len(nutrient_types)
-
-    for plant in plants:
-        nutrient_dates = set()
-        for nutrient in plant.nutrients:
-            nutrient_dates.add(nutrient.date)
+    pivot = build_nutrient_pivot(NutrientColumns.concatenate([history.nutrients for history in histories]))
+    dates = pivot.dates
+    num_nutrient_types = len(pivot.nutrient_type_ids)
 
-        nutrient_dates = sorted(list(nutrient_dates))
-
-        for nutrient_type in nutrient_types:
-            nutrient_amounts = []
-            for date in nutrient_dates:
-                nutrient = next((n for n in plant.nutrients if n.nutrient_type.name == nutrient_type and n.date == date), None)
-                nutrient_amounts.append(nutrient.amount if nutrient else 0)
+    for history in histories:
+        index = pivot.plant_index(history.plant_id)
+        if index is None:
+            continue
+        days = pivot.recorded[index]
 
-            ax.plot(nutrient_dates, nutrient_amounts, label=f"{plant.name} - {nutrient_type}", marker='o')
+        for t, nutrient_type_id in enumerate(pivot.nutrient_type_ids):
+            nutrient_type = history.nutrient_type_names[int(nutrient_type_id)]
+            ax.plot(dates[days], pivot.amounts[index, days, t], label=f"{history.name} - {nutrient_type}", marker='o')
 
-    ax.legend(ncol=num_nutrient_types)
+    ax.legend(ncol=max(num_nutrient_types, 1))
     ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
     fig.autofmt_xdate()
-    plt.show()
+    if show:
+        plt.show()
+    return fig
 
-def plot_nutrient_schedule_individual_plant(plant):
+def plot_nutrient_schedule_individual_plant(history, show=True):
     fig, ax = plt.subplots(figsize=(12, 6))
-    ax.set_title(f"Nutrient Schedule for {plant.name}")
+    ax.set_title(f"Nutrient Schedule for {history.name}")
     ax.set_xlabel("Date")
     ax.set_ylabel("Nutrient Amount (ml)")
 
-    nutrient_types = set(nutrient.nutrient_type.name for nutrient in plant.nutrients)
-    nutrient_types = list(nutrient_types)
-    num_nutrient_types = len(nutrient_types)
-
-    measurements = plant.measurements
-    dates = [measurement.date for measurement in measurements]
+    pivot = build_nutrient_pivot(history.nutrients)
+    dates = pivot.dates
 
-    for i, nutrient_type in enumerate(nutrient_types):
-        nutrient_amounts = [nutrient.amount for nutrient in plant.nutrients if nutrient.nutrient_type.name == nutrient_type]
-        ax.plot(dates, nutrient_amounts, label=nutrient_type, marker='o')
+    for t, nutrient_type_id in enumerate(pivot.nutrient_type_ids):
+        nutrient_type = history.nutrient_type_names[int(nutrient_type_id)]
+        ax.plot(dates, pivot.amounts[0, :, t], label=nutrient_type, marker='o')
 
     ax.legend()
     ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
     fig.autofmt_xdate()
-    plt.show()
+    if show:
+        plt.show()
+    return fig
+
+def plot_strain_statistics(strain_statistics, show=True):
+    fig, (height_ax, rate_ax) = plt.subplots(1, 2, figsize=(12, 6))
+    strains = [row.strain for row in strain_statistics]
+    positions = range(len(strains))
+
+    height_ax.set_title("Mean Final Height by Strain")
+    height_ax.set_ylabel("Height (cm)")
+    height_ax.bar(positions, [row.mean_final_height or 0 for row in strain_statistics])
+
+    rate_ax.set_title("Growth Rate by Strain")
+    rate_ax.set_ylabel("Growth Rate (cm/day)")
+    width = 0.4
+    rate_ax.bar([p - width / 2 for p in positions], [row.mean_growth_rate or 0 for row in strain_statistics], width, label="Mean")
+    rate_ax.bar([p + width / 2 for p in positions], [row.mean_peak_growth_rate or 0 for row in strain_statistics], width, label="Peak (7-day smoothed)")
+    rate_ax.legend()
+
+    for ax in (height_ax, rate_ax):
+        ax.set_xticks(list(positions))
+        ax.set_xticklabels([f"{strain}\n({row.plant_count} plants)" for strain, row in zip(strains, strain_statistics)])
+    fig.tight_layout()
+    if show:
+        plt.show()
+    return fig
 
 def calculate_growth_rates(measurements, measurement_type):
-    growth_rates = []
-    for i in range(1, len(measurements)):
-        current_measurement = measurements[i]
-        previous_measurement = measurements[i - 1]
-
-        time_diff = (current_measurement.date - previous_measurement.date).days
-        if time_diff == 0:
-            continue
-
-        if measurement_type == 'height':
-            growth = current_measurement.height - previous_measurement.height
-        elif measurement_type == 'leaf_count':
-            growth = current_measurement.leaf_count - previous_measurement.leaf_count
-        elif measurement_type == 'stem_diameter':
-            growth = current_measurement.stem_diameter - previous_measurement.stem_diameter
-        else:
-            raise ValueError("Invalid measurement type.")
-
-        growth_rate = growth / time_diff
-        growth_rates.append(growth_rate)
-
-    return growth_rates
+    # Rates line up with measurements[1:]; same-day intervals yield NaN.
+    columns = MeasurementColumns.from_measurements(measurements)
+    return compute_growth_rates(columns, (measurement_type,))[measurement_type][1:]
 
-def visualization_menu(plants):
+def visualization_menu(histories):
     while True:
         print("\nData Visualization Menu")
         print("1. Plant Heights Over Time")
@@ -151,49 +153,49 @@ def visualization_menu(plants):
         choice = input("Enter your choice (1-6): ")
 
         if choice == "1":
-            plot_plant_heights(plants)
+            plot_plant_heights(histories)
         elif choice == "2":
-            plot_growth_rates_all_plants(plants)
+            plot_growth_rates_all_plants(histories)
         elif choice == "3":
-            if plants:
+            if histories:
                 print("Select a plant:")
-                for i, plant in enumerate(plants, start=1):
-                    print(f"{i}. {plant.name}")
+                for i, history in enumerate(histories, start=1):
+                    print(f"{i}. {history.name}")
 
                 while True:
                     try:
                         plant_choice = int(input("Enter the number of the plant: "))
-                        if 1 <= plant_choice <= len(plants):
-                            selected_plant = plants[plant_choice - 1]
+                        if 1 <= plant_choice <= len(histories):
+                            selected_history = histories[plant_choice - 1]
                             break
                         else:
                             print("Invalid plant choice. Please try again.")
                     except ValueError:
                         print("Invalid input. Please enter a valid number.")
 
-                plot_growth_rates_individual_plant(selected_plant)
+                plot_growth_rates_individual_plant(selected_history)
             else:
                 print("No plant data available.")
         elif choice == "4":
-            plot_nutrient_schedule_all_plants(plants)
+            plot_nutrient_schedule_all_plants(histories)
         elif choice == "5":
-            if plants:
+            if histories:
                 print("Select a plant:")
-                for i, plant in enumerate(plants, start=1):
-                    print(f"{i}. {plant.name}")
+                for i, history in enumerate(histories, start=1):
+                    print(f"{i}. {history.name}")
 
                 while True:
                     try:
                         plant_choice = int(input("Enter the number of the plant: "))
-                        if 1 <= plant_choice <= len(plants):
-                            selected_plant = plants[plant_choice - 1]
+                        if 1 <= plant_choice <= len(histories):
+                            selected_history = histories[plant_choice - 1]
                             break
                         else:
                             print("Invalid plant choice. Please try again.")
                     except ValueError:
                         print("Invalid input. Please enter a valid number.")
 
-                plot_nutrient_schedule_individual_plant(selected_plant)
+                plot_nutrient_schedule_individual_plant(selected_history)
             else:
                 print("No plant data available.")
         elif choice == "6":
@@ -1,77 +1,102 @@
+import math
 import os
-
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, ForeignKey
-from sqlalchemy.orm import sessionmaker, relationship
-from sqlalchemy.ext.declarative import declarative_base
-from datetime import date
-
-Base = declarative_base()
-
-class Plant(Base):
-    __tablename__ = 'plants'
-
-    id = Column(Integer, primary_key=True)
-    name = Column(String, nullable=False)
-    strain = Column(String, nullable=False)
-    measurements = relationship('Measurement', backref='plant', cascade='all, delete-orphan')
-    nutrients = relationship('Nutrient', backref='plant', cascade='all, delete-orphan')
-    comments = relationship('Comment', backref='plant', cascade='all, delete-orphan')
-
-    def __repr__(self):
-        return f"<Plant(id='{self.id}', name='{self.name}', strain='{self.strain}')>"
-
-class Measurement(Base):
-    __tablename__ = 'measurements'
-
-    id = Column(Integer, primary_key=True)
-    date = Column(Date, nullable=False)
-    height = Column(Float, nullable=False)
-    leaf_count = Column(Integer, nullable=False)
-    stem_diameter = Column(Float, nullable=False)
-    plant_id = Column(Integer, ForeignKey('plants.id'), nullable=False)
+import time
+
+from sqlalchemy import select, func, text, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker, joinedload
+from datetime import date, datetime
+from itertools import groupby
+from operator import attrgetter
+
+import comment_search
+import growth_rates
+import migrations
+import rollups
+import storage
+from connection_profiles import MAX_IN_PARAMETERS, create_profiled_engine
+from models_module import Base, Plant, Measurement, NutrientType, Nutrient, Comment, PlantStatistics, StrainStatistics, ArchivedPlant
+
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_PAGE_SIZE = 1000
+
+MEASUREMENT_FIELDS = ('plant_id', 'date', 'height', 'leaf_count', 'stem_diameter')
+NUTRIENT_FIELDS = ('plant_id', 'nutrient_type_id', 'date', 'amount')
+COMMENT_FIELDS = ('plant_id', 'date', 'content')
+
+class BulkInsertResult:
+    def __init__(self):
+        self.inserted = 0
+        self.batches = 0
+        self.elapsed = 0.0
+        self.errors = []
+
+    @property
+    def rows_per_second(self):
+        return self.inserted / self.elapsed if self.elapsed else 0.0
+
+    def add_error(self, index, row, message):
+        self.errors.append((index, row, message))
 
     def __repr__(self):
-        return f"<Measurement(id='{self.id}', date='{self.date}', height='{self.height}', leaf_count='{self.leaf_count}', stem_diameter='{self.stem_diameter}')>"
-
-class NutrientType(Base):
-    __tablename__ = 'nutrient_types'
-
-    id = Column(Integer, primary_key=True)
-    name = Column(String, nullable=False, unique=True)
-    description = Column(String)
-
-    def __repr__(self):
-        return f"<NutrientType(id='{self.id}', name='{self.name}', description='{self.description}')>"
-
-class Nutrient(Base):
-    __tablename__ = 'nutrients'
-
-    id = Column(Integer, primary_key=True)
-    date = Column(Date, nullable=False)
-    amount = Column(Float, nullable=False)
-    plant_id = Column(Integer, ForeignKey('plants.id'), nullable=False)
-    nutrient_type_id = Column(Integer, ForeignKey('nutrient_types.id'), nullable=False)
-    nutrient_type = relationship('NutrientType')
-
-    def __repr__(self):
-        return f"<Nutrient(id='{self.id}', date='{self.date}', amount='{self.amount}', nutrient_type='{self.nutrient_type.name}')>"
-
-class Comment(Base):
-    __tablename__ = 'comments'
-
-    id = Column(Integer, primary_key=True)
-    date = Column(Date, nullable=False)
-    content = Column(String, nullable=False)
-    plant_id = Column(Integer, ForeignKey('plants.id'), nullable=False)
-
-    def __repr__(self):
-        return f"<Comment(id='{self.id}', date='{self.date}', content='{self.content[:20]}...')>"
+        return f"<BulkInsertResult(inserted='{self.inserted}', errors='{len(self.errors)}', batches='{self.batches}', rows_per_second='{self.rows_per_second:.0f}')>"
+
+def _row_values(row, fields):
+    if isinstance(row, dict):
+        missing = [field for field in fields if field not in row]
+        if missing:
+            raise ValueError(f"Missing field(s): {', '.join(missing)}")
+        return {field: row[field] for field in fields}
+    if len(row) != len(fields):
+        raise ValueError(f"Expected {len(fields)} values ({', '.join(fields)}), got {len(row)}")
+    return dict(zip(fields, row))
+
+def _coerce_id(value, known_ids, label):
+    value = int(getattr(value, 'id', value))
+    if value not in known_ids:
+        raise ValueError(f"Unknown {label} id {value}")
+    return value
+
+def _coerce_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value))
+
+def _coerce_non_negative(value, label, convert=float):
+    value = convert(value)
+    # NaN and infinity pass the sign check and would poison every rollup,
+    # growth rate and statistic computed from the row.
+    if not math.isfinite(value):
+        raise ValueError(f"{label} must be a finite number, got {value}")
+    if value < 0:
+        raise ValueError(f"{label} must be non-negative, got {value}")
+    return value
+
+def _coerce_leaf_count(value):
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"Leaf count must be a whole number, got {value}")
+    return _coerce_non_negative(value, 'Leaf count', int)
 
 class DatabaseManager:
-    def __init__(self, database_uri):
-        self.engine = create_engine(database_uri)
-        Base.metadata.create_all(self.engine)
+    def __init__(self, database_uri, cache_bytes=None, profile=None):
+        self.database_uri = database_uri
+        self.engine, self.profile = create_profiled_engine(database_uri, profile)
+        storage.watch(self.engine)
+        migrations.upgrade(self.engine, Base.metadata)
         self.Session = sessionmaker(bind=self.engine)
+        self.cache_bytes = cache_bytes
+        self._history_cache = None
+
+    @property
+    def history_cache(self):
+        # Built on first use so that NumPy is only imported by the code
+        # paths that work with history arrays.
+        if self._history_cache is None:
+            from history_cache import DEFAULT_MAX_BYTES, HistoryCache
+            self._history_cache = HistoryCache(DEFAULT_MAX_BYTES if self.cache_bytes is None else self.cache_bytes)
+        return self._history_cache
 
     def create_session(self):
         return self.Session()
@@ -82,20 +107,40 @@ class DatabaseManager:
         session.commit()
         return plant
 
+    def add_plants(self, session, plants):
+        plants = [Plant(name=name, strain=strain) for name, strain in plants]
+        session.add_all(plants)
+        session.commit()
+        return plants
+
     def get_plant(self, session, plant_id):
         return session.query(Plant).get(plant_id)
 
     def get_all_plants(self, session):
         return session.query(Plant).all()
 
+    def get_plants(self, session, plant_ids):
+        plant_ids = sorted(plant_ids)
+        plants = []
+        for start in range(0, len(plant_ids), MAX_IN_PARAMETERS):
+            chunk = plant_ids[start:start + MAX_IN_PARAMETERS]
+            plants.extend(session.query(Plant).filter(Plant.id.in_(chunk)).order_by(Plant.id))
+        return plants
+
     def add_measurement(self, session, plant, date, height, leaf_count, stem_diameter):
         measurement = Measurement(date=date, height=height, leaf_count=leaf_count, stem_diameter=stem_diameter, plant=plant)
         session.add(measurement)
+        plant_id = plant.id
+        rollups.add_measurements(session, [{
+            'plant_id': plant_id, 'date': date, 'height': height, 'leaf_count': leaf_count, 'stem_diameter': stem_diameter,
+        }])
         session.commit()
+        if self._history_cache is not None:
+            self._history_cache.append_measurement(plant_id, date, height, leaf_count, stem_diameter)
         return measurement
 
     def get_measurements(self, session, plant):
-        return session.query(Measurement).filter_by(plant=plant).all()
+        return session.query(Measurement).filter_by(plant=plant).order_by(Measurement.date, Measurement.id).all()
 
     def add_nutrient_type(self, session, name, description=None):
         nutrient_type = NutrientType(name=name, description=description)
@@ -112,11 +157,17 @@ class DatabaseManager:
     def add_nutrient(self, session, plant, nutrient_type, date, amount):
         nutrient = Nutrient(date=date, amount=amount, plant=plant, nutrient_type=nutrient_type)
         session.add(nutrient)
+        plant_id, nutrient_type_id, nutrient_type_name = plant.id, nutrient_type.id, nutrient_type.name
+        rollups.add_nutrients(session, [{
+            'plant_id': plant_id, 'nutrient_type_id': nutrient_type_id, 'date': date, 'amount': amount,
+        }])
         session.commit()
+        if self._history_cache is not None:
+            self._history_cache.append_nutrient(plant_id, nutrient_type_id, nutrient_type_name, date, amount)
         return nutrient
 
     def get_nutrients(self, session, plant):
-        return session.query(Nutrient).filter_by(plant=plant).all()
+        return session.query(Nutrient).filter_by(plant=plant).order_by(Nutrient.date, Nutrient.id).all()
 
     def add_comment(self, session, plant, date, content):
         comment = Comment(date=date, content=content, plant=plant)
@@ -125,7 +176,264 @@ class DatabaseManager:
         return comment
 
     def get_comments(self, session, plant):
-        return session.query(Comment).filter_by(plant=plant).all()
+        return session.query(Comment).filter_by(plant=plant).order_by(Comment.date, Comment.id).all()
+
+    def search_comments(self, session, query, plant=None, date_range=None, limit=comment_search.DEFAULT_LIMIT, raw=False):
+        since, until = date_range or (None, None)
+        plant_id = plant.id if isinstance(plant, Plant) else plant
+        return comment_search.search(session, query, plant_id, since, until, limit, raw)
+
+    def iter_plants(self, session, page_size=DEFAULT_PAGE_SIZE):
+        last_id = None
+        while True:
+            statement = select(Plant).order_by(Plant.id).limit(page_size)
+            if last_id is not None:
+                statement = statement.where(Plant.id > last_id)
+            page = session.scalars(statement).all()
+            yield from page
+            if len(page) < page_size:
+                return
+            last_id = page[-1].id
+
+    def iter_measurements(self, session, plant_id=None, since=None, until=None, page_size=DEFAULT_PAGE_SIZE):
+        return self._iter_records(session, Measurement, plant_id, since, until, page_size)
+
+    def iter_nutrients(self, session, plant_id=None, since=None, until=None, page_size=DEFAULT_PAGE_SIZE):
+        return self._iter_records(session, Nutrient, plant_id, since, until, page_size, joinedload(Nutrient.nutrient_type))
+
+    def iter_comments(self, session, plant_id=None, since=None, until=None, page_size=DEFAULT_PAGE_SIZE):
+        return self._iter_records(session, Comment, plant_id, since, until, page_size)
+
+    def _iter_records(self, session, model, plant_id, since, until, page_size, *options):
+        # Keyset pagination: each page restarts after the last key seen, so
+        # deep pages cost the same as the first one and only one page is
+        # held at a time. Without a plant the key leads with plant_id, which
+        # the (plant_id, date) index (plus the implicit rowid) already orders.
+        if page_size < 1:
+            raise ValueError("page_size must be at least 1")
+        key = (model.date, model.id) if plant_id is not None else (model.plant_id, model.date, model.id)
+        statement = select(model).options(*options).order_by(*key).limit(page_size)
+        if plant_id is not None:
+            statement = statement.where(model.plant_id == plant_id)
+        if since is not None:
+            statement = statement.where(model.date >= since)
+        if until is not None:
+            statement = statement.where(model.date <= until)
+
+        last = None
+        while True:
+            page = session.scalars(statement if last is None else statement.where(tuple_(*key) > last)).all()
+            yield from page
+            if len(page) < page_size:
+                return
+            last = tuple(getattr(page[-1], column.key) for column in key)
+
+    def iter_plant_records(self, session, plant_id=None, since=None, until=None, page_size=DEFAULT_PAGE_SIZE):
+        # Walks the plant, measurement, nutrient and comment streams side by
+        # side, yielding (plant, measurements, nutrients, comments) per plant.
+        # Each group is an iterator that must be consumed before the next
+        # plant is requested.
+        streams = [
+            groupby(records, key=attrgetter('plant_id'))
+            for records in (
+                self.iter_measurements(session, plant_id, since, until, page_size),
+                self.iter_nutrients(session, plant_id, since, until, page_size),
+                self.iter_comments(session, plant_id, since, until, page_size),
+            )
+        ]
+        current = [next(stream, None) for stream in streams]
+        if plant_id is None:
+            plants = self.iter_plants(session, page_size)
+        else:
+            plants = [plant for plant in [self.get_plant(session, plant_id)] if plant is not None]
+        for plant in plants:
+            groups = []
+            for index, stream in enumerate(streams):
+                while current[index] is not None and current[index][0] < plant.id:
+                    current[index] = next(stream, None)
+                if current[index] is not None and current[index][0] == plant.id:
+                    groups.append(current[index][1])
+                else:
+                    groups.append(iter(()))
+            yield (plant, *groups)
+
+    def get_history_fingerprints(self, session):
+        # Rows are only ever appended, so a count plus the highest id changes
+        # whenever a plant's history does, backdated rows included.
+        fingerprints = {plant_id: [0, 0, 0, 0] for plant_id in session.scalars(select(Plant.id))}
+        for offset, model in ((0, Measurement), (2, Nutrient)):
+            statement = select(model.plant_id, func.count(), func.max(model.id)).group_by(model.plant_id)
+            for plant_id, count, max_id in session.execute(statement):
+                if plant_id in fingerprints:
+                    fingerprints[plant_id][offset:offset + 2] = [count, max_id]
+        return fingerprints
+
+    def get_plant_histories(self, session, plants=None, granularity=None):
+        if plants is None:
+            plants = session.query(Plant).order_by(Plant.id).all()
+        if granularity is None:
+            return self.history_cache.get_many(session, plants)
+
+        # Rollup histories are small and cheap to read, so they bypass the cache.
+        from history_cache import build_histories
+        measurements, nutrients = rollups.load_columns(session, granularity, [plant.id for plant in plants])
+        self.history_cache.refresh_nutrient_type_names(session, nutrients.nutrient_type_id)
+        return build_histories(plants, measurements, nutrients, self.history_cache.nutrient_type_names)
+
+    def rebuild_rollups(self, session):
+        rollups.rebuild(session)
+        session.commit()
+
+    def get_growth_rates(self, session, plant_id=None, since=None, until=None):
+        return growth_rates.load_columns(session, None if plant_id is None else [plant_id], since, until)
+
+    def rebuild_growth_rates(self, session):
+        growth_rates.rebuild(session)
+        session.commit()
+        if self._history_cache is not None:
+            self._history_cache.invalidate()
+
+    def get_plant_statistics(self, session, plant_ids=None, strain=None):
+        query = session.query(PlantStatistics).order_by(PlantStatistics.strain, PlantStatistics.plant_id)
+        if plant_ids is not None:
+            query = query.filter(PlantStatistics.plant_id.in_(sorted(plant_ids)))
+        if strain is not None:
+            query = query.filter(PlantStatistics.strain == strain)
+        return query.all()
+
+    def get_strain_statistics(self, session):
+        return session.query(StrainStatistics).order_by(StrainStatistics.strain).all()
+
+    def get_archived_plants(self, session):
+        return session.query(ArchivedPlant).order_by(ArchivedPlant.plant_id).all()
+
+    def hot_queries(self, plant_id, nutrient_type_id, since):
+        return [
+            ('measurements for a plant', select(Measurement).where(Measurement.plant_id == plant_id).order_by(Measurement.date, Measurement.id)),
+            ('nutrients for a plant', select(Nutrient).where(Nutrient.plant_id == plant_id).order_by(Nutrient.date, Nutrient.id)),
+            ('comments for a plant', select(Comment).where(Comment.plant_id == plant_id).order_by(Comment.date, Comment.id)),
+            ('nutrients of a type since a date', select(Nutrient).where(Nutrient.nutrient_type_id == nutrient_type_id, Nutrient.date >= since).order_by(Nutrient.date)),
+            ('latest measurement for a plant', select(Measurement).where(Measurement.plant_id == plant_id).order_by(Measurement.date.desc()).limit(1)),
+        ]
+
+    def explain_query_plans(self, session):
+        plant_id = session.scalar(select(Plant.id).limit(1)) or 1
+        nutrient_type_id = session.scalar(select(NutrientType.id).limit(1)) or 1
+        plans = []
+        for label, statement in self.hot_queries(plant_id, nutrient_type_id, date.today()):
+            sql = str(statement.compile(self.engine, compile_kwargs={'literal_binds': True}))
+            steps = [row[-1] for row in session.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+            plans.append((label, sql, steps))
+        return plans
+
+    def add_measurements_bulk(self, session, rows, batch_size=DEFAULT_BATCH_SIZE, commit=True):
+        plant_ids = self._known_ids(session, Plant)
+
+        def coerce(row):
+            values = _row_values(row, MEASUREMENT_FIELDS)
+            return {
+                'plant_id': _coerce_id(values['plant_id'], plant_ids, 'plant'),
+                'date': _coerce_date(values['date']),
+                'height': _coerce_non_negative(values['height'], 'Height'),
+                'leaf_count': _coerce_leaf_count(values['leaf_count']),
+                'stem_diameter': _coerce_non_negative(values['stem_diameter'], 'Stem diameter'),
+            }
+
+        return self._bulk_insert(session, Measurement.__table__, rows, coerce, batch_size, commit, rollups.add_measurements)
+
+    def add_nutrients_bulk(self, session, rows, batch_size=DEFAULT_BATCH_SIZE, commit=True):
+        plant_ids = self._known_ids(session, Plant)
+        nutrient_type_ids = self._known_ids(session, NutrientType)
+
+        def coerce(row):
+            values = _row_values(row, NUTRIENT_FIELDS)
+            return {
+                'plant_id': _coerce_id(values['plant_id'], plant_ids, 'plant'),
+                'nutrient_type_id': _coerce_id(values['nutrient_type_id'], nutrient_type_ids, 'nutrient type'),
+                'date': _coerce_date(values['date']),
+                'amount': _coerce_non_negative(values['amount'], 'Nutrient amount'),
+            }
+
+        return self._bulk_insert(session, Nutrient.__table__, rows, coerce, batch_size, commit, rollups.add_nutrients)
+
+    def add_comments_bulk(self, session, rows, batch_size=DEFAULT_BATCH_SIZE, commit=True):
+        plant_ids = self._known_ids(session, Plant)
+
+        def coerce(row):
+            values = _row_values(row, COMMENT_FIELDS)
+            content = str(values['content']).strip()
+            if not content:
+                raise ValueError("Comment content must not be empty")
+            return {
+                'plant_id': _coerce_id(values['plant_id'], plant_ids, 'plant'),
+                'date': _coerce_date(values['date']),
+                'content': content,
+            }
+
+        return self._bulk_insert(session, Comment.__table__, rows, coerce, batch_size, commit)
+
+    def _known_ids(self, session, model):
+        return set(session.scalars(select(model.id)))
+
+    def _bulk_insert(self, session, table, rows, coerce, batch_size, commit, after_insert=None):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
+        result = BulkInsertResult()
+        started = time.perf_counter()
+        batch = []
+        for index, row in enumerate(rows):
+            try:
+                batch.append((index, row, coerce(row)))
+            except (ValueError, TypeError, KeyError) as e:
+                result.add_error(index, row, str(e))
+                continue
+
+            if len(batch) >= batch_size:
+                self._flush_batch(session, table, batch, result, commit, after_insert)
+                batch = []
+
+        if batch:
+            self._flush_batch(session, table, batch, result, commit, after_insert)
+
+        result.elapsed = time.perf_counter() - started
+        return result
+
+    def _flush_batch(self, session, table, batch, result, commit, after_insert=None):
+        if self._history_cache is not None and table is not Comment.__table__:
+            self._history_cache.invalidate({values['plant_id'] for _, _, values in batch})
+        if not commit:
+            # The caller owns the transaction, so a failure has to abort it.
+            rows = storage.assign_ids(session, table, [values for _, _, values in batch])
+            session.execute(table.insert(), rows)
+            if after_insert is not None:
+                after_insert(session, rows)
+            result.inserted += len(batch)
+            result.batches += 1
+            return
+
+        try:
+            rows = storage.assign_ids(session, table, [values for _, _, values in batch])
+            session.execute(table.insert(), rows)
+            if after_insert is not None:
+                after_insert(session, rows)
+            session.commit()
+            result.inserted += len(batch)
+        except IntegrityError:
+            # Isolate the offending rows instead of losing the whole batch.
+            session.rollback()
+            for index, row, values in batch:
+                try:
+                    rows = storage.assign_ids(session, table, [values])
+                    session.execute(table.insert(), rows)
+                    if after_insert is not None:
+                        after_insert(session, rows)
+                    session.commit()
+                    result.inserted += 1
+                except IntegrityError as e:
+                    session.rollback()
+                    result.add_error(index, row, str(e.orig))
+        result.batches += 1
 
 if __name__ == '__main__':
     database_uri = os.environ.get('DATABASE_URI', 'sqlite:///plant_tracker.db')
@@ -148,6 +456,13 @@ if __name__ == '__main__':
         # Add a comment
         comment = db_manager.add_comment(session, plant, date(2023, 5, 1), 'Looking healthy!')
 
+        # Add a batch of measurements in a single transaction
+        result = db_manager.add_measurements_bulk(session, [
+            (plant.id, date(2023, 5, 2), 26.5, 13, 5.4),
+            (plant.id, date(2023, 5, 3), 28.0, 15, 5.5),
+        ])
+        print(result)
+
         # Get all plants
         plants = db_manager.get_all_plants(session)
         for plant in plants:
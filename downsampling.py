@@ -0,0 +1,86 @@
+import numpy as np
+
+DEFAULT_METHOD = 'lttb'
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: keeps the first and last points and,
+    # from each bucket in between, the point forming the largest triangle
+    # with the previously kept point and the average of the next bucket.
+    count = len(x)
+    if threshold >= count or threshold < 3:
+        return x, y
+
+    xf = x.astype(np.float64)
+    edges = np.linspace(1, count - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = count - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else count
+        if next_end > end:
+            next_x = xf[end:next_end].mean()
+            next_y = y[end:next_end].mean()
+        else:
+            next_x, next_y = xf[-1], y[-1]
+        area = np.abs(
+            (xf[previous] - next_x) * (y[start:end] - y[previous])
+            - (xf[previous] - xf[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(area))
+        selected[bucket + 1] = previous
+    return x[selected], y[selected]
+
+def min_max(x, y, threshold):
+    # Keeps the lowest and highest point of each bucket, so spikes survive.
+    count = len(x)
+    buckets = threshold // 2
+    if threshold >= count or buckets < 1:
+        return x, y
+
+    size = -(-count // buckets)
+    padded = np.full(buckets * size, np.nan)
+    padded[:count] = y
+    padded = padded.reshape(buckets, size)
+    filled = ~np.isnan(padded).all(axis=1)
+    offsets = np.arange(buckets)[filled] * size
+    lows = offsets + np.nanargmin(padded[filled], axis=1)
+    highs = offsets + np.nanargmax(padded[filled], axis=1)
+    selected = np.unique(np.concatenate((lows, highs)))
+    return x[selected], y[selected]
+
+def _period_mean(x, y, period):
+    # Day ordinal 1 (0001-01-01) is a Monday, so weekly buckets start on Mondays.
+    buckets = (x - 1) // period
+    keys, inverse = np.unique(buckets, return_inverse=True)
+    totals = np.bincount(inverse, weights=y)
+    counts = np.bincount(inverse)
+    return keys * period + 1, totals / counts
+
+def daily(x, y, threshold=None):
+    return _period_mean(x, y, 1)
+
+def weekly(x, y, threshold=None):
+    return _period_mean(x, y, 7)
+
+DOWNSAMPLERS = {
+    'lttb': lttb,
+    'minmax': min_max,
+    'daily': daily,
+    'weekly': weekly,
+}
+
+def target_points(ax):
+    return max(int(ax.bbox.width), 3)
+
+def downsample(x, y, method=DEFAULT_METHOD, threshold=None):
+    if method is None or not len(x):
+        return x, y
+    if method not in DOWNSAMPLERS:
+        raise ValueError(f"Unknown downsampling method '{method}', expected one of {', '.join(DOWNSAMPLERS)}.")
+
+    keep = ~np.isnan(y)
+    if not keep.all():
+        x, y = x[keep], y[keep]
+    return DOWNSAMPLERS[method](x, y, threshold or len(x))
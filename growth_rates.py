@@ -0,0 +1,84 @@
+from sqlalchemy import select, text
+
+from models_module import GrowthRate
+
+RATE_COLUMNS = ('height_rate', 'leaf_count_rate', 'stem_diameter_rate')
+
+# A measurement's rate depends only on the measurement before it in
+# (date, id) order, so a write changes at most the rows it touches and the
+# row right after each of them. The triggers recompute exactly those, for
+# ORM writes, bulk inserts, backdated rows and edits made by other tools.
+# Same-day pairs and a plant's first measurement get NULL, as in
+# timeseries.compute_growth_rates.
+_RATES = ", ".join(
+    f"(m.{metric} - p.{metric}) / NULLIF(julianday(m.date) - julianday(p.date), 0)"
+    for metric in ('height', 'leaf_count', 'stem_diameter')
+)
+
+_PREVIOUS = (
+    "(SELECT q.id FROM measurements q WHERE q.plant_id = m.plant_id AND q.date <= m.date "
+    "AND (q.date < m.date OR q.id < m.id) ORDER BY q.date DESC, q.id DESC LIMIT 1)"
+)
+
+def _next(row):
+    return (
+        f"(SELECT q.id FROM measurements q WHERE q.plant_id = {row}.plant_id AND q.date >= {row}.date "
+        f"AND (q.date > {row}.date OR q.id > {row}.id) ORDER BY q.date, q.id LIMIT 1)"
+    )
+
+def _refresh(measurement_id):
+    return (
+        f"INSERT OR REPLACE INTO growth_rates (measurement_id, plant_id, date, {', '.join(RATE_COLUMNS)}) "
+        f"SELECT m.id, m.plant_id, m.date, {_RATES} "
+        f"FROM measurements m LEFT JOIN measurements p ON p.id = {_PREVIOUS} WHERE m.id = {measurement_id};"
+    )
+
+CREATE_STATEMENTS = [
+    f"""CREATE TRIGGER IF NOT EXISTS growth_rates_insert AFTER INSERT ON measurements BEGIN
+            {_refresh('new.id')}
+            {_refresh(_next('new'))}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS growth_rates_delete AFTER DELETE ON measurements BEGIN
+            DELETE FROM growth_rates WHERE measurement_id = old.id;
+            {_refresh(_next('old'))}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS growth_rates_update
+        AFTER UPDATE OF plant_id, date, height, leaf_count, stem_diameter ON measurements BEGIN
+            {_refresh(_next('old'))}
+            {_refresh('new.id')}
+            {_refresh(_next('new'))}
+        END""",
+]
+
+# Full recomputation with a window over each plant's history, for backfills.
+REBUILD_STATEMENTS = [
+    "DELETE FROM growth_rates",
+    f"""INSERT INTO growth_rates (measurement_id, plant_id, date, {', '.join(RATE_COLUMNS)})
+        SELECT id, plant_id, date, {', '.join(
+            f"({metric} - LAG({metric}) OVER w) / NULLIF(julianday(date) - julianday(LAG(date) OVER w), 0)"
+            for metric in ('height', 'leaf_count', 'stem_diameter')
+        )}
+        FROM measurements
+        WINDOW w AS (PARTITION BY plant_id ORDER BY date, id)""",
+]
+
+def rebuild(session):
+    for statement in REBUILD_STATEMENTS:
+        session.execute(text(statement))
+
+def load_columns(session, plant_ids=None, since=None, until=None):
+    # Imported here to keep NumPy off the write path.
+    from timeseries import MeasurementColumns, day_ordinal
+
+    # Rates come back in the same (plant, date, id) order as
+    # MeasurementColumns.load, with NULL as NaN, so they line up row for row.
+    g = GrowthRate
+    statement = (
+        select(g.plant_id, day_ordinal(g.date), *[getattr(g, column) for column in RATE_COLUMNS])
+        .order_by(g.plant_id, g.date, g.measurement_id)
+    )
+    if since is not None:
+        statement = statement.where(g.date >= since)
+    if until is not None:
+        statement = statement.where(g.date <= until)
+    return MeasurementColumns.from_statement(session, statement, g.plant_id, plant_ids)
@@ -0,0 +1,255 @@
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy import select
+from models_module import NutrientType
+import archive
+import growth_rates
+from timeseries import METRICS, MeasurementColumns, NutrientColumns, compute_growth_rates
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+MIN_CAPACITY = 16
+
+class RecordBuffer:
+    def __init__(self, columns_class, records):
+        self.columns_class = columns_class
+        self._data = np.array(records, dtype=columns_class.dtype)
+        self._size = len(self._data)
+
+    @property
+    def columns(self):
+        return self.columns_class(self._data[:self._size])
+
+    @property
+    def nbytes(self):
+        return self._data.nbytes
+
+    def append(self, record):
+        if self._size == len(self._data):
+            grown = np.empty(max(MIN_CAPACITY, 2 * len(self._data)), dtype=self._data.dtype)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+
+        # New rows normally arrive in date order; a backdated row is slotted
+        # in after any rows from the same day to keep (day, id) ordering.
+        days = self._data['day'][:self._size]
+        position = self._size
+        if self._size and record[1] < days[-1]:
+            position = int(np.searchsorted(days, record[1], side='right'))
+            self._data[position + 1:self._size + 1] = self._data[position:self._size]
+        self._data[position] = record
+        self._size += 1
+        return position
+
+    def assign(self, rows, name, values):
+        self._data[name][:self._size][rows] = values
+
+class PlantHistory:
+    def __init__(self, plant_id, name, strain, measurements, nutrients, nutrient_type_names, growth_rates=None):
+        self.plant_id = plant_id
+        self.name = name
+        self.strain = strain
+        self.nutrient_type_names = nutrient_type_names
+        self._measurements = RecordBuffer(MeasurementColumns, measurements)
+        self._nutrients = RecordBuffer(NutrientColumns, nutrients)
+        # Rows line up with the measurements and hold each metric's rate in
+        # its own field; computed on first use when not read from the table.
+        self._growth_rates = None if growth_rates is None else RecordBuffer(MeasurementColumns, growth_rates)
+
+    def __repr__(self):
+        return f"<PlantHistory(plant_id='{self.plant_id}', name='{self.name}', measurements='{len(self.measurements)}', nutrients='{len(self.nutrients)}')>"
+
+    @property
+    def measurements(self):
+        return self._measurements.columns
+
+    @property
+    def nutrients(self):
+        return self._nutrients.columns
+
+    @property
+    def nbytes(self):
+        rates = 0 if self._growth_rates is None else self._growth_rates.nbytes
+        return self._measurements.nbytes + self._nutrients.nbytes + rates
+
+    def growth_rates(self):
+        if self._growth_rates is None:
+            measurements = self.measurements
+            records = np.empty(len(measurements), dtype=MeasurementColumns.dtype)
+            records['plant_id'] = measurements.plant_id
+            records['day'] = measurements.day
+            for metric, rates in compute_growth_rates(measurements).items():
+                records[metric] = rates
+            self._growth_rates = RecordBuffer(MeasurementColumns, records)
+        rates = self._growth_rates.columns
+        return {metric: getattr(rates, metric) for metric in METRICS}
+
+    def append_measurement(self, record):
+        position = self._measurements.append(record)
+        if self._growth_rates is None:
+            return
+        # Only the new row and the one after it have a different previous
+        # measurement, so only their rates are recomputed.
+        self._growth_rates.append((record[0], record[1], np.nan, np.nan, np.nan))
+        start = max(position - 1, 0)
+        window = self.measurements.take(slice(start, position + 2))
+        rows = slice(position, start + len(window))
+        for metric, rates in compute_growth_rates(window).items():
+            self._growth_rates.assign(rows, metric, rates[position - start:])
+
+    def append_nutrient(self, record):
+        self._nutrients.append(record)
+
+def build_histories(plants, measurements, nutrients, nutrient_type_names, rates=None):
+    measurement_slices = measurements.plant_slices()
+    nutrient_slices = nutrients.plant_slices()
+    empty = slice(0, 0)
+    # Stored rates are only used if they match the measurements row for row;
+    # otherwise they are computed on demand.
+    if rates is not None and (
+        len(rates) != len(measurements)
+        or not np.array_equal(rates.plant_id, measurements.plant_id)
+        or not np.array_equal(rates.day, measurements.day)
+    ):
+        rates = None
+    # Copies, so evicting one plant from the cache actually releases its memory.
+    return [
+        PlantHistory(
+            plant.id,
+            plant.name,
+            plant.strain,
+            measurements.records[measurement_slices.get(plant.id, empty)].copy(),
+            nutrients.records[nutrient_slices.get(plant.id, empty)].copy(),
+            nutrient_type_names,
+            None if rates is None else rates.records[measurement_slices.get(plant.id, empty)].copy(),
+        )
+        for plant in plants
+    ]
+
+class HistoryCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nutrient_type_names = {}
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, plant_id):
+        return plant_id in self._entries
+
+    def __repr__(self):
+        return f"<HistoryCache(entries='{len(self)}', nbytes='{self.nbytes}', hits='{self.hits}', misses='{self.misses}', evictions='{self.evictions}')>"
+
+    def stats(self):
+        return {
+            'entries': len(self),
+            'nbytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def get_many(self, session, plants):
+        histories = {}
+        missing = []
+        for plant in plants:
+            history = self._entries.get(plant.id)
+            if history is None:
+                missing.append(plant)
+            else:
+                self._entries.move_to_end(plant.id)
+                histories[plant.id] = history
+        self.hits += len(histories)
+        self.misses += len(missing)
+
+        if missing:
+            for history in self._load(session, missing):
+                histories[history.plant_id] = history
+                self._store(history)
+            self._evict()
+        return [histories[plant.id] for plant in plants]
+
+    def _load(self, session, plants):
+        plant_ids = [plant.id for plant in plants]
+        measurements = MeasurementColumns.load(session, plant_ids)
+        nutrients = NutrientColumns.load(session, plant_ids)
+        self.refresh_nutrient_type_names(session, nutrients.nutrient_type_id)
+        archived = archive.load_archived(session, plant_ids)
+
+        live = [plant for plant in plants if plant.id not in archived]
+        histories = []
+        if live:
+            rates = growth_rates.load_columns(session, [plant.id for plant in live])
+            live_measurements, live_nutrients = measurements, nutrients
+            if archived:
+                live_measurements = measurements.take(~np.isin(measurements.plant_id, list(archived)))
+                live_nutrients = nutrients.take(~np.isin(nutrients.plant_id, list(archived)))
+            histories.extend(build_histories(live, live_measurements, live_nutrients, self.nutrient_type_names, rates))
+
+        # Archived plants are read from their snapshot files plus anything
+        # recorded for them since; their growth rates are computed on first
+        # use, as the stored ones only cover the live rows.
+        measurement_slices = measurements.plant_slices()
+        nutrient_slices = nutrients.plant_slices()
+        empty = slice(0, 0)
+        for plant in plants:
+            if plant.id in archived:
+                snapshot_measurements, snapshot_nutrients, names = archived[plant.id]
+                for type_id, name in names.items():
+                    self.nutrient_type_names.setdefault(type_id, name)
+                histories.extend(build_histories(
+                    [plant],
+                    archive.merge_columns(measurements.take(measurement_slices.get(plant.id, empty)), [snapshot_measurements]),
+                    archive.merge_columns(nutrients.take(nutrient_slices.get(plant.id, empty)), [snapshot_nutrients]),
+                    self.nutrient_type_names,
+                ))
+        return histories
+
+    def refresh_nutrient_type_names(self, session, nutrient_type_ids):
+        if any(int(type_id) not in self.nutrient_type_names for type_id in np.unique(nutrient_type_ids)):
+            rows = session.execute(select(NutrientType.id, NutrientType.name))
+            self.nutrient_type_names.update((type_id, name) for type_id, name in rows)
+
+    def _store(self, history):
+        previous = self._entries.pop(history.plant_id, None)
+        if previous is not None:
+            self.nbytes -= previous.nbytes
+        self._entries[history.plant_id] = history
+        self.nbytes += history.nbytes
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and self._entries:
+            _, history = self._entries.popitem(last=False)
+            self.nbytes -= history.nbytes
+            self.evictions += 1
+
+    def append_measurement(self, plant_id, date, height, leaf_count, stem_diameter):
+        self._append(plant_id, 'append_measurement', (plant_id, date.toordinal(), height, leaf_count, stem_diameter))
+
+    def append_nutrient(self, plant_id, nutrient_type_id, nutrient_type_name, date, amount):
+        self.nutrient_type_names[nutrient_type_id] = nutrient_type_name
+        self._append(plant_id, 'append_nutrient', (plant_id, date.toordinal(), nutrient_type_id, amount))
+
+    def _append(self, plant_id, method, record):
+        history = self._entries.get(plant_id)
+        if history is not None:
+            self.nbytes -= history.nbytes
+            getattr(history, method)(record)
+            self.nbytes += history.nbytes
+            self._evict()
+
+    def invalidate(self, plant_ids=None):
+        if plant_ids is None:
+            self._entries.clear()
+            self.nbytes = 0
+            return
+        for plant_id in plant_ids:
+            history = self._entries.pop(plant_id, None)
+            if history is not None:
+                self.nbytes -= history.nbytes
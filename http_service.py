@@ -0,0 +1,316 @@
+import hashlib
+import heapq
+import json
+import math
+import re
+import threading
+import traceback
+from datetime import date
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from operator import itemgetter
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+import archive
+from models_module import Plant
+from rollups import GRANULARITIES
+from timeseries import METRICS, ordinals_to_dates
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+
+PLANT_PATH = re.compile(r'^/plants/(\d+)/(measurements|nutrients|comments|growth-rates)$')
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class ResponseCache:
+    # Encoded GET responses keyed by plant (None for plant-independent
+    # pages) and request target, so a write only drops the entries of the
+    # plants it touched.
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, plant_id, target):
+        with self._lock:
+            entry = self._entries.get(plant_id, {}).get(target)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def put(self, plant_id, target, body, generation):
+        # A response built from data read before a write landed is served
+        # but not stored, or it would outlive the invalidation.
+        entry = (f'"{hashlib.sha1(body).hexdigest()}"', body)
+        with self._lock:
+            if generation == self.generation:
+                self._entries.setdefault(plant_id, {})[target] = entry
+        return entry
+
+    def invalidate(self, plant_ids=None):
+        with self._lock:
+            self.generation += 1
+            if plant_ids is None:
+                self._entries.clear()
+                return
+            for plant_id in plant_ids:
+                self._entries.pop(plant_id, None)
+
+def _parse_date(query, name):
+    value = query.get(name)
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(value[-1])
+    except ValueError:
+        raise RequestError(HTTPStatus.BAD_REQUEST, f"Invalid {name} date '{value[-1]}', expected YYYY-MM-DD.")
+
+def _day_range(query, days):
+    since = _parse_date(query, 'since')
+    until = _parse_date(query, 'until')
+    start = 0 if since is None else int(np.searchsorted(days, since.toordinal(), side='left'))
+    end = len(days) if until is None else int(np.searchsorted(days, until.toordinal(), side='right'))
+    return slice(start, end)
+
+def _floats(values):
+    return [None if math.isnan(value) else value for value in values.tolist()]
+
+def _dates(days):
+    return ordinals_to_dates(days).astype(str).tolist()
+
+def _plant_ids(rows):
+    plant_ids = set()
+    for row in rows:
+        try:
+            plant_ids.add(int(row['plant_id']))
+        except (KeyError, TypeError, ValueError):
+            # The row will be rejected anyway; drop everything to be safe.
+            return None
+    return plant_ids
+
+class PlantService:
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.responses = ResponseCache()
+        # The history cache is not thread-safe, so every call that can read
+        # or invalidate it is made under this lock.
+        self.history_lock = threading.Lock()
+
+    def get(self, path, query):
+        if path == '/plants':
+            return None, self.list_plants()
+        match = PLANT_PATH.match(path)
+        if match is None:
+            raise RequestError(HTTPStatus.NOT_FOUND, f"No such resource: {path}")
+
+        plant_id, resource = int(match.group(1)), match.group(2)
+        if resource == 'comments':
+            return plant_id, self.comments(plant_id, query)
+        history = self._history(plant_id, query)
+        if resource == 'measurements':
+            return plant_id, self.measurements(history, query)
+        if resource == 'nutrients':
+            return plant_id, self.nutrients(history, query)
+        return plant_id, self.growth_rates(history, query)
+
+    def post(self, path, payload):
+        rows = payload if isinstance(payload, list) else [payload]
+        if not all(isinstance(row, dict) for row in rows):
+            raise RequestError(HTTPStatus.BAD_REQUEST, "Expected a JSON object or a list of objects.")
+
+        if path == '/plants':
+            return self.add_plants(rows)
+        add_bulk = {
+            '/measurements': self.db_manager.add_measurements_bulk,
+            '/nutrients': self.db_manager.add_nutrients_bulk,
+            '/comments': self.db_manager.add_comments_bulk,
+        }.get(path)
+        if add_bulk is None:
+            raise RequestError(HTTPStatus.NOT_FOUND, f"No such resource: {path}")
+
+        # Batches commit as they go, so the cache is dropped even if a later
+        # one fails.
+        try:
+            with self.history_lock, self.db_manager.create_session() as session:
+                result = add_bulk(session, rows)
+        finally:
+            self.responses.invalidate(_plant_ids(rows))
+        return {
+            'inserted': result.inserted,
+            'errors': [{'index': index, 'message': message} for index, _, message in result.errors],
+        }
+
+    def add_plants(self, rows):
+        # Every row is checked before any is written, and all of them go in
+        # one transaction.
+        for index, row in enumerate(rows):
+            if not row.get('name') or not row.get('strain'):
+                raise RequestError(HTTPStatus.BAD_REQUEST, f"Plant {index} needs a name and a strain.")
+        try:
+            with self.db_manager.create_session() as session:
+                added = self.db_manager.add_plants(session, [(str(row['name']), str(row['strain'])) for row in rows])
+                plants = [{'id': plant.id, 'name': plant.name, 'strain': plant.strain} for plant in added]
+        finally:
+            self.responses.invalidate([None])
+        return {'inserted': len(plants), 'plants': plants}
+
+    def list_plants(self):
+        with self.db_manager.create_session() as session:
+            return [
+                {'id': plant.id, 'name': plant.name, 'strain': plant.strain}
+                for plant in self.db_manager.iter_plants(session)
+            ]
+
+    def _history(self, plant_id, query):
+        granularity = query.get('granularity', [None])[-1]
+        if granularity is not None and granularity not in GRANULARITIES:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"Invalid granularity '{granularity}', expected one of {', '.join(GRANULARITIES)}.")
+        with self.history_lock, self.db_manager.create_session() as session:
+            plant = session.get(Plant, plant_id)
+            if plant is None:
+                raise RequestError(HTTPStatus.NOT_FOUND, f"No plant with id {plant_id}")
+            return self.db_manager.get_plant_histories(session, [plant], granularity=granularity)[0]
+
+    def measurements(self, history, query):
+        columns = history.measurements
+        rows = _day_range(query, columns.day)
+        series = {'plant_id': history.plant_id, 'date': _dates(columns.day[rows])}
+        for metric in METRICS:
+            series[metric] = _floats(getattr(columns, metric)[rows])
+        return series
+
+    def nutrients(self, history, query):
+        columns = history.nutrients
+        rows = _day_range(query, columns.day)
+        return {
+            'plant_id': history.plant_id,
+            'date': _dates(columns.day[rows]),
+            'nutrient_type': [history.nutrient_type_names[type_id] for type_id in columns.nutrient_type_id[rows].tolist()],
+            'amount': _floats(columns.amount[rows]),
+        }
+
+    def growth_rates(self, history, query):
+        columns = history.measurements
+        rows = _day_range(query, columns.day)
+        rates = history.growth_rates()
+        series = {'plant_id': history.plant_id, 'date': _dates(columns.day[rows])}
+        for metric in METRICS:
+            series[metric] = _floats(rates[metric][rows])
+        return series
+
+    def comments(self, plant_id, query):
+        since, until = _parse_date(query, 'since'), _parse_date(query, 'until')
+        with self.db_manager.create_session() as session:
+            if session.get(Plant, plant_id) is None:
+                raise RequestError(HTTPStatus.NOT_FOUND, f"No plant with id {plant_id}")
+            rows = ((comment.date, comment.content, comment.id) for comment in self.db_manager.iter_comments(session, plant_id, since, until))
+            # An archived plant's comments are read back from its snapshot,
+            # ahead of any added since on the same day.
+            path = archive.archived_paths(session, [plant_id]).get(plant_id)
+            if path is not None:
+                snapshot = archive.load_snapshot(path)
+                rows = heapq.merge(archive.snapshot_rows(snapshot, 'comment', ('content', 'id'), since, until), rows, key=itemgetter(0))
+            return [{'id': comment_id, 'date': day.isoformat(), 'content': content} for day, content, comment_id in rows]
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out as separate writes; with Nagle's algorithm on,
+    # keep-alive clients wait on a delayed ACK for every response.
+    disable_nagle_algorithm = True
+    service = None
+
+    def do_GET(self):
+        target = urlsplit(self.path)
+        try:
+            entry = self._cached(target)
+        except RequestError as e:
+            self._send_json(e.status, {'error': str(e)})
+            return
+        except Exception as e:
+            self._send_error(e)
+            return
+
+        etag, body = entry
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self._send_body(HTTPStatus.OK, body, etag)
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                payload = json.loads(self.rfile.read(length) or b'null')
+            except ValueError:
+                raise RequestError(HTTPStatus.BAD_REQUEST, "Request body is not valid JSON.")
+            result = self.service.post(urlsplit(self.path).path, payload)
+        except RequestError as e:
+            self._send_json(e.status, {'error': str(e)})
+            return
+        except Exception as e:
+            self._send_error(e)
+            return
+        status = HTTPStatus.BAD_REQUEST if result.get('errors') and not result['inserted'] else HTTPStatus.CREATED
+        self._send_json(status, result)
+
+    def _cached(self, target):
+        match = PLANT_PATH.match(target.path)
+        plant_id = int(match.group(1)) if match else None
+        key = f"{target.path}?{target.query}"
+        responses = self.service.responses
+        generation = responses.generation
+        entry = responses.get(plant_id, key)
+        if entry is None:
+            plant_id, data = self.service.get(target.path, parse_qs(target.query))
+            body = json.dumps(data, separators=(',', ':')).encode()
+            entry = responses.put(plant_id, key, body, generation)
+        return entry
+
+    def _send_error(self, error):
+        # Database errors such as "database is locked" get a response
+        # instead of a dropped connection; the traceback goes to the console.
+        traceback.print_exc()
+        self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {'error': f"{type(error).__name__}: {error}"})
+
+    def _send_json(self, status, data):
+        self._send_body(status, json.dumps(data, separators=(',', ':')).encode())
+
+    def _send_body(self, status, body, etag=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def create_server(db_manager, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    handler = type('PlantRequestHandler', (RequestHandler,), {'service': PlantService(db_manager)})
+    return ThreadingHTTPServer((host, port), handler)
+
+def serve(db_manager, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    server = create_server(db_manager, host, port)
+    print(f"Serving plant data on http://{host}:{server.server_port} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,290 @@
+import builtins
+import contextlib
+import functools
+import logging
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import event
+
+from models_module import Base
+
+DEFAULT_SLOW_MS = 200.0
+# A SELECT run this many times inside one operation is reported as a
+# likely N+1 pattern: a query per row that a join or IN query would avoid.
+N_PLUS_ONE_MIN = 10
+NO_OPERATION = '(outside any operation)'
+
+# Collapses IN lists and VALUES tuples, so the same query with a different
+# number of parameters is counted as one statement.
+PARAMETER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+VALUES_LIST = re.compile(r'(\([?,\s]*\))(?:\s*,\s*\([?,\s]*\))+')
+WHITESPACE = re.compile(r'\s+')
+LIMIT_CLAUSE = re.compile(r'LIMIT \?( OFFSET \?)?$')
+
+slow_log = logging.getLogger('botanylog.slow')
+
+def _is_page(statement, parameters):
+    # Paged reads (iter_* with LIMIT > 1) repeat one SELECT by design;
+    # a LIMIT 1 lookup in a loop is still an N+1.
+    match = LIMIT_CLAUSE.search(statement)
+    if match is None or not isinstance(parameters, (list, tuple)) or not parameters:
+        return False
+    limit = parameters[-2 if match.group(1) else -1]
+    return isinstance(limit, int) and limit > 1
+
+def normalize_statement(statement):
+    statement = WHITESPACE.sub(' ', statement).strip()
+    statement = VALUES_LIST.sub(r'\1, ...', statement)
+    return PARAMETER_LIST.sub('?, ...', statement)
+
+class TimingStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+class OperationStats(TimingStats):
+    def __init__(self):
+        super().__init__()
+        self.sql_time = 0.0
+        self.statements = 0
+        self.objects = 0
+
+class Frame:
+    # One running operation. SQL time, statement and object counts are
+    # charged to every enclosing frame, so a menu action includes the plots
+    # it draws.
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.sql_time = 0.0
+        self.statement_count = 0
+        # Per statement, for the N+1 check; only the innermost frame counts.
+        self.statements = Counter()
+        self.objects = 0
+        self.input_wait = 0.0
+
+class Profiler:
+    def __init__(self, slow_ms=DEFAULT_SLOW_MS, slow_log_path=None):
+        self.slow_seconds = slow_ms / 1000
+        self.operations = {}
+        self.statements = {}
+        self.n_plus_one = {}
+        self._engines = []
+        self._patches = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._input = None
+        self._log_handler = None
+        if slow_log_path is not None:
+            self._log_handler = logging.FileHandler(slow_log_path)
+            self._log_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            slow_log.addHandler(self._log_handler)
+            slow_log.setLevel(logging.INFO)
+            slow_log.propagate = False
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def attach(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+        self._engines.append(engine)
+
+    def install(self):
+        event.listen(Base, 'load', self._on_load, propagate=True)
+        # Time spent waiting at a menu prompt is not the application's, so
+        # it is left out of the operation that asked.
+        self._input = builtins.input
+        builtins.input = self._timed_input
+
+    def close(self):
+        for engine in self._engines:
+            event.remove(engine, 'before_cursor_execute', self._before_execute)
+            event.remove(engine, 'after_cursor_execute', self._after_execute)
+        self._engines = []
+        if self._input is not None:
+            event.remove(Base, 'load', self._on_load)
+            builtins.input = self._input
+            self._input = None
+        for module, name, original in reversed(self._patches):
+            setattr(module, name, original)
+        self._patches = []
+        if self._log_handler is not None:
+            slow_log.removeHandler(self._log_handler)
+            self._log_handler.close()
+            self._log_handler = None
+
+    def _timed_input(self, *args):
+        started = time.perf_counter()
+        try:
+            return self._input(*args)
+        finally:
+            waited = time.perf_counter() - started
+            for frame in self._stack():
+                frame.input_wait += waited
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        key = normalize_statement(statement)
+        stack = self._stack()
+        for frame in stack:
+            frame.sql_time += elapsed
+            frame.statement_count += 1
+        if stack and not _is_page(key, parameters):
+            stack[-1].statements[key] += 1
+        with self._lock:
+            self.statements.setdefault(key, TimingStats()).add(elapsed)
+        if elapsed >= self.slow_seconds:
+            operation = stack[-1].name if stack else NO_OPERATION
+            slow_log.info("slow query %.1f ms in %s: %s %s", 1000 * elapsed, operation, key, _brief(parameters))
+
+    def _on_load(self, target, context):
+        for frame in self._stack():
+            frame.objects += 1
+
+    @contextlib.contextmanager
+    def operation(self, name):
+        stack = self._stack()
+        frame = Frame(name)
+        stack.append(frame)
+        try:
+            yield frame
+        finally:
+            stack.pop()
+            elapsed = time.perf_counter() - frame.started - frame.input_wait
+            self._record(frame, elapsed)
+
+    def _record(self, frame, elapsed):
+        statements = frame.statement_count
+        with self._lock:
+            stats = self.operations.setdefault(frame.name, OperationStats())
+            stats.add(elapsed)
+            stats.sql_time += frame.sql_time
+            stats.statements += statements
+            stats.objects += frame.objects
+            for statement, count in frame.statements.items():
+                if count >= N_PLUS_ONE_MIN and statement.startswith('SELECT'):
+                    key = (frame.name, statement)
+                    self.n_plus_one[key] = max(self.n_plus_one.get(key, 0), count)
+        if elapsed >= self.slow_seconds:
+            slow_log.info(
+                "slow operation %.1f ms: %s (SQL %.1f ms in %d statements, %d objects loaded, %.1f ms other)",
+                1000 * elapsed, frame.name, 1000 * frame.sql_time, statements, frame.objects,
+                1000 * (elapsed - frame.sql_time),
+            )
+
+    def wrap(self, function, name=None):
+        name = name or f"{function.__module__}.{function.__qualname__}"
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            with self.operation(name):
+                return function(*args, **kwargs)
+        return timed
+
+    def instrument(self, module, names):
+        for name in names:
+            original = getattr(module, name)
+            if getattr(original, '__wrapped__', None) is not None:
+                continue
+            setattr(module, name, self.wrap(original, f"{original.__module__}.{name}"))
+            self._patches.append((module, name, original))
+
+    def summary(self):
+        lines = []
+        with self._lock:
+            operations = sorted(self.operations.items(), key=lambda item: item[1].total, reverse=True)
+            statements = sorted(self.statements.items(), key=lambda item: item[1].total, reverse=True)
+            n_plus_one = sorted(self.n_plus_one.items(), key=lambda item: item[1], reverse=True)
+
+        lines.append("Operations (time excludes waiting for input; SQL is statement execution, row fetching and ORM loading count as the rest):")
+        lines.append(f"  {'calls':>6} {'total ms':>10} {'mean ms':>9} {'max ms':>9} {'SQL ms':>9} {'queries':>8} {'objects':>8}  operation")
+        for name, stats in operations:
+            lines.append(
+                f"  {stats.count:>6} {1000 * stats.total:>10.1f} {1000 * stats.mean:>9.1f} {1000 * stats.max:>9.1f} "
+                f"{1000 * stats.sql_time:>9.1f} {stats.statements:>8} {stats.objects:>8}  {name}"
+            )
+        lines.append("Statements by total time:")
+        lines.append(f"  {'calls':>6} {'total ms':>10} {'mean ms':>9} {'max ms':>9}  statement")
+        for statement, stats in statements[:20]:
+            lines.append(f"  {stats.count:>6} {1000 * stats.total:>10.1f} {1000 * stats.mean:>9.2f} {1000 * stats.max:>9.2f}  {_shorten(statement)}")
+        if n_plus_one:
+            lines.append("Possible N+1 queries (one SELECT repeated within a single operation):")
+            for (operation, statement), count in n_plus_one:
+                lines.append(f"  {count:>6}x in {operation}: {_shorten(statement)}")
+        return "\n".join(lines)
+
+def _brief(parameters, limit=200):
+    text = repr(parameters)
+    return text if len(text) <= limit else text[:limit] + '...'
+
+def _shorten(statement, limit=160):
+    return statement if len(statement) <= limit else statement[:limit] + '...'
+
+active = None
+
+def enable(engine, slow_ms=DEFAULT_SLOW_MS, slow_log_path=None):
+    global active
+    if active is not None:
+        active.close()
+    active = Profiler(slow_ms, slow_log_path)
+    active.install()
+    active.attach(engine)
+    return active
+
+def disable():
+    global active
+    if active is not None:
+        active.close()
+        active = None
+
+def operation(name):
+    # A no-op unless profiling was enabled, so call sites can stay in place.
+    if active is None:
+        return contextlib.nullcontext()
+    return active.operation(name)
+
+PLOT_FUNCTIONS = (
+    'plot_plant_heights',
+    'plot_growth_rates_all_plants',
+    'plot_growth_rates_individual_plant',
+    'plot_nutrient_schedule_all_plants',
+    'plot_nutrient_schedule_individual_plant',
+    'plot_strain_statistics',
+    'calculate_growth_rates',
+    'compute_growth_rates',
+)
+
+def instrument_visualization(module):
+    # data_visualization is imported lazily, so it is patched once it has
+    # been loaded; history_cache computes the growth rates the plots use.
+    if active is None:
+        return module
+    import history_cache
+    active.instrument(module, PLOT_FUNCTIONS)
+    active.instrument(history_cache, ('compute_growth_rates',))
+    return module
+
+def print_summary(file=sys.stderr):
+    if active is not None:
+        print(active.summary(), file=file)
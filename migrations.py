@@ -0,0 +1,83 @@
+from sqlalchemy import text
+
+import comment_search
+import growth_rates
+import rollups
+
+RECORD_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_measurements_plant_id_date ON measurements (plant_id, date)",
+    "CREATE INDEX IF NOT EXISTS ix_nutrients_plant_id_date ON nutrients (plant_id, date)",
+    "CREATE INDEX IF NOT EXISTS ix_nutrients_nutrient_type_id_date ON nutrients (nutrient_type_id, date)",
+    "CREATE INDEX IF NOT EXISTS ix_comments_plant_id_date ON comments (plant_id, date)",
+]
+
+def _autoincrement(table, columns, foreign_keys):
+    # SQLite cannot add AUTOINCREMENT to an existing table, so it is rebuilt.
+    # Copying the rows with their ids seeds sqlite_sequence with the highest.
+    names = ", ".join(['id'] + [column.split()[0] for column in columns])
+    return [
+        f"CREATE TABLE {table}_new (id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, {', '.join(columns + foreign_keys)})",
+        f"INSERT INTO {table}_new ({names}) SELECT {names} FROM {table}",
+        f"DROP TABLE {table}",
+        f"ALTER TABLE {table}_new RENAME TO {table}",
+    ]
+
+MIGRATIONS = [
+    (1, RECORD_INDEXES),
+    # Backfill the daily and weekly rollups from the existing history.
+    (2, rollups.REBUILD_STATEMENTS),
+    # Full-text index over comments, filled from the existing rows.
+    (3, comment_search.CREATE_STATEMENTS + comment_search.REBUILD_STATEMENTS),
+    # plant_statistics and strain_statistics come from the models; they stay
+    # empty until the first 'analyze' run.
+    (4, []),
+    # Per-measurement growth rates, kept current by triggers on measurements.
+    (5, growth_rates.CREATE_STATEMENTS + growth_rates.REBUILD_STATEMENTS),
+    # archived_plants comes from the models; it lists plants whose history
+    # was moved out to snapshot files by archive.py.
+    (6, []),
+    # Record ids are never handed out again once their rows are deleted
+    # (archiving deletes whole histories), so everything keyed on the highest
+    # id seen keeps working. Dropping the tables drops their indexes and
+    # triggers, which are recreated afterwards.
+    (7, _autoincrement(
+        'measurements',
+        ["date DATE NOT NULL", "height FLOAT NOT NULL", "leaf_count INTEGER NOT NULL",
+         "stem_diameter FLOAT NOT NULL", "plant_id INTEGER NOT NULL"],
+        ["FOREIGN KEY(plant_id) REFERENCES plants (id)"],
+    ) + _autoincrement(
+        'nutrients',
+        ["date DATE NOT NULL", "amount FLOAT NOT NULL", "plant_id INTEGER NOT NULL", "nutrient_type_id INTEGER NOT NULL"],
+        ["FOREIGN KEY(plant_id) REFERENCES plants (id)", "FOREIGN KEY(nutrient_type_id) REFERENCES nutrient_types (id)"],
+    ) + _autoincrement(
+        'comments',
+        ["date DATE NOT NULL", "content VARCHAR NOT NULL", "plant_id INTEGER NOT NULL"],
+        ["FOREIGN KEY(plant_id) REFERENCES plants (id)"],
+    ) + RECORD_INDEXES + growth_rates.CREATE_STATEMENTS + comment_search.CREATE_STATEMENTS),
+]
+
+CURRENT_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(connection):
+    connection.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    version = connection.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+    return version or 0
+
+def apply(connection, metadata=None):
+    version = get_schema_version(connection)
+    # Tables only need creating on a new or outdated database; a schema
+    # change always comes with a new migration version.
+    if metadata is not None and version < CURRENT_VERSION:
+        metadata.create_all(connection)
+    for target_version, statements in MIGRATIONS:
+        if target_version <= version:
+            continue
+        for statement in statements:
+            connection.execute(text(statement))
+        connection.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {'version': target_version})
+        version = target_version
+    return version
+
+def upgrade(engine, metadata=None):
+    with engine.begin() as connection:
+        return apply(connection, metadata)
\ No newline at end of file
@@ -1,18 +1,61 @@
-from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey
+from datetime import date
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, Index, PrimaryKeyConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.types import UserDefinedType
 
 Base = declarative_base()
 
+# Julian day number of a date minus its ordinal; date(1, 1, 1) is day 1721426.
+JULIAN_DAY_NUMBER_OFFSET = 1721425
+
+class StoredDate(UserDefinedType):
+    # Stored as ISO text, or as an integer Julian day number when the engine
+    # uses compact storage (see storage.py); SQLite's date functions accept
+    # both. Values are read back in either form.
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return 'DATE'
+
+    @property
+    def python_type(self):
+        return date
+
+    def bind_processor(self, dialect):
+        def process(value):
+            if value is None:
+                return None
+            if getattr(dialect, 'compact_storage', False):
+                return value.toordinal() + JULIAN_DAY_NUMBER_OFFSET
+            return value.isoformat()
+        return process
+
+    def literal_processor(self, dialect):
+        bind = self.bind_processor(dialect)
+        def process(value):
+            value = bind(value)
+            return str(value) if isinstance(value, int) else f"'{value}'"
+        return process
+
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            if value is None:
+                return None
+            if isinstance(value, str):
+                return date.fromisoformat(value)
+            return date.fromordinal(int(value) - JULIAN_DAY_NUMBER_OFFSET)
+        return process
+
 class Plant(Base):
     __tablename__ = 'plants'
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     strain = Column(String, nullable=False)
-    measurements = relationship('Measurement', backref='plant', cascade='all, delete-orphan')
-    nutrients = relationship('Nutrient', backref='plant', cascade='all, delete-orphan')
-    comments = relationship('Comment', backref='plant', cascade='all, delete-orphan')
+    measurements = relationship('Measurement', backref='plant', cascade='all, delete-orphan', order_by='(Measurement.date, Measurement.id)')
+    nutrients = relationship('Nutrient', backref='plant', cascade='all, delete-orphan', order_by='(Nutrient.date, Nutrient.id)')
+    comments = relationship('Comment', backref='plant', cascade='all, delete-orphan', order_by='(Comment.date, Comment.id)')
 
     def __repr__(self):
         return f"<Plant(id='{self.id}', name='{self.name}', strain='{self.strain}')>"
@@ -21,12 +64,17 @@ class Measurement(Base):
     __tablename__ = 'measurements'
 
     id = Column(Integer, primary_key=True)
-    date = Column(Date, nullable=False)
+    date = Column(StoredDate, nullable=False)
     height = Column(Float, nullable=False)
     leaf_count = Column(Integer, nullable=False)
     stem_diameter = Column(Float, nullable=False)
     plant_id = Column(Integer, ForeignKey('plants.id'), nullable=False)
 
+    __table_args__ = (
+        Index('ix_measurements_plant_id_date', 'plant_id', 'date'),
+        {'sqlite_autoincrement': True},
+    )
+
     def __repr__(self):
         return f"<Measurement(id='{self.id}', date='{self.date}', height='{self.height}', leaf_count='{self.leaf_count}', stem_diameter='{self.stem_diameter}')>"
 
@@ -44,12 +92,18 @@ class Nutrient(Base):
     __tablename__ = 'nutrients'
 
     id = Column(Integer, primary_key=True)
-    date = Column(Date, nullable=False)
+    date = Column(StoredDate, nullable=False)
     amount = Column(Float, nullable=False)
     plant_id = Column(Integer, ForeignKey('plants.id'), nullable=False)
     nutrient_type_id = Column(Integer, ForeignKey('nutrient_types.id'), nullable=False)
     nutrient_type = relationship('NutrientType')
 
+    __table_args__ = (
+        Index('ix_nutrients_plant_id_date', 'plant_id', 'date'),
+        Index('ix_nutrients_nutrient_type_id_date', 'nutrient_type_id', 'date'),
+        {'sqlite_autoincrement': True},
+    )
+
     def __repr__(self):
         return f"<Nutrient(id='{self.id}', date='{self.date}', amount='{self.amount}', nutrient_type='{self.nutrient_type.name}')>"
 
@@ -61,5 +115,127 @@ class Comment(Base):
     content = Column(String, nullable=False)
     plant_id = Column(Integer, ForeignKey('plants.id'), nullable=False)
 
+    __table_args__ = (
+        Index('ix_comments_plant_id_date', 'plant_id', 'date'),
+        {'sqlite_autoincrement': True},
+    )
+
+    def __repr__(self):
+        return f"<Comment(id='{self.id}', date='{self.date}', content='{self.content[:20]}...')>"
+
+class MeasurementRollup(Base):
+    __tablename__ = 'measurement_rollups'
+
+    plant_id = Column(Integer, ForeignKey('plants.id'), nullable=False)
+    granularity = Column(String, nullable=False)
+    period_start = Column(Date, nullable=False)
+    count = Column(Integer, nullable=False)
+    height_sum = Column(Float, nullable=False)
+    leaf_count_max = Column(Integer, nullable=False)
+    stem_diameter_sum = Column(Float, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint('plant_id', 'granularity', 'period_start'),
+    )
+
+    def __repr__(self):
+        return f"<MeasurementRollup(plant_id='{self.plant_id}', granularity='{self.granularity}', period_start='{self.period_start}', count='{self.count}')>"
+
+class NutrientRollup(Base):
+    __tablename__ = 'nutrient_rollups'
+
+    plant_id = Column(Integer, ForeignKey('plants.id'), nullable=False)
+    nutrient_type_id = Column(Integer, ForeignKey('nutrient_types.id'), nullable=False)
+    granularity = Column(String, nullable=False)
+    period_start = Column(Date, nullable=False)
+    count = Column(Integer, nullable=False)
+    amount_total = Column(Float, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint('plant_id', 'granularity', 'period_start', 'nutrient_type_id'),
+    )
+
+    def __repr__(self):
+        return f"<NutrientRollup(plant_id='{self.plant_id}', granularity='{self.granularity}', period_start='{self.period_start}', nutrient_type_id='{self.nutrient_type_id}', amount_total='{self.amount_total}')>"
+
+class GrowthRate(Base):
+    __tablename__ = 'growth_rates'
+
+    measurement_id = Column(Integer, ForeignKey('measurements.id'), primary_key=True)
+    plant_id = Column(Integer, ForeignKey('plants.id'), nullable=False)
+    date = Column(StoredDate, nullable=False)
+    height_rate = Column(Float)
+    leaf_count_rate = Column(Float)
+    stem_diameter_rate = Column(Float)
+
+    __table_args__ = (
+        Index('ix_growth_rates_plant_id_date', 'plant_id', 'date'),
+    )
+
+    def __repr__(self):
+        return f"<GrowthRate(measurement_id='{self.measurement_id}', date='{self.date}', height_rate='{self.height_rate}', leaf_count_rate='{self.leaf_count_rate}', stem_diameter_rate='{self.stem_diameter_rate}')>"
+
+class PlantStatistics(Base):
+    __tablename__ = 'plant_statistics'
+
+    plant_id = Column(Integer, ForeignKey('plants.id'), primary_key=True)
+    strain = Column(String, nullable=False)
+    measurement_count = Column(Integer, nullable=False)
+    first_date = Column(Date)
+    last_date = Column(Date)
+    final_height = Column(Float)
+    rolling_height = Column(Float)
+    mean_growth_rate = Column(Float)
+    peak_growth_rate = Column(Float)
+    peak_growth_date = Column(Date)
+    days_to_30cm = Column(Integer)
+    days_to_60cm = Column(Integer)
+    days_to_90cm = Column(Integer)
+    days_to_120cm = Column(Integer)
+    nutrient_total = Column(Float, nullable=False)
+    feeding_count = Column(Integer, nullable=False)
+    nutrient_growth_correlation = Column(Float)
+    computed_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_plant_statistics_strain', 'strain'),
+    )
+
+    def __repr__(self):
+        return f"<PlantStatistics(plant_id='{self.plant_id}', strain='{self.strain}', measurement_count='{self.measurement_count}', mean_growth_rate='{self.mean_growth_rate}')>"
+
+class StrainStatistics(Base):
+    __tablename__ = 'strain_statistics'
+
+    strain = Column(String, primary_key=True)
+    plant_count = Column(Integer, nullable=False)
+    measurement_count = Column(Integer, nullable=False)
+    mean_final_height = Column(Float)
+    mean_growth_rate = Column(Float)
+    mean_peak_growth_rate = Column(Float)
+    median_days_to_30cm = Column(Float)
+    median_days_to_60cm = Column(Float)
+    median_days_to_90cm = Column(Float)
+    median_days_to_120cm = Column(Float)
+    feeding_count = Column(Integer, nullable=False)
+    nutrient_growth_correlation = Column(Float)
+    computed_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<StrainStatistics(strain='{self.strain}', plant_count='{self.plant_count}', mean_growth_rate='{self.mean_growth_rate}')>"
+
+class ArchivedPlant(Base):
+    __tablename__ = 'archived_plants'
+
+    plant_id = Column(Integer, ForeignKey('plants.id'), primary_key=True)
+    path = Column(String, nullable=False)
+    archived_at = Column(DateTime, nullable=False)
+    measurement_count = Column(Integer, nullable=False)
+    nutrient_count = Column(Integer, nullable=False)
+    comment_count = Column(Integer, nullable=False)
+    first_date = Column(Date)
+    last_date = Column(Date)
+    file_bytes = Column(Integer, nullable=False)
+
     def __repr__(self):
-        return f"<Comment(id='{self.id}', date='{self.date}', content='{self.content[:20]}...')>"
\ No newline at end of file
+        return f"<ArchivedPlant(plant_id='{self.plant_id}', path='{self.path}', measurement_count='{self.measurement_count}', last_date='{self.last_date}')>"
\ No newline at end of file
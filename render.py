@@ -0,0 +1,154 @@
+import hashlib
+import json
+import math
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from database_manager import DatabaseManager
+
+MANIFEST_NAME = 'render_manifest.json'
+
+# Chart name -> data_visualization function, for charts covering every plant
+# and for charts drawn once per plant.
+ALL_PLANT_CHARTS = {
+    'heights': 'plot_plant_heights',
+    'growth_rates': 'plot_growth_rates_all_plants',
+    'nutrient_schedule': 'plot_nutrient_schedule_all_plants',
+}
+PLANT_CHARTS = {
+    'growth_rates': 'plot_growth_rates_individual_plant',
+    'nutrient_schedule': 'plot_nutrient_schedule_individual_plant',
+}
+
+_worker = {}
+
+def _init_worker(database_uri):
+    import matplotlib
+    matplotlib.use('Agg')
+    _worker['db_manager'] = DatabaseManager(database_uri)
+
+def _save(fig, path, formats):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    for file_format in formats:
+        fig.savefig(f"{path}.{file_format}", format=file_format)
+
+def _render_job(job):
+    import matplotlib.pyplot as plt
+    import data_visualization
+
+    db_manager = _worker['db_manager']
+    with db_manager.create_session() as session:
+        plants = db_manager.get_plants(session, [plant_id for plant_id, _ in job['targets']])
+        histories = {history.plant_id: history for history in db_manager.get_plant_histories(session, plants)}
+
+    plot = getattr(data_visualization, job['function'])
+    timings = []
+    if job['scope'] == 'all':
+        started = time.perf_counter()
+        fig = plot([histories[plant_id] for plant_id, _ in job['targets']], show=False)
+        _save(fig, job['path'], job['formats'])
+        plt.close(fig)
+        timings.append(time.perf_counter() - started)
+    else:
+        for plant_id, path in job['targets']:
+            started = time.perf_counter()
+            fig = plot(histories[plant_id], show=False)
+            _save(fig, path, job['formats'])
+            plt.close(fig)
+            timings.append(time.perf_counter() - started)
+    return job, timings
+
+def _fingerprint(*parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+def _load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def _save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+def _is_current(manifest, key, fingerprint, path, formats):
+    return manifest.get(key) == fingerprint and all(os.path.exists(f"{path}.{f}") for f in formats)
+
+def plan_jobs(session, db_manager, output_dir, formats, manifest, workers, force=False):
+    fingerprints = db_manager.get_history_fingerprints(session)
+    plants = db_manager.get_plants(session, fingerprints)
+    plant_parts = {plant.id: (plant.name, plant.strain, fingerprints[plant.id]) for plant in plants}
+    chunk_size = max(1, math.ceil(len(plants) / (workers * 4)))
+    formats = list(formats)
+
+    jobs = []
+    skipped = 0
+    all_fingerprint = _fingerprint(sorted(plant_parts.items()))
+    for chart, function in ALL_PLANT_CHARTS.items():
+        path = os.path.join(output_dir, 'all_plants', chart)
+        key = os.path.relpath(path, output_dir)
+        if not force and _is_current(manifest, key, all_fingerprint, path, formats):
+            skipped += 1
+            continue
+        jobs.append({
+            'chart': f"all_plants/{chart}", 'function': function, 'scope': 'all', 'formats': formats,
+            'path': path, 'targets': [(plant.id, None) for plant in plants], 'keys': {key: all_fingerprint},
+        })
+
+    for chart, function in PLANT_CHARTS.items():
+        pending = []
+        for plant in plants:
+            path = os.path.join(output_dir, 'plants', str(plant.id), chart)
+            key = os.path.relpath(path, output_dir)
+            fingerprint = _fingerprint(plant_parts[plant.id])
+            if not force and _is_current(manifest, key, fingerprint, path, formats):
+                skipped += 1
+            else:
+                pending.append((plant.id, path, key, fingerprint))
+
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            jobs.append({
+                'chart': f"plants/{chart}", 'function': function, 'scope': 'plant', 'formats': formats,
+                'targets': [(plant_id, path) for plant_id, path, _, _ in chunk],
+                'keys': {key: fingerprint for _, _, key, fingerprint in chunk},
+            })
+    return jobs, skipped
+
+def render_all(database_uri, output_dir, formats=('png',), workers=None, force=False):
+    # Every worker process needs a non-interactive backend, including ones
+    # started with the spawn method that re-import matplotlib from scratch.
+    os.environ['MPLBACKEND'] = 'Agg'
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    manifest = _load_manifest(output_dir)
+    started = time.perf_counter()
+
+    db_manager = DatabaseManager(database_uri)
+    with db_manager.create_session() as session:
+        jobs, skipped = plan_jobs(session, db_manager, output_dir, formats, manifest, workers, force)
+    db_manager.engine.dispose()
+
+    timings = defaultdict(list)
+    try:
+        if jobs:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(database_uri,)) as pool:
+                futures = [pool.submit(_render_job, job) for job in jobs]
+                for future in as_completed(futures):
+                    job, job_timings = future.result()
+                    timings[job['chart']].extend(job_timings)
+                    manifest.update(job['keys'])
+    finally:
+        _save_manifest(output_dir, manifest)
+
+    rendered = sum(len(values) for values in timings.values())
+    print(f"Rendered {rendered:,} charts ({skipped:,} unchanged, skipped) to {output_dir} in {time.perf_counter() - started:.1f} s using {workers} workers.")
+    for chart, values in sorted(timings.items()):
+        total = sum(values)
+        print(f"  {chart}: {len(values):,} charts, {total:.2f} s total, {1000 * total / len(values):.1f} ms/chart")
+    return timings
@@ -0,0 +1,131 @@
+from datetime import timedelta
+
+from sqlalchemy import select, func, text
+from sqlalchemy.dialects.sqlite import insert
+from models_module import MeasurementRollup, NutrientRollup
+
+GRANULARITIES = ('day', 'week')
+
+# Full recomputation from the raw tables, used for backfills. SQLite's
+# strftime('%w') counts from Sunday, so (w + 6) % 7 is days since Monday.
+WEEK_START = "date(date, '-' || ((CAST(strftime('%w', date) AS INTEGER) + 6) % 7) || ' days')"
+
+REBUILD_STATEMENTS = [
+    "DELETE FROM measurement_rollups",
+    "DELETE FROM nutrient_rollups",
+    """INSERT INTO measurement_rollups (plant_id, granularity, period_start, count, height_sum, leaf_count_max, stem_diameter_sum)
+       SELECT plant_id, 'day', date(date), COUNT(*), SUM(height), MAX(leaf_count), SUM(stem_diameter)
+       FROM measurements GROUP BY plant_id, date""",
+    f"""INSERT INTO measurement_rollups (plant_id, granularity, period_start, count, height_sum, leaf_count_max, stem_diameter_sum)
+        SELECT plant_id, 'week', {WEEK_START} AS week, COUNT(*), SUM(height), MAX(leaf_count), SUM(stem_diameter)
+        FROM measurements GROUP BY plant_id, week""",
+    """INSERT INTO nutrient_rollups (plant_id, nutrient_type_id, granularity, period_start, count, amount_total)
+       SELECT plant_id, nutrient_type_id, 'day', date(date), COUNT(*), SUM(amount)
+       FROM nutrients GROUP BY plant_id, nutrient_type_id, date""",
+    f"""INSERT INTO nutrient_rollups (plant_id, nutrient_type_id, granularity, period_start, count, amount_total)
+        SELECT plant_id, nutrient_type_id, 'week', {WEEK_START} AS week, COUNT(*), SUM(amount)
+        FROM nutrients GROUP BY plant_id, nutrient_type_id, week""",
+]
+
+def period_start(day, granularity):
+    if granularity == 'day':
+        return day
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    raise ValueError(f"Unknown granularity '{granularity}', expected one of {', '.join(GRANULARITIES)}.")
+
+def _upsert(table, keys, updates):
+    statement = insert(table)
+    return statement.on_conflict_do_update(
+        index_elements=[table.c[key] for key in keys],
+        set_={name: update(table.c[name], statement.excluded[name]) for name, update in updates.items()},
+    )
+
+MEASUREMENT_UPSERT = _upsert(
+    MeasurementRollup.__table__,
+    ('plant_id', 'granularity', 'period_start'),
+    {
+        'count': lambda current, new: current + new,
+        'height_sum': lambda current, new: current + new,
+        'leaf_count_max': lambda current, new: func.max(current, new),
+        'stem_diameter_sum': lambda current, new: current + new,
+    },
+)
+
+NUTRIENT_UPSERT = _upsert(
+    NutrientRollup.__table__,
+    ('plant_id', 'granularity', 'period_start', 'nutrient_type_id'),
+    {
+        'count': lambda current, new: current + new,
+        'amount_total': lambda current, new: current + new,
+    },
+)
+
+def add_measurements(session, rows):
+    # Rows are pre-aggregated per (plant, period) so a batch costs one
+    # upsert per touched period rather than one per measurement.
+    totals = {}
+    for row in rows:
+        for granularity in GRANULARITIES:
+            key = (row['plant_id'], granularity, period_start(row['date'], granularity))
+            total = totals.get(key)
+            if total is None:
+                totals[key] = [1, row['height'], row['leaf_count'], row['stem_diameter']]
+            else:
+                total[0] += 1
+                total[1] += row['height']
+                total[2] = max(total[2], row['leaf_count'])
+                total[3] += row['stem_diameter']
+    if totals:
+        session.execute(MEASUREMENT_UPSERT, [
+            {
+                'plant_id': plant_id, 'granularity': granularity, 'period_start': start,
+                'count': count, 'height_sum': height_sum, 'leaf_count_max': leaf_count_max,
+                'stem_diameter_sum': stem_diameter_sum,
+            }
+            for (plant_id, granularity, start), (count, height_sum, leaf_count_max, stem_diameter_sum) in totals.items()
+        ])
+
+def add_nutrients(session, rows):
+    totals = {}
+    for row in rows:
+        for granularity in GRANULARITIES:
+            key = (row['plant_id'], granularity, period_start(row['date'], granularity), row['nutrient_type_id'])
+            total = totals.setdefault(key, [0, 0.0])
+            total[0] += 1
+            total[1] += row['amount']
+    if totals:
+        session.execute(NUTRIENT_UPSERT, [
+            {
+                'plant_id': plant_id, 'granularity': granularity, 'period_start': start,
+                'nutrient_type_id': nutrient_type_id, 'count': count, 'amount_total': amount_total,
+            }
+            for (plant_id, granularity, start, nutrient_type_id), (count, amount_total) in totals.items()
+        ])
+
+def rebuild(session):
+    for statement in REBUILD_STATEMENTS:
+        session.execute(text(statement))
+
+def load_columns(session, granularity, plant_ids=None):
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity '{granularity}', expected one of {', '.join(GRANULARITIES)}.")
+    # Imported here to keep NumPy off the write path.
+    from timeseries import MeasurementColumns, NutrientColumns, day_ordinal
+
+    # Rollup periods come back shaped like raw rows: mean height and stem
+    # diameter, the highest leaf count, and the total ml per nutrient type.
+    m = MeasurementRollup
+    measurements = MeasurementColumns.from_statement(session, (
+        select(m.plant_id, day_ordinal(m.period_start), m.height_sum / m.count, m.leaf_count_max, m.stem_diameter_sum / m.count)
+        .where(m.granularity == granularity)
+        .order_by(m.plant_id, m.period_start)
+    ), m.plant_id, plant_ids)
+
+    n = NutrientRollup
+    nutrients = NutrientColumns.from_statement(session, (
+        select(n.plant_id, day_ordinal(n.period_start), n.nutrient_type_id, n.amount_total)
+        .where(n.granularity == granularity)
+        .order_by(n.plant_id, n.period_start, n.nutrient_type_id)
+    ), n.plant_id, plant_ids)
+    return measurements, nutrients
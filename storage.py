@@ -0,0 +1,148 @@
+import os
+import time
+
+from sqlalchemy import event, text
+
+import growth_rates
+import migrations
+from models_module import Measurement, Nutrient
+
+LAYOUTS = ('standard', 'compact')
+
+# Compact storage rebuilds the two large record tables as WITHOUT ROWID
+# tables clustered on (plant_id, date, id), so a plant's history sits in
+# consecutive pages and is read in order straight from the table, and keeps
+# their dates as integer Julian day numbers (3 bytes instead of 10 of text).
+# Comments keep the standard layout: their search index is keyed on rowids.
+TABLES = {
+    'measurements': (
+        ["height FLOAT NOT NULL", "leaf_count INTEGER NOT NULL", "stem_diameter FLOAT NOT NULL", "plant_id INTEGER NOT NULL"],
+        ["FOREIGN KEY(plant_id) REFERENCES plants (id)"],
+        [],
+    ),
+    'nutrients': (
+        ["amount FLOAT NOT NULL", "plant_id INTEGER NOT NULL", "nutrient_type_id INTEGER NOT NULL"],
+        ["FOREIGN KEY(plant_id) REFERENCES plants (id)", "FOREIGN KEY(nutrient_type_id) REFERENCES nutrient_types (id)"],
+        ["CREATE INDEX IF NOT EXISTS ix_nutrients_nutrient_type_id_date ON nutrients (nutrient_type_id, date)"],
+    ),
+}
+
+JULIAN_DAY_NUMBER = "CAST(julianday(date) + 0.5 AS INTEGER)"
+
+def _rebuild(table, compact):
+    columns, foreign_keys, indexes = TABLES[table]
+    names = ", ".join(['id', 'date'] + [column.split()[0] for column in columns])
+    values = ", ".join(['id', JULIAN_DAY_NUMBER if compact else "date(date)"] + [column.split()[0] for column in columns])
+    if compact:
+        # SQLite only numbers rows of rowid tables, so ids for compact tables
+        # are reserved from record_ids, carrying on from the highest ever used.
+        statements = [
+            "CREATE TABLE IF NOT EXISTS record_ids (name VARCHAR NOT NULL PRIMARY KEY, last_id INTEGER NOT NULL)",
+            f"""INSERT OR REPLACE INTO record_ids (name, last_id) VALUES ('{table}', MAX(
+                    COALESCE((SELECT seq FROM sqlite_sequence WHERE name = '{table}'), 0),
+                    COALESCE((SELECT MAX(id) FROM {table}), 0)))""",
+            f"""CREATE TABLE {table}_new (id INTEGER NOT NULL, date INTEGER NOT NULL, {', '.join(columns)},
+                    PRIMARY KEY (plant_id, date, id), {', '.join(foreign_keys)}) WITHOUT ROWID""",
+            f"INSERT INTO {table}_new ({names}) SELECT {values} FROM {table} ORDER BY plant_id, date, id",
+        ]
+        indexes = [f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{table}_id ON {table} (id)"] + indexes
+    else:
+        statements = [
+            f"""CREATE TABLE {table}_new (id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, date DATE NOT NULL,
+                    {', '.join(columns + foreign_keys)})""",
+            f"INSERT INTO {table}_new ({names}) SELECT {values} FROM {table} ORDER BY id",
+        ]
+    statements += [f"DROP TABLE {table}", f"ALTER TABLE {table}_new RENAME TO {table}"]
+    if not compact:
+        statements += [
+            f"UPDATE sqlite_sequence SET seq = MAX(seq, (SELECT last_id FROM record_ids WHERE name = '{table}')) WHERE name = '{table}'",
+            f"""INSERT INTO sqlite_sequence (name, seq) SELECT name, last_id FROM record_ids
+                WHERE name = '{table}' AND NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = '{table}')""",
+        ]
+    return statements + indexes
+
+# Dropping measurements drops the growth-rate triggers, which are recreated
+# once the stored rates carry dates in the new form.
+COMPACT_STATEMENTS = (
+    _rebuild('measurements', True) + _rebuild('nutrients', True)
+    + [f"UPDATE growth_rates SET date = {JULIAN_DAY_NUMBER}"] + growth_rates.CREATE_STATEMENTS
+)
+STANDARD_STATEMENTS = (
+    _rebuild('measurements', False) + _rebuild('nutrients', False) + migrations.RECORD_INDEXES
+    + ["DROP TABLE record_ids", "UPDATE growth_rates SET date = date(date)"] + growth_rates.CREATE_STATEMENTS
+)
+
+LAYOUT_QUERY = "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'measurements'"
+
+def is_compact(connection):
+    return 'WITHOUT ROWID' in (connection.execute(text(LAYOUT_QUERY)).scalar() or '')
+
+def enabled(dialect):
+    return getattr(dialect, 'compact_storage', False)
+
+def _read_layout(dbapi_connection, dialect):
+    cursor = dbapi_connection.cursor()
+    try:
+        version = cursor.execute("PRAGMA schema_version").fetchone()[0]
+        if version != getattr(dialect, 'storage_schema_version', None):
+            row = cursor.execute(LAYOUT_QUERY).fetchone()
+            dialect.compact_storage = 'WITHOUT ROWID' in ((row and row[0]) or '')
+            dialect.storage_schema_version = version
+    finally:
+        cursor.close()
+
+def watch(engine):
+    # The layout is read from the schema, not passed in, so every process
+    # using the file agrees on it. It is checked on each connection checkout
+    # and only re-read when the schema has changed since, so a process that
+    # was already running when 'storage' converted the file binds dates the
+    # new way from its next checkout on.
+    event.listen(engine, 'checkout', lambda dbapi_connection, connection_record, connection_proxy: _read_layout(dbapi_connection, engine.dialect))
+
+def allocate_ids(connection, table_name, count):
+    # Reserves count consecutive ids and returns the first.
+    last_id = connection.execute(
+        text("UPDATE record_ids SET last_id = last_id + :count WHERE name = :name RETURNING last_id"),
+        {'count': count, 'name': table_name},
+    ).scalar_one()
+    return last_id - count + 1
+
+def assign_ids(session, table, rows):
+    # Rows for a compact table come back as copies with ids reserved in the
+    # current transaction, so a batch retried after a rollback gets new ones.
+    if table.name not in TABLES or not enabled(session.get_bind().dialect):
+        return rows
+    first_id = allocate_ids(session, table.name, len(rows))
+    return [dict(row, id=first_id + offset) for offset, row in enumerate(rows)]
+
+def _assign_id(mapper, connection, target):
+    if target.id is None and enabled(connection.dialect):
+        target.id = allocate_ids(connection, mapper.local_table.name, 1)
+
+for model in (Measurement, Nutrient):
+    event.listen(model, 'before_insert', _assign_id)
+
+def _file_size(engine):
+    # In WAL mode pages only reach the main file at a checkpoint, so one is
+    # run first for the size to reflect the database as it stands.
+    path = engine.url.database
+    with engine.connect() as connection:
+        connection.execution_options(isolation_level='AUTOCOMMIT').execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+    return os.path.getsize(path) if path and os.path.exists(path) else 0
+
+def convert(engine, layout):
+    # Returns (seconds, bytes before, bytes after), or None when the file
+    # already uses the layout. VACUUM afterwards is what releases the space.
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown storage layout '{layout}', expected one of {', '.join(LAYOUTS)}.")
+    compact = layout == 'compact'
+    started = time.perf_counter()
+    before = _file_size(engine)
+    with engine.begin() as connection:
+        if is_compact(connection) == compact:
+            return None
+        for statement in COMPACT_STATEMENTS if compact else STANDARD_STATEMENTS:
+            connection.execute(text(statement))
+    with engine.connect() as connection:
+        connection.execution_options(isolation_level='AUTOCOMMIT').execute(text("VACUUM"))
+    return time.perf_counter() - started, before, _file_size(engine)
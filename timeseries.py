@@ -0,0 +1,179 @@
+import numpy as np
+from sqlalchemy import select, func, cast, Integer
+from connection_profiles import MAX_IN_PARAMETERS
+from models_module import Measurement, Nutrient
+
+METRICS = ('height', 'leaf_count', 'stem_diameter')
+
+# julianday('0001-01-01') is 1721425.5 and date(1, 1, 1).toordinal() is 1.
+JULIAN_DAY_OFFSET = 1721424.5
+UNIX_EPOCH_ORDINAL = 719163
+
+MEASUREMENT_DTYPE = np.dtype([
+    ('plant_id', np.int64),
+    ('day', np.int64),
+    ('height', np.float64),
+    ('leaf_count', np.float64),
+    ('stem_diameter', np.float64),
+])
+
+NUTRIENT_DTYPE = np.dtype([
+    ('plant_id', np.int64),
+    ('day', np.int64),
+    ('nutrient_type_id', np.int64),
+    ('amount', np.float64),
+])
+
+def day_ordinal(column):
+    return cast(func.julianday(column) - JULIAN_DAY_OFFSET, Integer)
+
+def ordinals_to_dates(days):
+    return (np.asarray(days) - UNIX_EPOCH_ORDINAL).astype('datetime64[D]')
+
+def _field(name):
+    return property(lambda self: self.records[name])
+
+class RecordColumns:
+    dtype = None
+    model = None
+    fields = ()
+
+    def __init__(self, records):
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __repr__(self):
+        return f"<{type(self).__name__}(rows='{len(self)}', plants='{len(self.plant_slices())}')>"
+
+    plant_id = _field('plant_id')
+    day = _field('day')
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype=cls.dtype))
+
+    @classmethod
+    def from_rows(cls, rows):
+        return cls(np.fromiter(rows, dtype=cls.dtype))
+
+    @classmethod
+    def load(cls, session, plant_ids=None):
+        model = cls.model
+        columns = [model.plant_id, day_ordinal(model.date)] + [getattr(model, name) for name in cls.fields]
+        statement = select(*columns).order_by(model.plant_id, model.date, model.id)
+        return cls.from_statement(session, statement, model.plant_id, plant_ids)
+
+    @classmethod
+    def from_statement(cls, session, statement, plant_id_column, plant_ids=None):
+        if plant_ids is None:
+            return cls.from_rows(tuple(row) for row in session.execute(statement))
+
+        plant_ids = sorted(plant_ids)
+        chunks = [np.empty(0, dtype=cls.dtype)]
+        for start in range(0, len(plant_ids), MAX_IN_PARAMETERS):
+            chunk = statement.where(plant_id_column.in_(plant_ids[start:start + MAX_IN_PARAMETERS]))
+            chunks.append(cls.from_rows(tuple(row) for row in session.execute(chunk)).records)
+        return cls(np.concatenate(chunks))
+
+    def take(self, rows):
+        return type(self)(self.records[rows])
+
+    @classmethod
+    def concatenate(cls, parts):
+        return cls(np.concatenate([part.records for part in parts] or [np.empty(0, dtype=cls.dtype)]))
+
+    @property
+    def dates(self):
+        return ordinals_to_dates(self.day)
+
+    def plant_slices(self):
+        if not len(self):
+            return {}
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(self.plant_id)) + 1))
+        ends = np.append(starts[1:], len(self))
+        return {int(self.plant_id[start]): slice(int(start), int(end)) for start, end in zip(starts, ends)}
+
+class MeasurementColumns(RecordColumns):
+    dtype = MEASUREMENT_DTYPE
+    model = Measurement
+    fields = METRICS
+
+    height = _field('height')
+    leaf_count = _field('leaf_count')
+    stem_diameter = _field('stem_diameter')
+
+    @classmethod
+    def from_measurements(cls, measurements):
+        return cls.from_rows(
+            (m.plant_id, m.date.toordinal(), m.height, m.leaf_count, m.stem_diameter)
+            for m in measurements
+        )
+
+class NutrientColumns(RecordColumns):
+    dtype = NUTRIENT_DTYPE
+    model = Nutrient
+    fields = ('nutrient_type_id', 'amount')
+
+    nutrient_type_id = _field('nutrient_type_id')
+    amount = _field('amount')
+
+class NutrientPivot:
+    def __init__(self, plant_ids, days, nutrient_type_ids, amounts, recorded):
+        self.plant_ids = plant_ids
+        self.days = days
+        self.nutrient_type_ids = nutrient_type_ids
+        # amounts[plant, day, nutrient_type] holds the total ml applied;
+        # recorded[plant, day] marks the days a plant received anything.
+        self.amounts = amounts
+        self.recorded = recorded
+
+    def __repr__(self):
+        return f"<NutrientPivot(plants='{len(self.plant_ids)}', days='{len(self.days)}', nutrient_types='{len(self.nutrient_type_ids)}')>"
+
+    @property
+    def dates(self):
+        return ordinals_to_dates(self.days)
+
+    def plant_index(self, plant_id):
+        index = int(np.searchsorted(self.plant_ids, plant_id))
+        if index == len(self.plant_ids) or self.plant_ids[index] != plant_id:
+            return None
+        return index
+
+def build_nutrient_pivot(columns):
+    plant_ids, plant_index = np.unique(columns.plant_id, return_inverse=True)
+    days, day_index = np.unique(columns.day, return_inverse=True)
+    nutrient_type_ids, type_index = np.unique(columns.nutrient_type_id, return_inverse=True)
+
+    shape = (len(plant_ids), len(days), len(nutrient_type_ids))
+    cells = np.ravel_multi_index((plant_index, day_index, type_index), shape)
+    amounts = np.bincount(cells, weights=columns.amount, minlength=int(np.prod(shape))).reshape(shape)
+    recorded = np.zeros(shape[:2], dtype=bool)
+    recorded[plant_index, day_index] = True
+    return NutrientPivot(plant_ids, days, nutrient_type_ids, amounts, recorded)
+
+def compute_growth_rates(columns, metrics=METRICS):
+    count = len(columns)
+    day_diff = np.zeros(count)
+    day_diff[1:] = np.diff(columns.day)
+    # The first row of every plant has no previous measurement, and two
+    # measurements on the same day have no defined rate; both become NaN so
+    # the output stays aligned with the input rows.
+    valid = day_diff != 0
+    valid[1:] &= columns.plant_id[1:] == columns.plant_id[:-1]
+    if count:
+        valid[0] = False
+
+    rates = {}
+    for metric in metrics:
+        if metric not in METRICS:
+            raise ValueError("Invalid measurement type.")
+        values = getattr(columns, metric)
+        growth = np.zeros(count)
+        growth[1:] = np.diff(values)
+        rate = np.full(count, np.nan)
+        np.divide(growth, day_diff, out=rate, where=valid)
+        rates[metric] = rate
+    return rates
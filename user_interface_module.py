@@ -1,8 +1,16 @@
 import argparse
-from datetime import datetime
+import csv
+import json
+import sys
+import time
+from collections import defaultdict
+from datetime import date, datetime
+import comment_search
+import instrumentation
 from database_manager import DatabaseManager
 from models_module import Plant, Measurement, NutrientType, Nutrient, Comment
-from data_visualization import visualization_menu
+from data_import import KINDS, DEFAULT_BATCH_SIZE, NameLookup, import_fields, import_file, import_stream
+from rollups import GRANULARITIES
 from utility_module import (
     convert_date_string,
     validate_height,
@@ -61,6 +69,15 @@ def get_comment(plant):
     content = input(f"Enter a comment for {plant.name} (optional): ")
     return content
 
+def get_granularity():
+    while True:
+        granularity = input(f"Enter a summary period ({', '.join(GRANULARITIES)}) or press Enter for every record: ").strip().lower()
+        if granularity == "":
+            return None
+        if granularity in GRANULARITIES:
+            return granularity
+        print("Invalid summary period. Please try again.")
+
 def add_plant(session, db_manager):
     name, strain = get_plant_details()
     plant = db_manager.add_plant(session, name, strain)
@@ -105,35 +122,90 @@ def record_measurements_and_nutrients(session, db_manager):
         db_manager.add_comment(session, plant, date, comment)
         print(f"Comment added for {plant.name} on {format_date(date)}.")
 
-def view_plants(session, db_manager):
-    plants = db_manager.get_all_plants(session)
-    if not plants:
-        print("No plants available.")
+def print_measurement(day, height, leaf_count, stem_diameter):
+    print(
+        f"  {format_date(day)}: Height={format_float(height)} cm, "
+        f"Leaf Count={format_integer(int(leaf_count))}, "
+        f"Stem Diameter={format_float(stem_diameter)} mm"
+    )
+
+def print_nutrient(day, nutrient_type_name, amount):
+    print(f"  {format_date(day)}: {nutrient_type_name} - {format_float(amount)} ml")
+
+def view_plants(session, db_manager, granularity=None, plant_id=None, since=None, until=None):
+    if granularity is not None:
+        view_plant_summaries(session, db_manager, granularity, plant_id, since, until)
         return
 
-    for plant in plants:
+    # Streams every history page by page, so memory stays flat however
+    # many records a plant has.
+    archived = {entry.plant_id: entry for entry in db_manager.get_archived_plants(session)}
+    found = False
+    for plant, measurements, nutrients, comments in db_manager.iter_plant_records(session, plant_id, since, until):
+        found = True
         print(f"\nPlant: {plant.name} ({plant.strain})")
+        if plant.id in archived:
+            print_archived(archived[plant.id], measurements, nutrients, comments, since, until)
+            continue
         print("Measurements:")
-        measurements = db_manager.get_measurements(session, plant)
         for measurement in measurements:
-            print(
-                f"  {format_date(measurement.date)}: Height={format_float(measurement.height)} cm, "
-                f"Leaf Count={format_integer(measurement.leaf_count)}, "
-                f"Stem Diameter={format_float(measurement.stem_diameter)} mm"
-            )
+            print_measurement(measurement.date, measurement.height, measurement.leaf_count, measurement.stem_diameter)
 
         print("Nutrients:")
-        nutrients = db_manager.get_nutrients(session, plant)
         for nutrient in nutrients:
-            print(
-                f"  {format_date(nutrient.date)}: {nutrient.nutrient_type.name} - {format_float(nutrient.amount)} ml"
-            )
+            print_nutrient(nutrient.date, nutrient.nutrient_type.name, nutrient.amount)
 
         print("Comments:")
-        comments = db_manager.get_comments(session, plant)
         for comment in comments:
             print(f"  {format_date(comment.date)}: {comment.content}")
 
+    if not found:
+        print("No plants available.")
+
+def print_archived(entry, measurements, nutrients, comments, since=None, until=None):
+    from archive import merge_records
+    measurements, nutrients, comments = merge_records(entry.path, measurements, nutrients, comments, since, until)
+    print(f"Measurements (archived {format_date(entry.archived_at.date())}):")
+    for row in measurements:
+        print_measurement(*row)
+
+    print("Nutrients:")
+    for row in nutrients:
+        print_nutrient(*row)
+
+    print("Comments:")
+    for day, content in comments:
+        print(f"  {format_date(day)}: {content}")
+
+def view_plant_summaries(session, db_manager, granularity, plant_id=None, since=None, until=None):
+    plants = None if plant_id is None else db_manager.get_plants(session, [plant_id])
+    histories = db_manager.get_plant_histories(session, plants, granularity=granularity)
+    if not histories:
+        print("No plants available.")
+        return
+
+    first = since.toordinal() if since else 1
+    last = until.toordinal() if until else date.max.toordinal()
+    comments = defaultdict(list)
+    for comment in db_manager.iter_comments(session, plant_id, since, until):
+        comments[comment.plant_id].append(comment)
+
+    for history in histories:
+        print(f"\nPlant: {history.name} ({history.strain})")
+        print(f"Measurements ({granularity} averages):")
+        for _, day, height, leaf_count, stem_diameter in history.measurements.records.tolist():
+            if first <= day <= last:
+                print_measurement(date.fromordinal(day), height, leaf_count, stem_diameter)
+
+        print(f"Nutrients ({granularity} totals):")
+        for _, day, nutrient_type_id, amount in history.nutrients.records.tolist():
+            if first <= day <= last:
+                print_nutrient(date.fromordinal(day), history.nutrient_type_names[nutrient_type_id], amount)
+
+        print("Comments:")
+        for comment in comments[history.plant_id]:
+            print(f"  {format_date(comment.date)}: {comment.content}")
+
 def view_nutrient_types(session, db_manager):
     nutrient_types = db_manager.get_all_nutrient_types(session)
     if not nutrient_types:
@@ -143,14 +215,439 @@ def view_nutrient_types(session, db_manager):
     for nutrient_type in nutrient_types:
         print(f"{nutrient_type.name}: {nutrient_type.description}")
 
-def menu_loop():
+def import_files(db_manager, args):
+    for path in args.files:
+        import_file(
+            db_manager,
+            path,
+            file_format=args.format,
+            default_kind=args.kind,
+            batch_size=args.batch_size,
+            checkpoint_path=args.checkpoint if len(args.files) == 1 else None,
+            restart=args.restart,
+        )
+
+def explain_queries(db_manager, args):
+    with db_manager.create_session() as session:
+        for label, sql, steps in db_manager.explain_query_plans(session):
+            print(f"\n{label}:")
+            print("  " + " ".join(sql.split()))
+            for step in steps:
+                print(f"  -> {step}")
+
+def render_charts(db_manager, args):
+    from render import render_all
+    render_all(db_manager.database_uri, args.output, formats=args.format or ["png"], workers=args.workers, force=args.force)
+
+def rebuild_rollups(db_manager, args):
+    with db_manager.create_session() as session:
+        db_manager.rebuild_rollups(session)
+        db_manager.rebuild_growth_rates(session)
+    print("Daily and weekly rollups and growth rates rebuilt.")
+
+EXPORT_FIELDS = (
+    'kind', 'plant_id', 'plant', 'date', 'height', 'leaf_count', 'stem_diameter', 'nutrient_type', 'amount', 'content',
+)
+
+PLOT_CHARTS = ('heights', 'growth-rates', 'nutrient-schedule', 'strains')
+
+def iso_date(value):
+    try:
+        return convert_date_string(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def resolve_plant(session, args, lookup=None):
+    if args.plant_id is not None:
+        return args.plant_id
+    if args.plant is None:
+        return None
+    return (lookup or NameLookup(session)).plant_id({'plant': args.plant})
+
+def add_plants(db_manager, args):
+    if args.stdin:
+        plants = [(row['name'].strip(), row['strain'].strip()) for row in csv.DictReader(sys.stdin) if row.get('name')]
+    elif args.name and args.strain:
+        plants = [(args.name, args.strain)]
+    else:
+        raise ValueError("Give a plant name and strain, or --stdin with 'name' and 'strain' CSV columns")
+
+    with db_manager.create_session() as session:
+        for plant in db_manager.add_plants(session, plants):
+            print(f"Plant '{plant.name}' added with id {plant.id}.")
+
+def add_nutrient_types(db_manager, args):
+    with db_manager.create_session() as session:
+        nutrient_type = db_manager.add_nutrient_type(session, args.name, args.description)
+        print(f"Nutrient type '{nutrient_type.name}' added with id {nutrient_type.id}.")
+
+def record_entries(db_manager, args):
+    if args.stdin:
+        result = import_stream(db_manager, sys.stdin.buffer, args.format, args.kind, args.batch_size)
+    else:
+        if args.plant is None and args.plant_id is None:
+            raise ValueError("Give --plant or --plant-id, or --stdin")
+        base = {
+            'plant': args.plant,
+            'plant_id': args.plant_id,
+            'date': (args.date or datetime.now().date()).isoformat(),
+        }
+        rows = []
+        if any(value is not None for value in (args.height, args.leaf_count, args.stem_diameter)):
+            rows.append(dict(base, kind='measurement', height=args.height, leaf_count=args.leaf_count, stem_diameter=args.stem_diameter))
+        for nutrient in args.nutrient or []:
+            nutrient_type, _, amount = nutrient.rpartition('=')
+            rows.append(dict(base, kind='nutrient', nutrient_type=nutrient_type, amount=amount))
+        if args.comment:
+            rows.append(dict(base, kind='comment', content=args.comment))
+        if not rows:
+            raise ValueError("Nothing to record: give a measurement, --nutrient or --comment")
+        result = import_fields(db_manager, rows)
+
+    print(f"Recorded {result.inserted:,} rows, {result.errors:,} errors.")
+    if result.errors:
+        sys.exit(1)
+
+def view_records(db_manager, args):
+    with db_manager.create_session() as session:
+        view_plants(session, db_manager, args.granularity, resolve_plant(session, args), args.since, args.until)
+
+def export_records(db_manager, args):
+    import archive
+    kinds = args.kind or list(KINDS)
+    output = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+    try:
+        if args.format == 'csv':
+            writer = csv.DictWriter(output, EXPORT_FIELDS, lineterminator='\n')
+            writer.writeheader()
+            write = writer.writerow
+        else:
+            write = lambda row: output.write(json.dumps({key: value for key, value in row.items() if value is not None}) + '\n')
+
+        count = 0
+        with db_manager.create_session() as session:
+            plant_id = resolve_plant(session, args)
+            # Archived plants are exported with their snapshot records, so the
+            # file can be imported into another database without losing them.
+            archived = archive.archived_paths(session)
+            for plant, measurements, nutrients, comments in db_manager.iter_plant_records(session, plant_id, args.since, args.until):
+                base = {'plant_id': plant.id, 'plant': plant.name}
+                if plant.id in archived:
+                    measurements, nutrients, comments = archive.merge_records(archived[plant.id], measurements, nutrients, comments, args.since, args.until)
+                else:
+                    measurements = ((m.date, m.height, m.leaf_count, m.stem_diameter) for m in measurements)
+                    nutrients = ((n.date, n.nutrient_type.name, n.amount) for n in nutrients)
+                    comments = ((c.date, c.content) for c in comments)
+                if 'measurement' in kinds:
+                    for day, height, leaf_count, stem_diameter in measurements:
+                        write(dict(base, kind='measurement', date=day.isoformat(), height=height, leaf_count=leaf_count, stem_diameter=stem_diameter))
+                        count += 1
+                if 'nutrient' in kinds:
+                    for day, nutrient_type, amount in nutrients:
+                        write(dict(base, kind='nutrient', date=day.isoformat(), nutrient_type=nutrient_type, amount=amount))
+                        count += 1
+                if 'comment' in kinds:
+                    for day, content in comments:
+                        write(dict(base, kind='comment', date=day.isoformat(), content=content))
+                        count += 1
+    finally:
+        if args.output:
+            output.close()
+    print(f"Exported {count:,} records.", file=sys.stderr)
+
+def export_columnar(db_manager, args):
+    from columnar_export import export_dataset
+    export_dataset(db_manager, args.output, args.format, args.full)
+
+def show_dashboard(db_manager, args):
+    from dashboard import Dashboard
+    with db_manager.create_session() as session:
+        plant_id = resolve_plant(session, args)
+    Dashboard(db_manager, None if plant_id is None else [plant_id], args.interval).show()
+
+def search_comments(db_manager, args):
+    started = time.perf_counter()
+    with db_manager.create_session() as session:
+        plant_id = resolve_plant(session, args)
+        results = db_manager.search_comments(session, args.query, plant_id, (args.since, args.until), args.limit, args.raw)
+    elapsed = 1000 * (time.perf_counter() - started)
+
+    for result in results:
+        print(f"{format_date(result.date)}  {result.plant_name} (plant {result.plant_id}): {result.snippet}")
+    print(f"{len(results)} comments found in {elapsed:.1f} ms.")
+
+def plot_chart(db_manager, args):
+    if args.output:
+        import matplotlib
+        matplotlib.use('Agg')
+    import data_visualization
+    instrumentation.instrument_visualization(data_visualization)
+
+    if args.chart == 'strains':
+        if args.dataset:
+            raise ValueError("The strains chart is drawn from the database, it cannot be used with --dataset")
+        with db_manager.create_session() as session:
+            strain_statistics = db_manager.get_strain_statistics(session)
+        if not strain_statistics:
+            raise ValueError("No strain statistics yet, run 'analyze' first")
+        fig = data_visualization.plot_strain_statistics(strain_statistics, show=not args.output)
+        if args.output:
+            fig.savefig(args.output)
+            print(f"Saved {args.chart} chart to {args.output}.")
+        return
+
+    if args.dataset:
+        if args.granularity:
+            raise ValueError("--granularity needs the database, it cannot be used with --dataset")
+        from columnar_export import load_histories, load_plants
+        plant_id = args.plant_id
+        if args.plant is not None:
+            matches = [plant['id'] for plant in load_plants(args.dataset) if plant['name'] == args.plant]
+            if len(matches) != 1:
+                raise ValueError(f"Plant '{args.plant}' is unknown or ambiguous in {args.dataset}, use --plant-id")
+            plant_id = matches[0]
+        histories = load_histories(args.dataset, None if plant_id is None else [plant_id])
+    else:
+        with db_manager.create_session() as session:
+            plant_id = resolve_plant(session, args)
+            plants = None if plant_id is None else db_manager.get_plants(session, [plant_id])
+            histories = db_manager.get_plant_histories(session, plants, granularity=args.granularity)
+    if plant_id is not None and not histories:
+        raise ValueError(f"No plant with id {plant_id}")
+
+    show = not args.output
+    if args.chart == 'heights':
+        fig = data_visualization.plot_plant_heights(histories, show=show)
+    elif args.chart == 'growth-rates':
+        if plant_id is None:
+            fig = data_visualization.plot_growth_rates_all_plants(histories, show=show)
+        else:
+            fig = data_visualization.plot_growth_rates_individual_plant(histories[0], show=show)
+    elif plant_id is None:
+        fig = data_visualization.plot_nutrient_schedule_all_plants(histories, show=show)
+    else:
+        fig = data_visualization.plot_nutrient_schedule_individual_plant(histories[0], show=show)
+
+    if args.output:
+        fig.savefig(args.output)
+        print(f"Saved {args.chart} chart to {args.output}.")
+
+def archive_plants(db_manager, args):
+    import archive
+    if args.restore is not None:
+        with db_manager.create_session() as session:
+            measurements, nutrients, comments = archive.restore_plant(session, args.restore)
+        db_manager.history_cache.invalidate([args.restore])
+        print(f"Restored plant {args.restore}: {measurements:,} measurements, {nutrients:,} nutrients, {comments:,} comments.")
+        return
+
+    archived, elapsed = archive.run(db_manager, args.plant_id, args.older_than, args.archive_dir, compact=not args.no_vacuum)
+    for entry in archived:
+        print(
+            f"Plant {entry['plant_id']}: {entry['measurement_count']:,} measurements, {entry['nutrient_count']:,} nutrients, "
+            f"{entry['comment_count']:,} comments -> {entry['path']} ({entry['file_bytes'] / 1024:,.1f} KiB)"
+        )
+    print(f"Archived {len(archived)} plants in {elapsed:.1f} s.")
+
+def convert_storage(db_manager, args):
+    import storage
+    result = storage.convert(db_manager.engine, args.layout)
+    if result is None:
+        print(f"The database already uses {args.layout} storage.")
+        return
+    elapsed, before, after = result
+    print(f"Converted to {args.layout} storage in {elapsed:.1f} s: {before / 2**20:,.1f} MiB -> {after / 2**20:,.1f} MiB.")
+
+def format_optional(value, format_value=format_float, missing="-"):
+    return missing if value is None else format_value(value)
+
+def analyze_plants(db_manager, args):
+    from analytics import HEIGHT_MILESTONES, RESPONSE_DAYS, compute_statistics
+    compute_statistics(db_manager.database_uri, workers=args.workers, strains=args.strain)
+
+    with db_manager.create_session() as session:
+        if args.plants:
+            for row in db_manager.get_plant_statistics(session):
+                if args.strain and row.strain not in args.strain:
+                    continue
+                milestones = ", ".join(
+                    f"{milestone} cm: {format_optional(getattr(row, f'days_to_{milestone}cm'), format_integer)}"
+                    for milestone in HEIGHT_MILESTONES
+                )
+                print(
+                    f"Plant {row.plant_id} ({row.strain}): {row.measurement_count} measurements, "
+                    f"final height {format_optional(row.final_height)} cm, 7-day average {format_optional(row.rolling_height)} cm, "
+                    f"growth {format_optional(row.mean_growth_rate)} cm/day (peak {format_optional(row.peak_growth_rate)}), "
+                    f"days to {milestones}, dose/growth r={format_optional(row.nutrient_growth_correlation)}"
+                )
+        for row in db_manager.get_strain_statistics(session):
+            if args.strain and row.strain not in args.strain:
+                continue
+            milestones = ", ".join(
+                f"{milestone} cm: {format_optional(getattr(row, f'median_days_to_{milestone}cm'))}"
+                for milestone in HEIGHT_MILESTONES
+            )
+            print(
+                f"\nStrain: {row.strain} ({row.plant_count} plants, {row.measurement_count} measurements)\n"
+                f"  Mean final height: {format_optional(row.mean_final_height)} cm\n"
+                f"  Mean growth rate: {format_optional(row.mean_growth_rate)} cm/day, mean 7-day peak {format_optional(row.mean_peak_growth_rate)} cm/day\n"
+                f"  Median days to reach {milestones}\n"
+                f"  Dose vs. following {RESPONSE_DAYS} days' growth: r={format_optional(row.nutrient_growth_correlation)} over {row.feeding_count} feedings"
+            )
+
+def add_plant_arguments(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--plant", help="Plant name")
+    group.add_argument("--plant-id", type=int, help="Plant id, for plants sharing a name")
+
+def add_range_arguments(parser):
+    parser.add_argument("--since", type=iso_date, help="First date to include (YYYY-MM-DD)")
+    parser.add_argument("--until", type=iso_date, help="Last date to include (YYYY-MM-DD)")
+
+def serve_http(db_manager, args):
+    from http_service import serve
+    serve(db_manager, args.host, args.port)
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Plant Tracking Application")
-    parser.add_argument("-d", "--database", help="Path to the database file")
-    args = parser.parse_args()
+    parser.add_argument("-d", "--database", help="Database URI; add ?profile=stock|performance|durable (or set DATABASE_PROFILE) to choose the SQLite connection profile. The default is stock; performance switches the file to WAL with synchronous=NORMAL, which can lose the last committed writes on power loss or an OS crash")
+    parser.add_argument("--profile", action="store_true", help="Time every query, menu action and chart, and print a summary with likely N+1 queries at exit")
+    parser.add_argument("--slow-log", help="Append queries and operations slower than --slow-ms to this file")
+    parser.add_argument("--slow-ms", type=float, default=instrumentation.DEFAULT_SLOW_MS, help=f"Slow operation threshold in milliseconds (default: {instrumentation.DEFAULT_SLOW_MS:g})")
+    subparsers = parser.add_subparsers(dest="command")
 
-    database_uri = args.database if args.database else "sqlite:///plant_tracker.db"
-    db_manager = DatabaseManager(database_uri)
+    import_parser = subparsers.add_parser("import", help="Import measurements, nutrients and comments from CSV or NDJSON files")
+    import_parser.add_argument("files", nargs="+", help="CSV or NDJSON files to import")
+    import_parser.add_argument("--format", choices=("csv", "ndjson"), help="File format (detected from the extension by default)")
+    import_parser.add_argument("--kind", choices=KINDS, help="Record kind for files without a 'kind' column")
+    import_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Records per transaction")
+    import_parser.add_argument("--checkpoint", help="Checkpoint file (defaults to <file>.checkpoint)")
+    import_parser.add_argument("--restart", action="store_true", help="Ignore any existing checkpoint and start from the beginning")
+    import_parser.set_defaults(func=import_files)
+
+    explain_parser = subparsers.add_parser("explain", help="Print SQLite query plans for the most frequent queries")
+    explain_parser.set_defaults(func=explain_queries)
 
+    render_parser = subparsers.add_parser("render", help="Render every chart for every plant to image files without a display")
+    render_parser.add_argument("-o", "--output", default="charts", help="Output directory (default: charts)")
+    render_parser.add_argument("-f", "--format", action="append", choices=("png", "svg"), help="Image format, may be repeated (default: png)")
+    render_parser.add_argument("-w", "--workers", type=int, help="Worker processes (default: one per CPU)")
+    render_parser.add_argument("--force", action="store_true", help="Re-render charts even if their data has not changed")
+    render_parser.set_defaults(func=render_charts)
+
+    rollups_parser = subparsers.add_parser("rebuild-rollups", help="Recompute the daily and weekly rollup and growth-rate tables from the raw records")
+    rollups_parser.set_defaults(func=rebuild_rollups)
+
+    serve_parser = subparsers.add_parser("serve", help="Serve JSON endpoints for ingesting records and reading plant time series")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    serve_parser.add_argument("--port", type=int, default=8080, help="Port to listen on (default: 8080)")
+    serve_parser.set_defaults(func=serve_http)
+
+    add_plant_parser = subparsers.add_parser("add-plant", help="Add one plant, or many from CSV on stdin")
+    add_plant_parser.add_argument("name", nargs="?", help="Plant name")
+    add_plant_parser.add_argument("strain", nargs="?", help="Plant strain")
+    add_plant_parser.add_argument("--stdin", action="store_true", help="Read 'name' and 'strain' CSV columns from stdin")
+    add_plant_parser.set_defaults(func=add_plants)
+
+    nutrient_type_parser = subparsers.add_parser("add-nutrient-type", help="Add a nutrient type")
+    nutrient_type_parser.add_argument("name", help="Nutrient type name")
+    nutrient_type_parser.add_argument("--description", help="Optional description")
+    nutrient_type_parser.set_defaults(func=add_nutrient_types)
+
+    record_parser = subparsers.add_parser("record", help="Record a measurement, nutrients and a comment, or many records from stdin")
+    add_plant_arguments(record_parser)
+    record_parser.add_argument("--date", type=iso_date, help="Record date (default: today)")
+    record_parser.add_argument("--height", help="Plant height (cm)")
+    record_parser.add_argument("--leaf-count", help="Leaf count")
+    record_parser.add_argument("--stem-diameter", help="Stem diameter (mm)")
+    record_parser.add_argument("--nutrient", action="append", metavar="TYPE=AMOUNT", help="Nutrient given, in ml; may be repeated")
+    record_parser.add_argument("--comment", help="Comment text")
+    record_parser.add_argument("--stdin", action="store_true", help="Read records from stdin in the 'import' format instead")
+    record_parser.add_argument("--format", choices=("csv", "ndjson"), default="csv", help="Format of records on stdin (default: csv)")
+    record_parser.add_argument("--kind", choices=KINDS, help="Record kind for stdin records without a 'kind' column")
+    record_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Records per transaction")
+    record_parser.set_defaults(func=record_entries)
+
+    view_parser = subparsers.add_parser("view", help="Print plant measurements, nutrients and comments")
+    add_plant_arguments(view_parser)
+    add_range_arguments(view_parser)
+    view_parser.add_argument("--granularity", choices=GRANULARITIES, help="Show daily or weekly summaries instead of every record")
+    view_parser.set_defaults(func=view_records)
+
+    export_parser = subparsers.add_parser("export", help="Write records as CSV or NDJSON that 'import' and 'record --stdin' accept")
+    add_plant_arguments(export_parser)
+    add_range_arguments(export_parser)
+    export_parser.add_argument("--kind", action="append", choices=KINDS, help="Record kind to export, may be repeated (default: all)")
+    export_parser.add_argument("--format", choices=("csv", "ndjson"), default="csv", help="Output format (default: csv)")
+    export_parser.add_argument("-o", "--output", help="Output file (default: stdout)")
+    export_parser.set_defaults(func=export_records)
+
+    plot_parser = subparsers.add_parser("plot", help="Show a chart, or save it to a file")
+    plot_parser.add_argument("chart", choices=PLOT_CHARTS, help="Chart to draw")
+    add_plant_arguments(plot_parser)
+    plot_parser.add_argument("--granularity", choices=GRANULARITIES, help="Plot daily or weekly summaries instead of every record")
+    plot_parser.add_argument("-o", "--output", help="Image file to save instead of opening a window")
+    plot_parser.add_argument("--dataset", help="Plot from an 'export-dataset' directory instead of the database")
+    plot_parser.set_defaults(func=plot_chart)
+
+    dashboard_parser = subparsers.add_parser("dashboard", help="Keep height and growth-rate charts open and add new measurements as they are recorded")
+    add_plant_arguments(dashboard_parser)
+    dashboard_parser.add_argument("--interval", type=float, default=5.0, help="Seconds between checks for new measurements (default: 5)")
+    dashboard_parser.set_defaults(func=show_dashboard)
+
+    search_parser = subparsers.add_parser("search", help="Full-text search of comments, best matches first")
+    search_parser.add_argument("query", help="Words to find; a trailing * matches prefixes (mildew powd*)")
+    add_plant_arguments(search_parser)
+    add_range_arguments(search_parser)
+    search_parser.add_argument("--limit", type=int, default=comment_search.DEFAULT_LIMIT, help=f"Most results to show (default: {comment_search.DEFAULT_LIMIT})")
+    search_parser.add_argument("--raw", action="store_true", help="Pass the query to SQLite FTS5 unchanged (OR, NEAR, \"phrases\", column filters)")
+    search_parser.set_defaults(func=search_comments)
+
+    analyze_parser = subparsers.add_parser("analyze", help="Compute per-plant and per-strain growth statistics in parallel and print the strain summary")
+    analyze_parser.add_argument("--strain", action="append", help="Only recompute this strain, may be repeated (default: all)")
+    analyze_parser.add_argument("-w", "--workers", type=int, help="Worker processes (default: one per CPU)")
+    analyze_parser.add_argument("--plants", action="store_true", help="Also print the statistics of every plant")
+    analyze_parser.set_defaults(func=analyze_plants)
+
+    dataset_parser = subparsers.add_parser("export-dataset", help="Export records to Parquet or Arrow files partitioned by plant and month")
+    dataset_parser.add_argument("output", help="Dataset directory; later runs only add rows created since the previous one")
+    dataset_parser.add_argument("--format", choices=("parquet", "arrow"), default="parquet", help="File format; arrow files can be memory-mapped without copying (default: parquet)")
+    dataset_parser.add_argument("--full", action="store_true", help="Discard the existing dataset and export every row again")
+    dataset_parser.set_defaults(func=export_columnar)
+
+    archive_parser = subparsers.add_parser("archive", help="Move the history of finished plants into compressed snapshot files and shrink the database")
+    archive_parser.add_argument("--plant-id", type=int, action="append", help="Archive this plant, may be repeated (default: every plant inactive for --older-than days)")
+    archive_parser.add_argument("--older-than", type=int, default=90, help="Days without any record after which a plant counts as finished (default: 90)")
+    archive_parser.add_argument("--archive-dir", help="Directory for the snapshot files (default: <database name>_archive next to the database)")
+    archive_parser.add_argument("--no-vacuum", action="store_true", help="Skip the VACUUM that returns the freed space to the file system")
+    archive_parser.add_argument("--restore", type=int, metavar="PLANT_ID", help="Move an archived plant's history back into the database")
+    archive_parser.set_defaults(func=archive_plants)
+
+    storage_parser = subparsers.add_parser(
+        "storage",
+        help="Switch the measurement and nutrient tables between the standard and the compact on-disk layout",
+        description=(
+            "Switch the measurement and nutrient tables between the standard and the compact on-disk layout. "
+            "The conversion waits for other connections' transactions to finish. Processes that are already "
+            "running (serve, dashboard) pick up the new layout the next time they take a connection from "
+            "their pool; other tools writing to the file directly must be stopped first."
+        ),
+    )
+    storage_parser.add_argument("layout", choices=["standard", "compact"], help="compact clusters each plant's rows together and stores dates as day numbers")
+    storage_parser.set_defaults(func=convert_storage)
+
+    return parser
+
+MENU_OPERATIONS = {
+    "1": "menu: add plant",
+    "2": "menu: add nutrient type",
+    "3": "menu: record measurements and nutrients",
+    "4": "menu: view plants",
+    "5": "menu: view nutrient types",
+    "6": "menu: data visualization",
+}
+
+def menu_loop(db_manager):
     while True:
         print("\nPlant Tracking Menu")
         print("1. Add a new plant")
@@ -163,7 +660,7 @@ def menu_loop():
 
         choice = input("Enter your choice (1-7): ")
 
-        with db_manager.create_session() as session:
+        with db_manager.create_session() as session, instrumentation.operation(MENU_OPERATIONS.get(choice, "menu: other")):
             if choice == "1":
                 add_plant(session, db_manager)
             elif choice == "2":
@@ -171,16 +668,42 @@ def menu_loop():
             elif choice == "3":
                 record_measurements_and_nutrients(session, db_manager)
             elif choice == "4":
-                view_plants(session, db_manager)
+                view_plants(session, db_manager, get_granularity())
             elif choice == "5":
                 view_nutrient_types(session, db_manager)
             elif choice == "6":
-                plants = db_manager.get_all_plants(session)
-                visualization_menu(plants)
+                # matplotlib takes longer to import than everything else
+                # combined, so it is only loaded once a chart is asked for.
+                import data_visualization
+                instrumentation.instrument_visualization(data_visualization)
+                histories = db_manager.get_plant_histories(session, granularity=get_granularity())
+                data_visualization.visualization_menu(histories)
             elif choice == "7":
                 break
             else:
                 print("Invalid choice. Please try again.")
 
+def main():
+    args = build_parser().parse_args()
+
+    database_uri = args.database if args.database else "sqlite:///plant_tracker.db"
+    db_manager = DatabaseManager(database_uri)
+    if args.profile or args.slow_log:
+        instrumentation.enable(db_manager.engine, args.slow_ms, args.slow_log)
+
+    try:
+        if args.command:
+            try:
+                with instrumentation.operation(f"command: {args.command}"):
+                    args.func(db_manager, args)
+            except ValueError as e:
+                sys.exit(f"Error: {e}")
+        else:
+            menu_loop(db_manager)
+    finally:
+        if args.profile:
+            instrumentation.print_summary()
+        instrumentation.disable()
+
 if __name__ == "__main__":
-    menu_loop()
\ No newline at end of file
+    main()
\ No newline at end of file